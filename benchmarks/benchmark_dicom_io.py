@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the DICOM reading parallelism of ormir_mids.utils.io.
+
+A synthetic dataset (10000 slices by default) is written to a temporary folder, or an existing folder can be given
+with --data (e.g. a folder on the network storage that should be tested). The dataset is then loaded with
+load_dicom_with_subfolders using different numbers of reading threads and parsing processes.
+
+Note: on a local disk the files are in the page cache after the first read, so the speedup mainly shows the
+parsing overlap. The reading threads make the biggest difference on high-latency storage such as NFS.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian
+
+from ormir_mids.utils.io import load_dicom_with_subfolders, default_io_threads
+
+
+def write_dataset(root, n_slices, slices_per_series=500, size=128):
+    """ Writes a synthetic MR dataset with n_slices slices, split in series of slices_per_series slices """
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 4000, (size, size), dtype=np.uint16).tobytes()
+    for first_slice in range(0, n_slices, slices_per_series):
+        series_number = first_slice // slices_per_series + 1
+        folder = os.path.join(root, f'series{series_number:03d}')
+        os.makedirs(folder, exist_ok=True)
+        series_uid = generate_uid()
+        for slice_index in range(min(slices_per_series, n_slices - first_slice)):
+            file_meta = FileMetaDataset()
+            file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+            file_meta.MediaStorageSOPInstanceUID = generate_uid()
+            file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            ds = Dataset()
+            ds.file_meta = file_meta
+            ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+            ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+            ds.SeriesInstanceUID = series_uid
+            ds.SeriesNumber = series_number
+            ds.InstanceNumber = slice_index + 1
+            ds.Modality = 'MR'
+            ds.Manufacturer = 'SIEMENS'
+            ds.PatientName = 'Benchmark'
+            ds.ImageType = ['ORIGINAL', 'PRIMARY', 'M', 'ND']
+            ds.ScanningSequence = 'SE'
+            ds.EchoTime = 10.0
+            ds.InPlanePhaseEncodingDirection = 'ROW'
+            ds.ImagePositionPatient = [0, 0, float(slice_index)]
+            ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+            ds.PixelSpacing = [1, 1]
+            ds.SliceThickness = 1
+            ds.Rows = size
+            ds.Columns = size
+            ds.BitsAllocated = 16
+            ds.BitsStored = 12
+            ds.HighBit = 11
+            ds.PixelRepresentation = 0
+            ds.SamplesPerPixel = 1
+            ds.PhotometricInterpretation = 'MONOCHROME2'
+            ds.PixelData = pixels
+            pydicom.dcmwrite(os.path.join(folder, f'IM{slice_index:05d}'), ds, enforce_file_format=True)
+
+
+def time_load(path, num_workers, io_threads):
+    start_time = time.perf_counter()
+    volumes = load_dicom_with_subfolders(path, num_workers=num_workers, io_threads=io_threads)
+    elapsed = time.perf_counter() - start_time
+    n_slices = sum(volume.shape[2] for volume in volumes)
+    return elapsed, n_slices
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parallel DICOM reading')
+    parser.add_argument('--data', type=str, default=None, help='Existing DICOM folder to load')
+    parser.add_argument('--slices', type=int, default=10000, help='Number of synthetic slices (default: 10000)')
+    parser.add_argument('--workers', type=int, default=4, help='Number of parsing processes to test (default: 4)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = args.data
+        if data_path is None:
+            data_path = temp_dir
+            print(f'Writing {args.slices} slices to {data_path}')
+            write_dataset(data_path, args.slices)
+
+        configurations = [
+            ('serial (io_threads=1, num_workers=0)', 0, 1),
+            (f'threads (io_threads={default_io_threads()}, num_workers=0)', 0, None),
+            (f'threads + processes (io_threads={default_io_threads()}, num_workers={args.workers})', args.workers, None),
+        ]
+        reference_time = None
+        for name, num_workers, io_threads in configurations:
+            elapsed, n_slices = time_load(data_path, num_workers, io_threads)
+            if reference_time is None:
+                reference_time = elapsed
+            print(f'{name}: {n_slices} slices in {elapsed:.2f} s '
+                  f'({n_slices / elapsed:.0f} slices/s, speedup {reference_time / elapsed:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
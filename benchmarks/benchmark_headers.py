@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the header compression of ormir_mids.utils.headers.
+
+Synthetic slices are written to memory and parsed back, as they would be when loading a series, and their headers are
+converted with headers_to_dicts (columnar store) and with the previous implementation, which converted every slice to
+a JSON dictionary and compared the dictionaries tag by tag. The time is reported for increasing numbers of slices.
+"""
+import argparse
+import copy
+import io
+import time
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian
+
+from ormir_mids.utils.headers import headers_to_dicts, _get_value_tag
+
+
+def make_slices(n_slices, size=64):
+    """ Creates n_slices parsed DICOM slices of a synthetic MR series """
+    pixels = np.random.default_rng(0).integers(0, 4000, (size, size), dtype=np.uint16).tobytes()
+    series_uid = generate_uid()
+    study_uid = generate_uid()
+    referenced_uid = generate_uid()
+    slices = []
+    for slice_index in range(n_slices):
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+        file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = file_meta
+        ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID = series_uid
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesNumber = 1
+        ds.InstanceNumber = slice_index + 1
+        ds.Modality = 'MR'
+        ds.Manufacturer = 'SIEMENS'
+        ds.ManufacturerModelName = 'Benchmark'
+        ds.PatientName = 'Benchmark^Patient'
+        ds.PatientID = '0001'
+        ds.ImageType = ['ORIGINAL', 'PRIMARY', 'M', 'ND']
+        ds.ScanningSequence = 'SE'
+        ds.SequenceVariant = 'SK'
+        ds.EchoTime = 10.0
+        ds.RepetitionTime = 2000.0
+        ds.FlipAngle = 90
+        ds.MagneticFieldStrength = 3
+        ds.InPlanePhaseEncodingDirection = 'ROW'
+        ds.AcquisitionTime = f'{120000 + slice_index % 60:06d}.000'
+        ds.SliceLocation = float(slice_index)
+        ds.ImagePositionPatient = [0, 0, float(slice_index)]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [1, 1]
+        ds.SliceThickness = 1
+        ds.ReferencedImageSequence = Sequence([Dataset()])
+        ds.ReferencedImageSequence[0].ReferencedSOPInstanceUID = referenced_uid
+        ds.add_new(0x00290010, 'LO', 'SIEMENS CSA HEADER')
+        ds.add_new(0x00291010, 'OB', bytes(2000))
+        ds.Rows = size
+        ds.Columns = size
+        ds.BitsAllocated = 16
+        ds.BitsStored = 12
+        ds.HighBit = 11
+        ds.PixelRepresentation = 0
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.PixelData = pixels
+        buffer = io.BytesIO()
+        pydicom.dcmwrite(buffer, ds, enforce_file_format=True)
+        buffer.seek(0)
+        slices.append(pydicom.dcmread(buffer))
+    return slices
+
+
+def legacy_headers_to_dicts(header_list):
+    """ The previous implementation of headers_to_dicts """
+    json_header_list = []
+    for h in header_list:
+        json_header_list.append({'meta': h.file_meta.to_json_dict(), 'header': h.to_json_dict()})
+
+    compressed_meta = {}
+    compressed_header = {}
+
+    def process_tag(tag, content, index, dest_dictionary):
+        if tag == '7FE00010':
+            dest_dictionary[tag] = {'vr': content['vr'], 'InlineBinary': ''}
+            return
+        if tag not in dest_dictionary:
+            dest_dictionary[tag] = content
+            return
+        existing_content = dest_dictionary[tag]
+        if content == existing_content:
+            return
+        value_tag = _get_value_tag(existing_content)
+        if 'isList' not in existing_content:
+            existing_content['isList'] = True
+            existing_content[value_tag] = [existing_content[value_tag]] * index
+        existing_content[value_tag].append(content[value_tag])
+
+    for i, element in enumerate(json_header_list):
+        for tag, content in element['header'].items():
+            process_tag(tag, content, i, compressed_header)
+        for tag, content in element['meta'].items():
+            process_tag(tag, content, i, compressed_meta)
+
+    return compressed_meta, compressed_header
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the header compression')
+    parser.add_argument('--slices', type=int, nargs='+', default=[100, 500, 1000, 5000],
+                        help='Numbers of slices to test (default: 100 500 1000 5000)')
+    args = parser.parse_args()
+
+    for n_slices in args.slices:
+        slices = make_slices(n_slices)
+        legacy_slices = copy.deepcopy(slices)
+
+        start_time = time.perf_counter()
+        legacy_result = legacy_headers_to_dicts(legacy_slices)
+        legacy_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        result = headers_to_dicts(slices)
+        columnar_time = time.perf_counter() - start_time
+
+        assert result == legacy_result
+        print(f'{n_slices} slices: legacy {legacy_time:.2f} s ({legacy_time / n_slices * 1e3:.2f} ms/slice), '
+              f'columnar {columnar_time:.2f} s ({columnar_time / n_slices * 1e3:.2f} ms/slice), '
+              f'speedup {legacy_time / columnar_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the NIfTI compression modes of ormir_mids.utils.io.save_omids.
+
+By default a synthetic HR-pQCT-like volume is used (int16, a noisy cortical shell and trabecular region on a noisy
+background). A real volume can be given with --input (any file readable by nibabel).
+For every compression mode, the time to save the volume, the throughput and the file size are reported.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from ormir_mids.utils.OMidsMedVolume import OMidsMedVolume
+from ormir_mids.utils.io import save_omids
+
+
+def make_hrpqct_like_volume(shape):
+    """ Creates a synthetic int16 volume that compresses like a typical HR-pQCT scan """
+    rng = np.random.default_rng(0)
+    x, y = np.meshgrid(np.linspace(-1, 1, shape[0]), np.linspace(-1, 1, shape[1]), indexing='ij')
+    radius = np.sqrt(x ** 2 + (1.3 * y) ** 2)
+    slice_template = np.zeros(shape[:2], dtype=np.float32)
+    slice_template[radius < 0.7] = 300  # trabecular bone
+    slice_template[(radius >= 0.6) & (radius < 0.7)] = 1000  # cortical shell
+    volume = np.empty(shape, dtype=np.int16)
+    for z in range(shape[2]):
+        noise = rng.normal(0, 60, shape[:2]).astype(np.float32)
+        volume[:, :, z] = np.clip(slice_template + noise, -1000, 4000).astype(np.int16)
+    return volume
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NIfTI compression modes')
+    parser.add_argument('--input', type=str, default=None, help='NIfTI file to use instead of the synthetic volume')
+    parser.add_argument('--shape', type=int, nargs=3, default=[768, 768, 168],
+                        help='Shape of the synthetic volume (default: 768 768 168)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Number of threads for the parallel compression (default: number of CPUs)')
+    args = parser.parse_args()
+
+    if args.input:
+        nib_img = nib.load(args.input)
+        volume = OMidsMedVolume(np.asanyarray(nib_img.dataobj), nib_img.affine)
+    else:
+        volume = OMidsMedVolume(make_hrpqct_like_volume(tuple(args.shape)), np.eye(4))
+    raw_size = volume.volume.nbytes
+    print(f'Volume: shape {volume.shape}, dtype {volume.volume.dtype}, {raw_size / 1e6:.1f} MB')
+
+    configurations = [
+        ('none', None),
+        ('gzip', 1),
+        ('gzip', 6),
+        ('gzip', 9),
+        ('parallel', 1),
+        ('parallel', 6),
+        ('parallel', 9),
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for compression, level in configurations:
+            extension = '.nii' if compression == 'none' else '.nii.gz'
+            file_name = os.path.join(temp_dir, f'{compression}_{level}{extension}')
+            start_time = time.perf_counter()
+            save_omids(file_name, volume, save_patient_json=False, save_extra_json=False,
+                       compression=compression, compression_level=level, compression_threads=args.threads)
+            elapsed = time.perf_counter() - start_time
+            file_size = os.path.getsize(file_name)
+            print(f'{compression:>8} level {str(level):>4}: {elapsed:6.2f} s, {raw_size / elapsed / 1e6:7.1f} MB/s, '
+                  f'{file_size / 1e6:7.1f} MB (ratio {raw_size / file_size:.2f})')
+            os.remove(file_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,9 @@ Specifically, the MedicalVolumes returned have four additional attributes:
     - meta_header: a dictionary containing the meta DICOM information
 """
 from .utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
-from .utils.io import load_dicom, save_bids, load_dicom_with_subfolders, save_dicom, find_omids, save_omids
+from .utils.io import load_dicom, save_bids, load_dicom_with_subfolders, iter_dicom_with_subfolders, scan_dicom_series, iter_dicom_series, save_dicom, find_omids, save_omids
+from .utils.index import update_index, query
 
-__all__ = ['load_dicom', 'save_bids', 'load_dicom_with_subfolders', 'save_dicom', 'find_omids']
+__all__ = ['load_dicom', 'save_bids', 'load_dicom_with_subfolders', 'iter_dicom_with_subfolders', 'scan_dicom_series', 'iter_dicom_series', 'save_dicom', 'find_omids', 'update_index', 'query']
 
 __version__ = '0.1.3'
\ No newline at end of file
@@ -23,6 +23,7 @@ class TagDefinitionDict(dict):
         dict.__init__(self)
         self.inverse = {}
         self.translator_dict = {}
+        self._lookup = None
 
         if d:
             for k, v in d.items():
@@ -66,18 +67,36 @@ class TagDefinitionDict(dict):
 
         self.__add_item(self.translator_dict, numerical_tag, numerical_to_named_translator)
         self.__add_item(self.translator_dict, named_tag, named_to_numerical_translator)
+        self._lookup = None
 
     def set_translator(self, tag, translator):
         if translator is None:
             def translator(x): return x
 
         self.__add_item(self.translator_dict, tag, translator)
+        self._lookup = None
+
+    def _get_lookup(self):
+        """
+        Returns the lookup tables, compiled when the definitions change: the tuple of named tags of each numerical tag
+        and the translator of each tag.
+        """
+        if self._lookup is None:
+            named_tags = {tag: tuple(named_tag) if isinstance(named_tag, list) else (named_tag,)
+                          for tag, named_tag in self.items()}
+            translators = {tag: translator[0] if isinstance(translator, list) else translator
+                           for tag, translator in self.translator_dict.items()}
+            self._lookup = (named_tags, translators)
+        return self._lookup
+
+    def get_named_tags(self, tag):
+        """
+        Returns the named tags of a numerical tag, in order of definition.
+        """
+        return self._get_lookup()[0][tag]
 
     def get_translator(self, tag):
-        translator = self.translator_dict[tag]
-        if isinstance(translator, list):
-            return translator[0]
-        return translator
+        return self._get_lookup()[1][tag]
 
 
 patient_tags = TagDefinitionDict({
@@ -1,6 +1,7 @@
 import os
 from abc import ABC, abstractmethod
 from ..utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
+from ..utils.index import index_exists, parse_omids_name, query
 
 
 class Converter(ABC):
@@ -65,15 +66,19 @@ class Converter(ABC):
         return file_path
 
     @classmethod
-    def find(cls, path):
-        
-        file_pattern = (cls.get_file_name('') + '.nii.gz').lower()
+    def find(cls, path, refresh=False):
+        """ Finds the files produced by this converter in an ORMIR-MIDS tree. The index of the tree is used if it
+        exists, and updated first if refresh is True (see find_omids). """
+        suffix = cls.get_suffix().lstrip('_')
+        if index_exists(path):
+            return query(path, suffix=suffix, refresh=refresh)
 
         found_files = []
 
         for root, dirs, files in os.walk(path):
             for f in files:
-                if f.lower().endswith(file_pattern):
+                file_suffix = parse_omids_name(f)[2]
+                if file_suffix is not None and file_suffix.lower() == suffix.lower():
                     found_files.append(os.path.join(root, f))
 
         return found_files
@@ -0,0 +1,141 @@
+import time
+
+from .abstract_converter import Converter
+
+
+def _implements_conversion(converter_class):
+    """ Checks if a converter class can convert datasets, or if it is only a node of the tree """
+    return converter_class.convert_dataset.__func__ is not Converter.convert_dataset.__func__
+
+
+class DispatchPlan:
+    """
+    The converter tree, compiled once into flat tables.
+
+    The predicates of the nodes are evaluated top-down, and the children of a node are only tested if the node is
+    compatible, so a vendor or modality node prunes its whole subtree. The converters are returned in the same order as
+    the recursive conversion: all the children first, then the node itself.
+    """
+
+    def __init__(self, root_converter):
+        self.converters = []
+        self.children = []
+        self.converts = []
+        self.multiseries = []
+        self.subtree_size = []
+        self._compile(root_converter)
+
+    def _compile(self, converter_class):
+        index = len(self.converters)
+        self.converters.append(converter_class)
+        self.children.append([])
+        self.converts.append(_implements_conversion(converter_class))
+        self.multiseries.append(converter_class.is_multiseries())
+        self.subtree_size.append(1)
+        for child_converter in converter_class.get_children():
+            child_index = self._compile(child_converter)
+            self.children[index].append(child_index)
+            self.subtree_size[index] += self.subtree_size[child_index]
+        return index
+
+    def iter_converters(self, med_volume, multiseries_part=False, trace=None):
+        """
+        Finds the converters of a volume. This is a generator: the caller should run convert_dataset on each returned
+        converter before asking for the next one, as converters can modify the headers of the volume. The facts
+        computed by the predicates are cached on the volume (see ormir_mids.utils.facts.volume_fact).
+
+        Parameters:
+            med_volume (MedicalVolume): the volume to convert
+            multiseries_part (bool): if True, only the multiseries converters are returned, otherwise only the
+                single series converters
+            trace (list): if not None, a record is appended for each evaluated predicate (see format_trace)
+
+        Returns:
+            generator: the converter classes
+        """
+        yield from self._iter_node(0, med_volume, multiseries_part, trace, 0)
+
+    def find_converters(self, med_volume, trace=None):
+        """
+        Lists the converters that are compatible with a volume, both single series and multiseries, without running
+        any conversion.
+
+        Parameters:
+            med_volume (MedicalVolume): the volume to test
+            trace (list): if not None, a record is appended for each evaluated predicate (see format_trace)
+
+        Returns:
+            list: the converter classes
+        """
+        return list(self._iter_node(0, med_volume, None, trace, 0))
+
+    def _iter_node(self, index, med_volume, multiseries_part, trace, depth):
+        converter_class = self.converters[index]
+        error = None
+        start_time = time.perf_counter()
+        try:
+            compatible = bool(converter_class.is_dataset_compatible(med_volume))
+        except Exception as e:
+            compatible = False
+            error = e
+        if trace is not None:
+            trace.append({
+                'depth': depth,
+                'converter': converter_class.get_name(),
+                'compatible': compatible,
+                'time': time.perf_counter() - start_time,
+                'error': error,
+                'pruned': 0 if compatible else self.subtree_size[index] - 1,
+            })
+
+        if not compatible:
+            return
+
+        for child_index in self.children[index]:
+            yield from self._iter_node(child_index, med_volume, multiseries_part, trace, depth + 1)
+
+        if self.converts[index] and (multiseries_part is None or self.multiseries[index] == multiseries_part):
+            yield converter_class
+
+
+_plans = {}
+
+
+def get_dispatch_plan(root_converter):
+    """
+    Returns the compiled plan of a converter tree. The tree is compiled the first time it is requested.
+
+    Parameters:
+        root_converter (type): the root of the converter tree
+
+    Returns:
+        DispatchPlan: the plan
+    """
+    if root_converter not in _plans:
+        _plans[root_converter] = DispatchPlan(root_converter)
+    return _plans[root_converter]
+
+
+def format_trace(trace):
+    """
+    Formats an explain trace produced by DispatchPlan.iter_converters.
+
+    Parameters:
+        trace (list): the trace
+
+    Returns:
+        list: the lines of text describing the predicates that were evaluated
+    """
+    lines = []
+    for record in trace:
+        if record['error'] is not None:
+            result = f"error ({type(record['error']).__name__}: {record['error']})"
+        elif record['compatible']:
+            result = 'compatible'
+        else:
+            result = 'not compatible'
+        line = f"{'  ' * (record['depth'] + 1)}{record['converter']}: {result} [{record['time'] * 1000:.3f} ms]"
+        if record['pruned']:
+            line += f", {record['pruned']} converters skipped"
+        lines.append(line)
+    return lines
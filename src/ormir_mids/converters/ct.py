@@ -2,7 +2,7 @@ import os
 
 from ..converter_base.abstract_converter import Converter, RootConverter
 from ..utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
-from ..utils.headers import get_raw_tag_value, slice_volume_3d, get_modality
+from ..utils.headers import get_raw_tag_value, get_modality, get_volume_part, tag_fact
 
 
 def _is_ct(med_volume: MedicalVolume):
@@ -42,6 +42,7 @@ def _test_ima_type(med_volume: MedicalVolume, ima_type: int):
     return False
 
 
+@tag_fact('00080008', '00080070')
 def _get_image_indices(med_volume: MedicalVolume):
     """
     Get the indices for magnitude, phase, and reco for the given MedicalVolume.
@@ -106,8 +107,7 @@ class CTConverter(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['ct'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'ct')
 
         med_volume_out.omids_header['XRayEnergy'] = get_raw_tag_value(med_volume, '00180060')[0]
         med_volume_out.omids_header['XRayExposure'] = get_raw_tag_value(med_volume, '00181152')[0]
@@ -135,8 +135,7 @@ class PCCTConverter(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['pcct'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'pcct')
 
         med_volume_out.omids_header['XRayEnergy'] = get_raw_tag_value(med_volume, '00180060')[0]
         med_volume_out.omids_header['XRayExposure'] = get_raw_tag_value(med_volume, '00181152')[0]
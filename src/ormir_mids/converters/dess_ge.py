@@ -3,7 +3,7 @@ import os
 from .GEMR import GEMRConverter
 from ..converter_base.abstract_converter import Converter
 from ..utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
-from ..utils.headers import get_raw_tag_value, slice_volume_3d, get_manufacturer
+from ..utils.headers import get_raw_tag_value, get_manufacturer, get_volume_part, tag_fact
 
 
 def _is_dess_ge(med_volume: MedicalVolume):
@@ -23,6 +23,7 @@ def _is_dess_ge(med_volume: MedicalVolume):
     return False
 
 
+@tag_fact('00180081')
 def _get_image_indices(med_volume: MedicalVolume):
     """
     Get the indices for FID, echo, and combined for the given MedicalVolume.
@@ -93,8 +94,7 @@ class DESSConverterGECombined(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['combined'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'combined')
 
         med_volume_out.omids_header['PulseSequenceType'] = 'DESS'
 
@@ -128,8 +128,7 @@ class DESSConverterGEFid(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['fid'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'fid')
 
         med_volume_out.omids_header['PulseSequenceType'] = 'DESS'
 
@@ -163,8 +162,7 @@ class DESSConverterGEEcho(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['echo'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'echo')
 
         med_volume_out.omids_header['PulseSequenceType'] = 'DESS'
 
@@ -3,13 +3,10 @@ import os
 from .GEMR import GEMRConverter
 from ..converter_base.abstract_converter import Converter
 from ..utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
-from ..utils.headers import get_raw_tag_value, group, slice_volume_3d, get_manufacturer
+from ..utils.headers import get_raw_tag_value, group, get_manufacturer, get_volume_part, tag_fact, \
+    get_raw_scanning_sequence, get_n_echo_times
 import numpy as np
 
-def get_raw_scanning_sequence(med_volume: MedicalVolume):
-    return [v[0] for v in get_raw_tag_value(med_volume, '00180020',
-                                            force_raw=True)]
-
 
 def _is_megre_ge(med_volume: MedicalVolume):
     """
@@ -21,9 +18,7 @@ def _is_megre_ge(med_volume: MedicalVolume):
         bool: True if the MedicalVolume is a MEGRE GE dataset, False otherwise.
     """
     scanning_sequence_list = med_volume.omids_header['ScanningSequence']
-    echo_times_list = med_volume.omids_header['EchoTime']
-    echo_times_unique = set(echo_times_list)
-    n_echo_times = sum(TE > 0. for TE in echo_times_unique)
+    n_echo_times = get_n_echo_times(med_volume)
 
     if n_echo_times > 1 and 'GR' in scanning_sequence_list:
         return True
@@ -32,6 +27,12 @@ def _is_megre_ge(med_volume: MedicalVolume):
 
 
 
+@tag_fact('0043102F')
+def _get_flat_ima_type(med_volume: MedicalVolume):
+    ima_type_list = get_raw_tag_value(med_volume, '0043102F')
+    return [x for xs in ima_type_list for x in xs]
+
+
 def _test_ima_type(med_volume: MedicalVolume, ima_type: int):
     """
     Test if the given MedicalVolume is of the given type.
@@ -42,14 +43,14 @@ def _test_ima_type(med_volume: MedicalVolume, ima_type: int):
     Returns:
         bool: True if the MedicalVolume is of the given type, False otherwise.
     """
-    ima_type_list = get_raw_tag_value(med_volume, '0043102F')
-    flat_ima_type = [x for xs in ima_type_list for x in xs]
+    flat_ima_type = _get_flat_ima_type(med_volume)
 
     if ima_type in flat_ima_type:
         return True
     return False
 
 
+@tag_fact('00180095', '00180084')
 def _water_fat_shift_calc(med_volume: MedicalVolume):
     """
     Calculate water-fat shift in pixels from image header.
@@ -68,6 +69,7 @@ def _water_fat_shift_calc(med_volume: MedicalVolume):
     return water_fat_shift_px
 
 
+@tag_fact('0043102F', '00180020')
 def _get_image_indices(med_volume: MedicalVolume):
     """
     Get the indices for magnitude, phase, and reco for the given MedicalVolume.
@@ -84,8 +86,7 @@ def _get_image_indices(med_volume: MedicalVolume):
                  'imaginary': []
                  }
 
-    ima_type_list = get_raw_tag_value(med_volume, '0043102F')
-    flat_ima_type = [x for xs in ima_type_list for x in xs]
+    flat_ima_type = _get_flat_ima_type(med_volume)
 
     scanning_sequence_list = med_volume.omids_header['ScanningSequence']
     if not isinstance(scanning_sequence_list, list):
@@ -140,7 +141,7 @@ class MeGreConverterGEMagnitude(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['magnitude'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'magnitude')
         med_volume_out.omids_header['PulseSequenceType'] \
             = 'Multi-echo Gradient Echo'
         med_volume_out.omids_header['MagneticFieldStrength'] \
@@ -181,7 +182,7 @@ class MeGreConverterGEPhase(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['phase'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'phase')
         med_volume_out.omids_header['PulseSequenceType'] \
             = 'Multi-echo Gradient Echo'
 
@@ -223,7 +224,7 @@ class MeGreConverterGEReal(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['real'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'real')
         med_volume_out.omids_header['PulseSequenceType'] \
             = 'Multi-echo Gradient Echo'
 
@@ -262,7 +263,7 @@ class MeGreConverterGEImaginary(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['imaginary'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'imaginary')
         med_volume_out.omids_header['PulseSequenceType'] \
             = 'Multi-echo Gradient Echo'
 
@@ -306,8 +307,7 @@ class MeGreConverterGEReconstructedMap(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['reco'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'reco')
         med_volume_out.omids_header['PulseSequenceType'] \
             = 'Multi-echo Gradient Echo'
         return med_volume_out
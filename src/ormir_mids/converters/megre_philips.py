@@ -4,12 +4,10 @@ import numpy as np
 from .PhilipsMR import PhilipsMRConverter
 from ..converter_base.abstract_converter import Converter
 from ..utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
-from ..utils.headers import get_raw_tag_value, group, slice_volume_3d
+from ..utils.headers import get_raw_tag_value, group, get_volume_part, tag_fact, get_raw_scanning_sequence, \
+    get_n_echo_times
 
 
-def get_raw_scanning_sequence(med_volume: MedicalVolume):
-    return [v[0] for v in get_raw_tag_value(med_volume, '00180020', force_raw=True)]
-
 def _is_megre_philips(med_volume: MedicalVolume):
     """
     Check if the given MedicalVolume is a MEGRE Philips dataset.
@@ -21,15 +19,14 @@ def _is_megre_philips(med_volume: MedicalVolume):
     """
 
     scanning_sequence_list = med_volume.omids_header['ScanningSequence']
-    echo_times_list = med_volume.omids_header['EchoTime']
-    echo_times_unique = set(echo_times_list)
-    n_echo_times = sum(TE > 0. for TE in echo_times_unique)
+    n_echo_times = get_n_echo_times(med_volume)
 
     if ('GR' in scanning_sequence_list or 'GRADIENT' in scanning_sequence_list) and n_echo_times > 1:
         return True
 
     return False
 
+@tag_fact('00089208', '00080008', raw_tags=('00180020',))
 def _get_ima_type(med_volume):
     try:
         # this is defined in the newer version of SIEMENS DICOMS and in Philips DICOMs
@@ -75,6 +72,7 @@ def _test_ima_type(med_volume: MedicalVolume, ima_type: str):
     return False
 
 
+@tag_fact('00180095', '00180084')
 def _water_fat_shift_calc(med_volume: MedicalVolume):
     """
     Calculate water-fat shift in pixels from image header.
@@ -93,6 +91,7 @@ def _water_fat_shift_calc(med_volume: MedicalVolume):
     return water_fat_shift_px
 
 
+@tag_fact('00089208', '00080008', raw_tags=('00180020',))
 def _get_image_indices(med_volume: MedicalVolume):
     """
     Get the indices for magnitude, phase, and reco for the given MedicalVolume.
@@ -161,7 +160,7 @@ class MeGreConverterPhilipsMagnitude(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['magnitude'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'magnitude')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
         med_volume_out.omids_header['MagneticFieldStrength'] = get_raw_tag_value(med_volume, '00180087')[0]
 
@@ -198,7 +197,7 @@ class MeGreConverterPhilipsPhase(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['phase'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'phase')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
 
         # TO DO - incorporate code below into function
@@ -238,7 +237,7 @@ class MeGreConverterPhilipsReal(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['real'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'real')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
 
         # TO DO - incorporate code below into function
@@ -274,7 +273,7 @@ class MeGreConverterPhilipsImaginary(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['imaginary'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'imaginary')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
 
         # TO DO - incorporate code below into function
@@ -314,8 +313,7 @@ class MeGreConverterPhilipsReconstructedMap(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['reco'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'reco')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
         return med_volume_out
 
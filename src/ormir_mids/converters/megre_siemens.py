@@ -5,7 +5,7 @@ import numpy as np
 from .SiemensMR import SiemensMRConverter
 from ..converter_base.abstract_converter import Converter
 from ..utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
-from ..utils.headers import get_raw_tag_value, group, slice_volume_3d, get_manufacturer
+from ..utils.headers import get_raw_tag_value, group, get_manufacturer, get_volume_part, tag_fact
 
 
 # TODO: DC-3T - Incorporate changes from offline megre_siemens converter
@@ -25,6 +25,7 @@ def _is_megre_siemens(med_volume: MedicalVolume):
         return True
     return False
 
+@tag_fact('00089208', '00080008')
 def _get_ima_type(med_volume):
     try:
         # this is defined in the newer version of SIEMENS DICOMS and in Philips DICOMs
@@ -66,6 +67,7 @@ def _test_ima_type(med_volume: MedicalVolume, ima_type: int):
     return False
 
 
+@tag_fact('00180095', '00180084', '00189098')
 def _water_fat_shift_calc(med_volume: MedicalVolume):
     """
     Calculate water-fat shift in pixels from image header.
@@ -84,6 +86,7 @@ def _water_fat_shift_calc(med_volume: MedicalVolume):
     return water_fat_shift_px
 
 
+@tag_fact('00089208', '00080008')
 def _get_image_indices(med_volume: MedicalVolume):
     """
     Get the indices for magnitude, phase, and reco for the given MedicalVolume.
@@ -175,7 +178,7 @@ class MeGreConverterSiemensMagnitude(Converter):
         if image_comment.startswith('TE [ms]:'):
             echo_time = float(image_comment[len('TE [ms]:'):])
             med_volume.omids_header['EchoTime'] = echo_time
-        med_volume_out = slice_volume_3d(med_volume, indices['magnitude'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'magnitude')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
         med_volume_out.omids_header['MagneticFieldStrength'] = get_raw_tag_value(med_volume, '00180087')[0]
 
@@ -224,7 +227,7 @@ class MeGreConverterSiemensPhase(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['phase'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'phase')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
 
         # TO DO - incorporate code below into function
@@ -273,7 +276,7 @@ class MeGreConverterSiemensReal(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['real'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'real')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
 
         # TO DO - incorporate code below into function
@@ -319,7 +322,7 @@ class MeGreConverterSiemensImaginary(Converter):
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
         indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['imaginary'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'imaginary')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
 
         # TO DO - incorporate code below into function
@@ -365,8 +368,7 @@ class MeGreConverterSiemensReconstructedMap(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['reco'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'reco')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Gradient Echo'
         return med_volume_out
 
@@ -6,12 +6,9 @@ import numpy as np
 from .PhilipsMR import PhilipsMRConverter
 from ..converter_base.abstract_converter import Converter
 from ..utils.OMidsMedVolume import OMidsMedVolume as MedicalVolume
-from ..utils.headers import get_raw_tag_value, group, slice_volume_3d
+from ..utils.headers import get_raw_tag_value, group, get_volume_part, tag_fact, get_raw_scanning_sequence
 
 
-def get_raw_scanning_sequence(med_volume: MedicalVolume):
-    return [v[0] for v in get_raw_tag_value(med_volume, '00180020', force_raw=True)]
-
 def _is_mese_philips(med_volume: MedicalVolume):
     """
     Check if the given MedicalVolume is a MESE Philips dataset.
@@ -30,6 +27,12 @@ def _is_mese_philips(med_volume: MedicalVolume):
     return False
 
 
+@tag_fact('00089208')
+def _get_flat_ima_type(med_volume: MedicalVolume):
+    ima_type_list = get_raw_tag_value(med_volume, '00089208')
+    return [x for xs in ima_type_list for x in xs]
+
+
 def _test_ima_type(med_volume: MedicalVolume, ima_type: str):
     """
     Test if the given MedicalVolume is of the given type.
@@ -40,14 +43,14 @@ def _test_ima_type(med_volume: MedicalVolume, ima_type: str):
     Returns:
         bool: True if the MedicalVolume is of the given type, False otherwise.
     """
-    ima_type_list = get_raw_tag_value(med_volume, '00089208')
-    flat_ima_type = [x for xs in ima_type_list for x in xs]
+    flat_ima_type = _get_flat_ima_type(med_volume)
 
     if ima_type in flat_ima_type:
         return True
     return False
 
 
+@tag_fact('00089208', raw_tags=('00180020',))
 def _get_image_indices(med_volume: MedicalVolume):
     """
     Get the indices for magnitude, phase, and reco for the given MedicalVolume.
@@ -110,8 +113,7 @@ class MeSeConverterPhilipsMagnitude(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['magnitude'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'magnitude')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Spin Echo'
         med_volume_out = group(med_volume_out, 'EchoTime')
         med_volume_out.omids_header['RefocusingFlipAngle'] = 180.0
@@ -138,8 +140,7 @@ class MeSeConverterPhilipsPhase(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['phase'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'phase')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Spin Echo'
         med_volume_out = group(med_volume_out, 'EchoTime')
 
@@ -175,8 +176,7 @@ class MeSeConverterPhilipsReconstructedMap(Converter):
 
     @classmethod
     def convert_dataset(cls, med_volume: MedicalVolume):
-        indices = _get_image_indices(med_volume)
-        med_volume_out = slice_volume_3d(med_volume, indices['reco'])
+        med_volume_out = get_volume_part(med_volume, _get_image_indices, 'reco')
         med_volume_out.omids_header['PulseSequenceType'] = 'Multi-echo Spin Echo'
         return med_volume_out
 
@@ -3,10 +3,19 @@ import re
 import json
 import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from .converters import RootConverter
-from .utils.headers import concatenate_volumes_3d, group, get_raw_tag_value
-from .utils.io import load_dicom, save_omids, load_dicom_with_subfolders
+from .converter_base.dispatch import get_dispatch_plan, format_trace
+from .utils.headers import MultiseriesAccumulator, group, get_raw_tag_value
+from .utils.facts import clear_volume_facts
+from .utils.io import load_dicom, save_omids, AsyncOmidsWriter, nifti_extension, load_dicom_with_subfolders, iter_dicom_with_subfolders, \
+    scan_dicom_series, load_dicom_series, iter_dicom_series, format_prefetch_statistics
+from .utils.walk import format_walk_statistics
+from .utils.index import index_exists, update_index
+from .utils.manifest import load_manifest, save_manifest, fingerprint_files, make_manifest_entry, is_up_to_date
+from . import __version__
 import pathlib
 
 import argparse
@@ -56,7 +65,8 @@ def parse_list_expression(list_expression):
     return [start + i * step for i in range(n_values)]
 
 
-def convert_dicom_to_ormirmids(input_folder, output_folder, anonymize='anon', recursive=True, session='', series_number=False, save_patient_json=True, save_extra_json=True):
+def convert_dicom_to_ormirmids(input_folder, output_folder, anonymize='anon', recursive=True, session='', series_number=False, save_patient_json=True, save_extra_json=True, workers=1, stream=False, prescan=False, incremental=False, explain=False, io_threads=None, dicom_workers=0, write_threads=0,
+                               compression='gzip', compression_level=None, prefetch=0, prefetch_bytes=None):
     """
     Convert DICOM to ORMIR-MIDS format.
     
@@ -65,6 +75,27 @@ def convert_dicom_to_ormirmids(input_folder, output_folder, anonymize='anon', re
     - output_folder (str): Path to the output folder where results will be saved.
     - anonymize (str): Pseudonym for patient name (default: 'anon').
     - recursive (bool): Whether to recurse into subfolders (default: True).
+    - workers (int): Number of processes used to convert independent series in parallel (default: 1).
+      All the series of a multiseries group are converted by the same process.
+    - stream (bool): Load, convert and save one series at a time instead of loading the whole input first
+      (default: False). The peak memory then depends on the largest series rather than on the whole dataset.
+    - prescan (bool): Read the headers of all the files first, and only decode the pixel data of the series that
+      have a compatible converter (default: False).
+    - incremental (bool): Skip the series that were already converted by a previous run and did not change since
+      (default: False). The conversions are recorded in ormirmids_manifest.json in the output folder. Implies prescan.
+    - explain (bool): Print, for every series, the converter predicates that were evaluated, their result and their
+      duration (default: False).
+    - io_threads (int): Number of threads used to read the DICOM files (default: None, based on the number of CPUs).
+    - dicom_workers (int): Number of processes used to parse the DICOM files of each folder (default: 0, no processes).
+    - write_threads (int): Number of background threads that write the output files while the next series is being
+      converted (default: 0, the files are written synchronously).
+    - compression (str): 'gzip' (.nii.gz, default), 'parallel' (.nii.gz compressed with all the CPUs) or 'none' (.nii).
+    - compression_level (int): zlib compression level, from 1 (fastest) to 9 (smallest) (default: 1).
+    - prefetch (int): Number of folders (or series, with prescan) whose files are read in background threads while
+      the current one is being converted (default: 0, no read-ahead). Useful on network filesystems. The hits,
+      stalls and misses of the read-ahead are printed at the end of the loading.
+    - prefetch_bytes (int): Maximum size in bytes of the files read ahead (default: None, no limit). It can be used
+      instead of, or together with, prefetch.
     """
     
     inputDir = input_folder
@@ -72,18 +103,8 @@ def convert_dicom_to_ormirmids(input_folder, output_folder, anonymize='anon', re
     ANON_NAME = anonymize
     RECURSIVE = recursive
     ADD_SERIES_NUMBER = series_number
-    concat_flag = False
-    concat_list = []
-
-    if RECURSIVE:
-        med_volume_list = load_dicom_with_subfolders(inputDir)
-    else:
-        med_volume_list = [load_dicom(inputDir)]
-
-    print("Data loaded")
 
     multiseries_config = None
-    multiseries_volumes = {}
     raw_overrides = {}
 
     if os.path.exists(os.path.join(inputDir, 'series_config.json')):
@@ -143,107 +164,479 @@ def convert_dicom_to_ormirmids(input_folder, output_folder, anonymize='anon', re
 
     print('Overrides', overrides)
 
-    multiseries_finished = None
+    # counts of the folder walk and of the prefetcher, printed at the end
+    load_statistics = {}
+    manifest = None
+    if incremental:
+        manifest = load_manifest(outputDir)
+        prescan = True
+
+    if prescan:
+        series_catalog = scan_dicom_series(inputDir, RECURSIVE, io_threads, load_statistics)
+        if not RECURSIVE:
+            # as in load_dicom, only the first series of the folder is converted
+            series_catalog = dict(list(series_catalog.items())[:1])
+        if manifest is not None:
+            # the series that are up to date are skipped before their headers are dispatched
+            series_catalog = _select_changed_series(series_catalog, manifest, multiseries_config, inputDir, outputDir)
+        series_catalog = _prescan_series(series_catalog, overrides, explain)
+        med_volumes = iter_dicom_series(series_catalog, dicom_workers, io_threads, prefetch, prefetch_bytes,
+                                        load_statistics)
+        if not stream:
+            med_volumes = list(med_volumes)
+            print("Data loaded")
+    elif stream:
+        # volumes are loaded one at a time while they are being converted
+        if RECURSIVE:
+            med_volumes = iter_dicom_with_subfolders(inputDir, dicom_workers, io_threads, prefetch, prefetch_bytes,
+                                                     load_statistics)
+        else:
+            med_volumes = iter([load_dicom(inputDir, num_workers=dicom_workers, io_threads=io_threads)])
+    else:
+        if RECURSIVE:
+            med_volumes = load_dicom_with_subfolders(inputDir, dicom_workers, io_threads, prefetch, prefetch_bytes,
+                                                     load_statistics)
+        else:
+            med_volumes = [load_dicom(inputDir, num_workers=dicom_workers, io_threads=io_threads)]
+        print("Data loaded")
+
+    med_volumes = _apply_overrides(med_volumes, overrides)
+
+    conversion_options = {
+        'input_folder': inputDir,
+        'output_folder': outputDir,
+        'anonymize': ANON_NAME,
+        'session': session,
+        'series_number': ADD_SERIES_NUMBER,
+        'save_patient_json': save_patient_json,
+        'save_extra_json': save_extra_json,
+        'explain': explain,
+        'write_threads': write_threads,
+        'compression': compression,
+        'compression_level': compression_level,
+    }
+
+    if workers is None or workers <= 1:
+        outputs = _convert_volumes(med_volumes, multiseries_config, conversion_options)
+    else:
+        outputs = _convert_volumes_parallel(med_volumes, multiseries_config, conversion_options, workers)
 
-    for med_volume in med_volume_list:
+    if 'folders' in load_statistics:
+        print(format_walk_statistics(load_statistics))
+    if 'series' in load_statistics:
+        print(format_prefetch_statistics(load_statistics))
+
+    if manifest is not None:
+        for series_uid, series_entry in series_catalog.items():
+            manifest[series_uid] = make_manifest_entry(series_entry['fingerprint'], __version__,
+                                                       outputs.get(series_uid, []))
+        save_manifest(outputDir, manifest)
+
+    if index_exists(outputDir):
+        update_index(outputDir)
+
+
+def _convert_volumes_parallel(med_volumes, multiseries_config, conversion_options, workers):
+    """
+    Converts the volumes in a process pool.
+
+    Parameters:
+        med_volumes (iterable): the volumes to convert
+        multiseries_config (dict): the parsed multiseries configuration
+        conversion_options (dict): the conversion options (see convert_dicom_to_ormirmids)
+        workers (int): the number of processes
+
+    Returns:
+        dict: SeriesInstanceUID -> list of (converter name, output path) (see _convert_volumes)
+    """
+    inputDir = conversion_options['input_folder']
+    outputs = {}
+
+    # every multiseries group is converted by one worker, so that the concatenation sees all its parts in order.
+    # The parts are buffered until the group is complete. All the other volumes are converted in separate tasks.
+    # A task that would write the same files as a pending task waits for it, so that the last volume in input order
+    # writes the files, as in a serial run.
+    pending_tasks = deque() # (future, output files of the task)
+    group_buffers = {}
+
+    def report_oldest_task():
+        # report in submission order, so that the output is the same as in a serial run
+        messages, task_outputs = pending_tasks.popleft()[0].result()
+        for message in messages:
+            print(message)
+        for series_uid, series_outputs in task_outputs.items():
+            outputs.setdefault(series_uid, []).extend(series_outputs)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit(task):
+            task_files = _predict_output_files(task, conversion_options)
+            while any(task_files is None or files is None or not task_files.isdisjoint(files)
+                      for _, files in pending_tasks):
+                report_oldest_task()
+            pending_tasks.append((executor.submit(_convert_volumes_task, task, multiseries_config, conversion_options),
+                                  task_files))
+            # limit the number of volumes waiting in the queue, so that memory stays bounded when streaming
+            while len(pending_tasks) > 2 * workers:
+                report_oldest_task()
+
+        for med_volume in med_volumes:
+            series_group_name, series_list = _find_multiseries_group(med_volume, multiseries_config, inputDir)
+            if series_group_name is None:
+                submit([med_volume])
+                continue
+            group_buffers.setdefault(series_group_name, []).append(med_volume)
+            if len(group_buffers[series_group_name]) == len(series_list):
+                submit(group_buffers.pop(series_group_name))
+
+        # groups with missing series are converted part by part, as in a serial run
+        for task in group_buffers.values():
+            submit(task)
+        group_buffers.clear()
+
+        while pending_tasks:
+            report_oldest_task()
+
+    return outputs
+
+
+def _predict_output_files(med_volume_list, options):
+    """
+    Predicts the files written by the conversion of a list of volumes (see save_converted in _convert_volumes), from
+    the converters that are compatible with the volumes before the conversion.
+
+    Parameters:
+        med_volume_list (list): the volumes of a conversion task
+        options (dict): the conversion options (see convert_dicom_to_ormirmids)
+
+    Returns:
+        set: the paths of the files, relative to the output folder, without extension. None if they cannot be
+            predicted
+    """
+    dispatch_plan = get_dispatch_plan(RootConverter)
+    output_files = set()
+    try:
+        series_prefixes = [f'{get_raw_tag_value(med_volume, "00200011")[0]:03d}_' if options['series_number'] else ''
+                           for med_volume in med_volume_list]
+        for med_volume in med_volume_list:
+            if options['anonymize']:
+                patient_name = options['anonymize']
+            else:
+                patient_name = parse_patient_name(med_volume.patient_header['PatientName'])
+            for converter_class in dispatch_plan.find_converters(med_volume):
+                output_path = os.path.dirname(converter_class.get_file_path(patient_name, options['session']))
+                # a multiseries group is saved with the prefix of its first series
+                for series_prefix in series_prefixes:
+                    output_files.add(os.path.join(output_path, series_prefix +
+                                                  converter_class.get_file_name(patient_name)))
+    except Exception:
+        return None
+    finally:
+        # the facts computed by the predicates are computed again by the worker
+        for med_volume in med_volume_list:
+            clear_volume_facts(med_volume)
+    return output_files
+
+
+def _apply_overrides(med_volumes, overrides):
+    """
+    Applies the header overrides from the series config to the volumes as they are loaded.
+
+    Parameters:
+        med_volumes (iterable): the volumes
+        overrides (dict): series number -> dictionary of omids header values
+
+    Returns:
+        generator: the volumes, with the overrides applied
+    """
+    for med_volume in med_volumes:
         series_number = get_raw_tag_value(med_volume, '00200011')[0]
         if series_number in overrides:
             for key, value in overrides[series_number].items():
                 med_volume.omids_header[key] = value
+        yield med_volume
+
+
+def _prescan_series(series_catalog, overrides, explain=False):
+    """
+    Selects the series of a catalog that have a compatible converter, from the headers read by scan_dicom_series.
+
+    Parameters:
+        series_catalog (dict): the catalog of the series (see scan_dicom_series)
+        overrides (dict): series number -> dictionary of omids header values
+        explain (bool): print how the converters were selected
 
-    def convert_recursive(converter_class, med_volume):
-        #print('Checking converter', converter_class.get_name())
-        compatible_dataset = False
+    Returns:
+        dict: the catalog of the series to convert
+    """
+    selected_series = {}
+    for series_uid, series_entry in series_catalog.items():
+        if series_entry['enhanced']:
+            # the frames of enhanced dicom files are only separated when the pixel data is loaded
+            selected_series[series_uid] = series_entry
+            continue
+        header_volume = load_dicom_series(series_entry, headers_only=True)
+        if header_volume is None:
+            continue
+        for header_volume in _apply_overrides([header_volume], overrides):
+            trace = [] if explain else None
+            if get_dispatch_plan(RootConverter).find_converters(header_volume, trace):
+                selected_series[series_uid] = series_entry
+            else:
+                print(f"No compatible converter found for dataset {series_entry['path']}")
+            if trace is not None:
+                print(f"Converter selection for {series_entry['path']} (headers only):")
+                for line in format_trace(trace):
+                    print(line)
 
-        try:
-            compatible_dataset = converter_class.is_dataset_compatible(med_volume)
-        except Exception as e:
-            pass
+    print(f'Pre-scan: {len(selected_series)} of {len(series_catalog)} series will be converted')
+    return selected_series
 
-        if not compatible_dataset:
-            return False
 
-        converted = False
+def _select_changed_series(series_catalog, manifest, multiseries_config, input_folder, output_folder):
+    """
+    Removes from the catalog the series that are already converted and up to date, according to the manifest.
+    The series of a multiseries group are only skipped if the whole group is up to date.
+
+    Parameters:
+        series_catalog (dict): the catalog of the series (see scan_dicom_series)
+        manifest (dict): the manifest of the previous runs (see load_manifest)
+        multiseries_config (dict): the parsed multiseries configuration
+        input_folder (str): the input folder
+        output_folder (str): the output folder
+
+    Returns:
+        dict: the catalog of the series to convert. Each entry gets a 'fingerprint' key
+    """
+    up_to_date = {}
+    group_up_to_date = {}
+    for series_uid, series_entry in series_catalog.items():
+        series_entry['fingerprint'] = fingerprint_files(series_entry['files'], input_folder)
+        up_to_date[series_uid] = is_up_to_date(manifest.get(series_uid), series_entry['fingerprint'],
+                                               __version__, output_folder)
+        series_group_name, _ = _find_series_group(series_entry['SeriesNumber'], series_entry['path'],
+                                                  multiseries_config, input_folder)
+        if series_group_name is not None:
+            group_up_to_date[series_group_name] = group_up_to_date.get(series_group_name, True) and \
+                                                  up_to_date[series_uid]
+
+    changed_series = {}
+    for series_uid, series_entry in series_catalog.items():
+        series_group_name, _ = _find_series_group(series_entry['SeriesNumber'], series_entry['path'],
+                                                  multiseries_config, input_folder)
+        if series_group_name is not None:
+            skip = group_up_to_date[series_group_name]
+        else:
+            skip = up_to_date[series_uid]
+        if skip:
+            print(f"Dataset {series_entry['path']} is up to date")
+        else:
+            changed_series[series_uid] = series_entry
+
+    print(f'Incremental conversion: {len(changed_series)} of {len(series_catalog)} series changed')
+    return changed_series
+
+
+def _find_multiseries_group(med_volume, multiseries_config, input_folder):
+    """
+    Finds the multiseries group a volume belongs to.
+
+    Parameters:
+        med_volume (MedicalVolume): the volume to test
+        multiseries_config (dict): the parsed multiseries configuration (group name -> list of series)
+        input_folder (str): the input folder, used to resolve series given as paths
+
+    Returns:
+        (str, list): the group name and the list of series in the group, or (None, None)
+    """
+    return _find_series_group(get_raw_tag_value(med_volume, '00200011')[0], med_volume.path,
+                              multiseries_config, input_folder)
+
+
+def _find_series_group(series_number, series_path, multiseries_config, input_folder):
+    """
+    Finds the multiseries group of a series from its number and its folder (see _find_multiseries_group).
+    """
+    if not multiseries_config:
+        return None, None
+
+    med_path = os.path.abspath(series_path)
+
+    for series_group_name, series_list in multiseries_config.items():
+        # check if this series is part of a group
+        if series_number in series_list or \
+                med_path in [os.path.abspath(os.path.join(input_folder, str(x))) for x in series_list]:
+            return series_group_name, series_list
+    return None, None
+
+
+def _convert_volumes_task(med_volume_list, multiseries_config, options):
+    """
+    Process pool entry point: converts a list of volumes and returns the messages instead of printing them.
+    """
+    messages = []
+    outputs = _convert_volumes(med_volume_list, multiseries_config, options, messages.append)
+    return messages, outputs
 
-        # if the converter_class is compatible, check its children
-        # try converting the dataset with each child converter as the same dataset may be compatible with multiple converters
-        for child_converter in converter_class.get_children():
-            try:
-                converted = convert_recursive(child_converter, med_volume) or converted
-            except Exception as e:
-                pass
 
-        # After all the children, try the base class too.
-        if multiseries_part == converter_class.is_multiseries():
+def _convert_volumes(med_volume_list, multiseries_config, options, log=print):
+    """
+    Runs the converter tree on a list of volumes, in order, and saves the converted datasets.
+
+    Parameters:
+        med_volume_list (iterable): the volumes to convert. It can be a generator, in which case
+            only one volume is kept in memory, plus the concatenated data of incomplete multiseries groups
+        multiseries_config (dict): the parsed multiseries configuration
+        options (dict): the conversion options (see convert_dicom_to_ormirmids)
+        log (callable): function used to report the progress
+
+    Returns:
+        dict: SeriesInstanceUID -> list of (converter name, path of the saved file relative to the output folder).
+            The path is None if the conversion or the saving failed
+    """
+    outputDir = options['output_folder']
+    ANON_NAME = options['anonymize']
+    ADD_SERIES_NUMBER = options['series_number']
+    session = options['session']
+    save_patient_json = options['save_patient_json']
+    save_extra_json = options['save_extra_json']
+    compression = options.get('compression', 'gzip')
+    compression_level = options.get('compression_level')
+    nii_extension = nifti_extension(compression)
+
+    multiseries_accumulators = {}
+    multiseries_series = {} # group name -> list of (series instance UID, series number) of the parts seen so far
+    multiseries_finished = None
+    outputs = {}
+
+    output_writer = None
+    write_omids = save_omids
+    if options.get('write_threads'):
+        output_writer = AsyncOmidsWriter(options['write_threads'])
+        write_omids = output_writer.save_omids
+
+    def record_output(series_uid_list, converter_class, file_path):
+        for series_uid in series_uid_list:
+            outputs.setdefault(series_uid, []).append(
+                (converter_class.get_name(), os.path.relpath(file_path, outputDir).replace(os.sep, '/')))
+
+    def record_failure(med_volume, converter_class):
+        series_uid = get_raw_tag_value(med_volume, '0020000E')[0]
+        outputs.setdefault(series_uid, []).append((converter_class.get_name(), None))
+
+    dispatch_plan = get_dispatch_plan(RootConverter)
+
+    def save_converted(converter_class, med_volume, converted_volume):
+        if ANON_NAME:
+            patient_name = ANON_NAME
+        else:
+            patient_name = parse_patient_name(med_volume.patient_header['PatientName'])
+        output_path = pathlib.Path(outputDir) / os.path.dirname(converter_class.get_file_path(patient_name, session))
+        output_path.mkdir(parents=True, exist_ok=True)
+        if multiseries_part:
+            if multiseries_finished is not None:
+                # a multiseries is finished, we can concatenate
+                accumulator = multiseries_accumulators[series_group_name]
+                if len(accumulator) < len(multiseries_series[series_group_name]):
+                    accumulator.append(med_volume)
+                concat_volume_4d = accumulator.get_volume()
+                converted_multiseries_volume = group(concat_volume_4d, converter_class.multiseries_concat_tag())
+
+                series_prefix = ''
+                if ADD_SERIES_NUMBER:
+                    first_series = min(series_number for _, series_number in multiseries_series[series_group_name])
+                    series_prefix = f'{first_series:03d}_'
+
+                file_path = str(output_path / (series_prefix + converter_class.get_file_name(patient_name))) + nii_extension
+                write_omids(file_path, converted_multiseries_volume, save_patient_json, save_extra_json,
+                            compression, compression_level)
+                record_output([series_uid for series_uid, _ in multiseries_series[series_group_name]], converter_class,
+                              file_path)
+                log(f'Volume {med_volume.path} saved with {converter_class.get_name()} using multiseries concatenation')
+                return
+
+        series_prefix = ''
+        if ADD_SERIES_NUMBER:
+            series_prefix = f'{get_raw_tag_value(med_volume, "00200011")[0]:03d}_'
+        file_path = str(output_path / (series_prefix + converter_class.get_file_name(patient_name))) + nii_extension
+        write_omids(file_path, converted_volume, save_patient_json, save_extra_json, compression, compression_level)
+        record_output([get_raw_tag_value(med_volume, '0020000E')[0]], converter_class, file_path)
+        log(f'Volume {med_volume.path} saved with {converter_class.get_name()}')
+
+    def convert_volume(med_volume):
+        # the compatible converters are returned children first, so that the most specific converters run first
+        converted_with = []
+        trace = [] if options.get('explain') else None
+        for converter_class in dispatch_plan.iter_converters(med_volume, multiseries_part, trace):
             try:
                 converted_volume = converter_class.convert_dataset(med_volume)
             except Exception as e:
-                print(f'Error converting volume with {converter_class.get_name()}: {e}')
+                log(f'Error converting volume with {converter_class.get_name()}: {e}')
+                record_failure(med_volume, converter_class)
                 converted_volume = None
             if converted_volume is None:
-                # This class cannot convert datasets, it's just a dependency class
-                return converted
-            if ANON_NAME:
-                patient_name = ANON_NAME
-            else:
-                patient_name = parse_patient_name(med_volume.patient_header['PatientName'])
-            output_path = pathlib.Path(outputDir) / os.path.dirname(converter_class.get_file_path(patient_name, session))
-            output_path.mkdir(parents=True, exist_ok=True)
-            if multiseries_part:
-                if multiseries_finished is not None:
-                    # a multiseries is finished, we can concatenate
-                    concat_volume_4d = concatenate_volumes_3d(multiseries_volumes[series_group_name])
-                    converted_multiseries_volume = group(concat_volume_4d, converter_class.multiseries_concat_tag())
-
-                    series_prefix = ''
-                    if ADD_SERIES_NUMBER:
-                        first_series = min(
-                            [get_raw_tag_value(x, '00200011')[0] for x in multiseries_volumes[series_group_name]])
-                        series_prefix = f'{first_series:03d}_'
-
-                    save_omids(
-                        str(output_path / (series_prefix + converter_class.get_file_name(patient_name))) + '.nii.gz',
-                        converted_multiseries_volume, save_patient_json, save_extra_json)
-                    print('Volume', med_volume.path, 'saved with', converter_class.get_name(), 'using multiseries concatenation')
-                    return True # we successfully converted the multiseries volume
-
-            series_prefix = ''
-            if ADD_SERIES_NUMBER:
-                series_prefix = f'{get_raw_tag_value(med_volume, "00200011")[0]:03d}_'
-            save_omids(str(output_path / (series_prefix + converter_class.get_file_name(patient_name))) + '.nii.gz',
-                       converted_volume, save_patient_json, save_extra_json)
-            print('Volume', med_volume.path, 'saved with', converter_class.get_name())
-            return True # we successfully converted the volume
-
-        return converted # return if any child converted the volume
+                continue
+            try:
+                save_converted(converter_class, med_volume, converted_volume)
+            except Exception as e:
+                log(f'Error saving volume converted with {converter_class.get_name()}: {e}')
+                record_failure(med_volume, converter_class)
+                continue
+            converted_with.append(converter_class.get_name())
+
+        if trace is not None:
+            log(f'Converter selection for {med_volume.path}:')
+            for line in format_trace(trace):
+                log(line)
+            log(f"  converted with: {', '.join(converted_with) if converted_with else 'none'}")
+        return len(converted_with) > 0
 
     for med_volume in med_volume_list:
         multiseries_part = False
-        if multiseries_config:
-            series_number = get_raw_tag_value(med_volume, '00200011')[0]
-            med_path = os.path.abspath(med_volume.path)
-
-
-            for series_group_name, series_list in multiseries_config.items():
-                # check if this series is part of a group
-                if series_number in series_list or \
-                        med_path in [os.path.abspath(os.path.join(inputDir, str(x))) for x in series_list]:
-                    if series_group_name not in multiseries_volumes:
-                        multiseries_volumes[series_group_name] = []
-                    multiseries_volumes[series_group_name].append(med_volume)
-                    multiseries_part = True
-                    print('Multiseries part:', series_group_name)
-                    if len(multiseries_volumes[series_group_name]) == len(series_list):
-                        multiseries_finished = series_group_name
-                        print('Multiseries finished:', series_group_name)
-                    else:
-                        multiseries_finished = None
-                    break # don't search for other groups
-
-        if convert_recursive(RootConverter, med_volume):
-            print("Dataset converted successfully")
+        series_group_name, series_list = _find_multiseries_group(med_volume, multiseries_config,
+                                                                 options['input_folder'])
+        if series_group_name is not None:
+            if series_group_name not in multiseries_accumulators:
+                multiseries_accumulators[series_group_name] = MultiseriesAccumulator(len(series_list))
+                multiseries_series[series_group_name] = []
+            multiseries_series[series_group_name].append((get_raw_tag_value(med_volume, '0020000E')[0],
+                                                          get_raw_tag_value(med_volume, '00200011')[0]))
+            multiseries_part = True
+            log(f'Multiseries part: {series_group_name}')
+            if len(multiseries_series[series_group_name]) == len(series_list):
+                multiseries_finished = series_group_name
+                log(f'Multiseries finished: {series_group_name}')
+            else:
+                multiseries_finished = None
+
+        if convert_volume(med_volume):
+            log("Dataset converted successfully")
         else:
-            print("No compatible converter found for dataset", med_volume.path)
+            log(f"No compatible converter found for dataset {med_volume.path}")
+        # the facts of the converters (e.g. the extracted parts) are not needed anymore
+        clear_volume_facts(med_volume)
+
+        if multiseries_part:
+            if multiseries_finished is not None:
+                # the group is complete, release its data
+                del multiseries_accumulators[multiseries_finished]
+                del multiseries_series[multiseries_finished]
+                multiseries_finished = None
+            else:
+                # the volume is copied with the headers set by the converters, and can be released
+                multiseries_accumulators[series_group_name].append(med_volume)
+        del med_volume # release the volume before the next one is loaded
+
+    if output_writer is not None:
+        # wait for the pending files, and mark the outputs that could not be written as failed
+        failed_files = set()
+        for nii_file, error in output_writer.close():
+            log(f'Error writing {nii_file}: {error}')
+            failed_files.add(os.path.relpath(nii_file, outputDir).replace(os.sep, '/'))
+        for series_outputs in outputs.values():
+            series_outputs[:] = [(converter_name, None if output_path in failed_files else output_path)
+                                 for converter_name, output_path in series_outputs]
+
+    return outputs
 
 
 def main():
@@ -257,6 +650,32 @@ def main():
     parser.add_argument('--disable-extra-json', '-e', action='store_true', help='Avoid saving extra json file')
     parser.add_argument('--session', metavar='session_id', type=str, nargs=1,
                         help='Specify the session ID to use (default: none)')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                        help='Number of processes used to convert independent series in parallel (default: 1)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Load and convert one series at a time to limit the memory usage')
+    parser.add_argument('--prescan', action='store_true',
+                        help='Read the dicom headers first and skip the series that cannot be converted')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only convert the series that changed since the previous run in the same output folder')
+    parser.add_argument('--explain', action='store_true',
+                        help='Print how the converters were selected for every series')
+    parser.add_argument('--io-threads', metavar='N', type=int, default=None,
+                        help='Number of threads used to read the DICOM files (default: number of CPUs + 4, max 32)')
+    parser.add_argument('--write-threads', metavar='N', type=int, default=0,
+                        help='Write the output files in N background threads (default: 0, synchronous writes)')
+    parser.add_argument('--compression', choices=['gzip', 'parallel', 'none'], default='gzip',
+                        help='Compression of the NIfTI files: gzip (default), parallel (multithreaded gzip) '
+                             'or none (.nii files)')
+    parser.add_argument('--compression-level', metavar='L', type=int, default=None, choices=range(1, 10),
+                        help='gzip compression level, from 1 (fastest, default) to 9 (smallest)')
+    parser.add_argument('--dicom-workers', metavar='N', type=int, default=0,
+                        help='Number of processes used to parse the DICOM files of each folder (default: 0)')
+    parser.add_argument('--prefetch', metavar='N', type=int, default=0,
+                        help='Read the files of the next N folders (or series, with --prescan) in the background '
+                             '(default: 0)')
+    parser.add_argument('--prefetch-mb', metavar='MB', type=float, default=None,
+                        help='Maximum size of the files read ahead, in megabytes (default: no limit)')
 
     args = parser.parse_args()
 
@@ -269,7 +688,10 @@ def main():
         SESSION = args.session[0]
     else:
         SESSION = None
-    convert_dicom_to_ormirmids(inputDir, outputDir, ANON_NAME, RECURSIVE, SESSION, ADD_SERIES_NUMBER, not args.disable_patient_json, not args.disable_extra_json)
+    convert_dicom_to_ormirmids(inputDir, outputDir, ANON_NAME, RECURSIVE, SESSION, ADD_SERIES_NUMBER, not args.disable_patient_json, not args.disable_extra_json, args.jobs, args.stream, args.prescan, args.incremental, args.explain,
+                               args.io_threads, args.dicom_workers, args.write_threads,
+                               args.compression, args.compression_level, args.prefetch,
+                               None if args.prefetch_mb is None else int(args.prefetch_mb * 1024 ** 2))
 
 
 # if __name__ == "__main__":
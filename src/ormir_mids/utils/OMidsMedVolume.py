@@ -1,4 +1,6 @@
 from voxel import MedicalVolume as VoxelMedicalVolume
+from voxel.med_volume import _SpatialFirstSlicer
+import numpy as np
 import copy
 
 def copy_headers(medical_volume_src, medical_volume_dest):
@@ -12,10 +14,44 @@ def copy_headers(medical_volume_src, medical_volume_dest):
         No return value
     """
     for header in ['omids_header', 'meta_header', 'patient_header', 'extra_header']:
-        setattr(medical_volume_dest, header, copy.deepcopy(getattr(medical_volume_src, header, None)))
+        header_loader = None
+        if isinstance(medical_volume_src, OMidsMedVolume) and isinstance(medical_volume_dest, OMidsMedVolume):
+            header_loader = medical_volume_src.get_header_loader(header)
+        if header_loader is not None:
+            # the header was not loaded yet: the copy gets its own loader instead of parsing the header now
+            medical_volume_dest.set_header_loader(header, copy.deepcopy(header_loader))
+        else:
+            setattr(medical_volume_dest, header, copy.deepcopy(getattr(medical_volume_src, header, None)))
     setattr(medical_volume_dest, 'bids_header', getattr(medical_volume_dest, 'omids_header')) # for compatibility
 
 
+class _LazyHeader:
+    """
+    Descriptor of a header attribute that can be loaded on first access (see OMidsMedVolume.set_header_loader).
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.attribute = '_' + name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        header_loaders = instance.__dict__.get('_header_loaders')
+        if header_loaders and self.name in header_loaders:
+            instance.__dict__[self.attribute] = header_loaders.pop(self.name)()
+        try:
+            return instance.__dict__[self.attribute]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, instance, value):
+        header_loaders = instance.__dict__.get('_header_loaders')
+        if header_loaders:
+            header_loaders.pop(self.name, None)
+        instance.__dict__[self.attribute] = value
+
+
 class OMidsMedVolume(VoxelMedicalVolume):
     """
     A MedicalVolume with additional attributes for OMids.
@@ -31,9 +67,120 @@ class OMidsMedVolume(VoxelMedicalVolume):
         self.meta_header = {}
         self.bids_header = self.omids_header  # For compatibility with BIDS
 
+    # the sidecar headers can be large, they can be loaded when they are first used
+    meta_header = _LazyHeader()
+    patient_header = _LazyHeader()
+    extra_header = _LazyHeader()
+
+    def set_header_loader(self, header_name, loader):
+        """
+        Sets a function that loads a header the first time it is accessed.
+
+        Parameters:
+            header_name (str): 'meta_header', 'patient_header' or 'extra_header'
+            loader (callable): function without arguments returning the header. It must be picklable if the volume
+                is sent to other processes.
+
+        Returns:
+            None
+        """
+        if not isinstance(getattr(type(self), header_name, None), _LazyHeader):
+            raise ValueError(f'{header_name} cannot be loaded lazily')
+        self.__dict__.setdefault('_header_loaders', {})[header_name] = loader
+
+    def get_header_loader(self, header_name):
+        """
+        Returns the loader of a header that was not loaded yet, or None.
+        """
+        return self.__dict__.get('_header_loaders', {}).get(header_name)
+
+    def __getstate__(self):
+        # the facts cached on the volume (see ormir_mids.utils.facts.volume_fact) are not sent to other processes
+        state = self.__dict__.copy()
+        state.pop('_volume_facts', None)
+        return state
+
     def _partial_clone(self, **kwargs):
         clone = super()._partial_clone(**kwargs)
         copy_headers(self, clone)
         return clone
 
+    # Lazy loading: the data of the volume can be provided by a loader, which is only called when the array is first
+    # needed. The shape, number of dimensions and dtype are known without loading, and slicing only reads the
+    # requested part if the loader has a get_slice method.
+    _volume_loader = None
+
+    @classmethod
+    def from_loader(cls, loader, affine):
+        """
+        Creates a volume whose data is loaded on first access.
+
+        Parameters:
+            loader (callable): function without arguments returning the array. It must have the attributes shape and
+                dtype, and optionally a get_slice(slicer) method. It must be picklable if the volume is sent to
+                other processes.
+            affine (np.ndarray): the affine matrix
+
+        Returns:
+            OMidsMedVolume: the lazy volume
+        """
+        med_volume = cls(np.zeros((1,) * len(loader.shape), dtype=loader.dtype), affine)
+        med_volume._volume_array = None
+        med_volume._volume_loader = loader
+        return med_volume
+
+    @property
+    def is_loaded(self):
+        """ bool: False if the data of the volume has not been loaded yet """
+        return self._volume_loader is None
+
+    @property
+    def _volume(self):
+        if self._volume_loader is not None:
+            self._volume_array = self._volume_loader()
+            self._volume_loader = None
+        return self._volume_array
+
+    @_volume.setter
+    def _volume(self, value):
+        self._volume_loader = None
+        self._volume_array = value
+
+    @property
+    def shape(self):
+        if self._volume_loader is not None:
+            return tuple(self._volume_loader.shape)
+        return super().shape
+
+    @property
+    def ndim(self):
+        if self._volume_loader is not None:
+            return len(self._volume_loader.shape)
+        return super().ndim
+
+    @property
+    def dtype(self):
+        if self._volume_loader is not None:
+            return self._volume_loader.dtype
+        return super().dtype
+
+    def __getitem__(self, _slice):
+        if self._volume_loader is None or not hasattr(self._volume_loader, 'get_slice') or \
+                isinstance(_slice, VoxelMedicalVolume):
+            return super().__getitem__(_slice)
+
+        # same as MedicalVolume.__getitem__, but only the requested part is read
+        slicer = _SpatialFirstSlicer(self)
+        try:
+            _slice = slicer.check_slicing(_slice)
+        except ValueError as err:
+            raise IndexError(*err.args)
+
+        volume = self._volume_loader.get_slice(_slice)
+        if any(dim == 0 for dim in volume.shape):
+            raise IndexError("Empty slice requested")
+
+        affine = slicer.slice_affine(_slice)
+        return self._partial_clone(volume=volume, affine=affine, headers=self._headers)
+
 MedicalVolume = OMidsMedVolume
\ No newline at end of file
@@ -2,7 +2,9 @@ from .headers import reduce,\
     copy_volume_with_omids_headers, \
     replace_volume, \
     slice_volume_3d, \
+    split_volume_3d, \
     concatenate_volumes_3d, \
+    MultiseriesAccumulator, \
     get_manufacturer, \
     group, \
     ungroup, \
@@ -13,7 +15,9 @@ __all__ = [
     'copy_volume_with_omids_headers',
     'replace_volume',
     'slice_volume_3d',
+    'split_volume_3d',
     'concatenate_volumes_3d',
+    'MultiseriesAccumulator',
     'get_manufacturer',
     'group',
     'ungroup',
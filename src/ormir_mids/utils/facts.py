@@ -0,0 +1,67 @@
+"""
+Facts about a volume (e.g. the classification of its slices) cached on the volume itself, see volume_fact.
+"""
+import operator
+
+
+def _get_fact(facts, key, compute):
+    if key not in facts:
+        try:
+            facts[key] = (True, compute())
+        except Exception as e:
+            facts[key] = (False, e)
+    success, value = facts[key]
+    if not success:
+        raise value
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _is_same_stamp(stamp, other_stamp):
+    return len(stamp) == len(other_stamp) and all(map(operator.is_, stamp, other_stamp))
+
+
+def volume_fact(med_volume, key, compute, stamp):
+    """
+    Returns a fact about a volume, cached on the volume itself, e.g. the classification of its slices used by the
+    converter predicates. The fact is computed again when its stamp changes. The stamp is a tuple of the header
+    objects the fact is derived from, compared by identity, so that replacing a header or one of its entries
+    invalidates the fact (see headers.tag_fact). Modifying a header entry in place is not detected: call
+    clear_volume_facts afterwards.
+    Lists are copied, so that the callers can modify them. Exceptions are cached too, and raised again.
+    OMidsMedVolume does not pickle its cache, but other volumes do: the key should only contain picklable values
+    (e.g. the name of a function rather than the function).
+
+    Parameters:
+        med_volume (MedicalVolume): the volume
+        key (hashable): the identifier of the fact
+        compute (callable): function without arguments that computes the fact
+        stamp (tuple): the objects the fact depends on
+
+    Returns:
+        (Any): the value of the fact
+    """
+    volume_facts = getattr(med_volume, '_volume_facts', None)
+    if volume_facts is None:
+        volume_facts = {}
+        med_volume._volume_facts = volume_facts
+    entry = volume_facts.get(key)
+    if entry is None or not _is_same_stamp(entry[0], stamp):
+        entry = (stamp, {})
+        volume_facts[key] = entry
+    return _get_fact(entry[1], key, compute)
+
+
+def clear_volume_facts(med_volume):
+    """
+    Clears the facts cached on a volume (see volume_fact).
+
+    Parameters:
+        med_volume (MedicalVolume): the volume
+
+    Returns:
+        None
+    """
+    if getattr(med_volume, '_volume_facts', None) is not None:
+        med_volume._volume_facts = None
@@ -1,16 +1,18 @@
 import copy
-import itertools
+import functools
 import operator
-import sys
-from collections import OrderedDict
 
 import numpy as np
 import pydicom.dataset
+from pydicom.datadict import dictionary_VR
+from pydicom.dataelem import RawDataElement
+from pydicom.tag import Tag
 from pydicom.uid import generate_uid
 
 from ..config.tag_definitions import defined_tags, patient_tags
 from .OMidsMedVolume import OMidsMedVolume as MedicalVolume
 from .OMidsMedVolume import copy_headers
+from .facts import volume_fact
 
 from itertools import groupby
 
@@ -38,7 +40,9 @@ def _get_value_tag(element):
 def get_raw_tag_value(med_volume, tag, alternative_tag=None, force_raw=False):
     """
     Gets the value of a tag, regardless of its location in the header. A tag is always defined
-    by its DICOM tag number.
+    by its DICOM tag number. The value is cached on the volume until a header, or the header entry of the tag, is
+    replaced (see get_tag_stamp). The lists are returned as shallow copies: the caller can modify the list, but not
+    its elements (e.g. the list of each slice), which are shared with the cache.
 
     Parameters:
         med_volume (MedicalVolume): the volume to get the tag from
@@ -49,44 +53,165 @@ def get_raw_tag_value(med_volume, tag, alternative_tag=None, force_raw=False):
     Returns:
         (Any): the value of the tag
     """
+    stamp = _tag_stamp(med_volume, tag, force_raw)
+    if alternative_tag:
+        stamp += _tag_stamp(med_volume, alternative_tag)
+    return volume_fact(med_volume, ('raw_tag', tag, alternative_tag, force_raw),
+                       lambda: _get_raw_tag_value(med_volume, tag, alternative_tag, force_raw), stamp)
+
+
+def _tag_keys(med_volume, tag, force_raw=False):
+    """
+    Returns the header that stores a tag, the keys the tag can have in it, and the definitions of the named tags of
+    the header (None for the raw header).
+    """
     if not force_raw:
-        if tag in defined_tags:
-            # tag is named
-            named_tag = defined_tags[tag]
-            if isinstance(named_tag, list):
-                # tag is a list of tags. Find out what tag it actually is stored
-                for t in named_tag[:]:
-                    if t in med_volume.omids_header:
-                        named_tag = t
-                        break
-            try:
-                if isinstance(med_volume.omids_header[named_tag], list):
-                    return list(map(defined_tags.get_translator(named_tag), med_volume.omids_header[named_tag]))
-                else:
-                    return defined_tags.get_translator(named_tag)(med_volume.omids_header[named_tag])
-            except KeyError as e:
-                if alternative_tag:
-                    return get_raw_tag_value(med_volume, alternative_tag)
-                else:
-                    raise e
-
-        if tag in patient_tags:
-            # tag is named
-            named_tag = patient_tags[tag]
-            if isinstance(named_tag, list):
-                # tag is a list of tags. Find out what tag it actually is stored
-                for t in named_tag[:]:
-                    if t in med_volume.patient_header:
-                        named_tag = t
-                        break
-            if 'isList' in med_volume.patient_header[named_tag]:
-                return list(map(patient_tags.get_translator(named_tag), med_volume.patient_header[named_tag]))
-            else:
-                return patient_tags.get_translator(named_tag)(med_volume.patient_header[named_tag])
+        for tag_dict, header_name in ((defined_tags, 'omids_header'), (patient_tags, 'patient_header')):
+            if tag in tag_dict:
+                # tag is named, it can have several names
+                return getattr(med_volume, header_name), tag_dict.get_named_tags(tag), tag_dict
 
     # tag is numeric
-    value_tag = _get_value_tag(med_volume.extra_header[tag])
-    return med_volume.extra_header[tag][value_tag]
+    return med_volume.extra_header, (tag,), None
+
+
+def _locate_tag(med_volume, tag, force_raw=False):
+    """
+    Finds the header entry where the value of a tag is stored (see get_raw_tag_value).
+
+    Parameters:
+        med_volume (MedicalVolume): the volume
+        tag (str): the DICOM tag identifier
+        force_raw (bool, optional): if True, only look in the raw header
+
+    Returns:
+        (dict, str, TagDefinitionDict): the header, the key of the entry and the definitions of the named tags of the
+            header (None for the raw header)
+
+    Raises:
+        KeyError: if the tag is not stored
+    """
+    header, keys, tag_dict = _tag_keys(med_volume, tag, force_raw)
+    for key in keys:
+        # Find out under which name the tag is actually stored
+        if key in header:
+            return header, key, tag_dict
+    raise KeyError(keys[0])
+
+
+def _get_raw_tag_value(med_volume, tag, alternative_tag=None, force_raw=False):
+    """ Implementation of get_raw_tag_value, without caching """
+    try:
+        header, key, tag_dict = _locate_tag(med_volume, tag, force_raw)
+        value = header[key]
+    except KeyError as e:
+        if alternative_tag:
+            return get_raw_tag_value(med_volume, alternative_tag)
+        raise e
+
+    if tag_dict is None:
+        return value[_get_value_tag(value)]
+    if tag_dict is patient_tags:
+        if 'isList' in value:
+            return list(map(patient_tags.get_translator(key), value))
+        return patient_tags.get_translator(key)(value)
+    if isinstance(value, list):
+        return list(map(defined_tags.get_translator(key), value))
+    return defined_tags.get_translator(key)(value)
+
+
+def get_tag_stamp(med_volume, tags, raw_tags=()):
+    """
+    Gets the objects of the headers that store some tags, to detect when the tags are modified (see
+    ormir_mids.utils.facts.volume_fact). The stamp only looks up the entries: the header of each tag, and the entry
+    of each name of the tag (None if it is not stored), so that it is cheaper than reading the tags. The other headers
+    are not accessed, so that the lazy headers of a volume are not loaded.
+
+    Parameters:
+        med_volume (MedicalVolume): the volume
+        tags (iterable): the DICOM tag identifiers, as used by get_raw_tag_value
+        raw_tags (iterable): the DICOM tag identifiers that are read with force_raw=True
+
+    Returns:
+        tuple: the headers and the entries storing the tags
+    """
+    stamp = ()
+    for tag in tags:
+        stamp += _tag_stamp(med_volume, tag)
+    for tag in raw_tags:
+        stamp += _tag_stamp(med_volume, tag, True)
+    return stamp
+
+
+def _tag_stamp(med_volume, tag, force_raw=False):
+    """ Gets the stamp of a single tag (see get_tag_stamp) """
+    header, keys, tag_dict = _tag_keys(med_volume, tag, force_raw)
+    if tag_dict is not None:
+        return (header, *map(header.get, keys))
+    value = header.get(tag)
+    if value is None:
+        return header, None
+    # the raw entries are modified in place (e.g. by separate_headers)
+    return header, value, value.get(_get_value_tag(value))
+
+
+def tag_fact(*tags, raw_tags=()):
+    """
+    Decorator for the functions that compute a fact of a volume from some of its tags, e.g. the image type of each
+    slice. The fact is cached on the volume per function and arguments, and computed again when the header entries of
+    the tags are replaced (see ormir_mids.utils.facts.volume_fact).
+
+    Parameters:
+        *tags (str): the DICOM tag identifiers the fact depends on
+        raw_tags (iterable): the DICOM tag identifiers the fact reads with force_raw=True
+
+    Returns:
+        callable: the decorator
+    """
+    def decorator(function):
+        # the key is made of names, so that the volumes stay picklable
+        function_key = (function.__module__, function.__qualname__)
+
+        @functools.wraps(function)
+        def wrapper(med_volume, *args):
+            return volume_fact(med_volume, (function_key, args), lambda: function(med_volume, *args),
+                               get_tag_stamp(med_volume, tags, raw_tags))
+        # the tags are known to the users of the fact, e.g. get_volume_part
+        wrapper.tags = tags
+        wrapper.raw_tags = tuple(raw_tags)
+        return wrapper
+    return decorator
+
+
+@tag_fact(raw_tags=('00180020',))
+def get_raw_scanning_sequence(med_volume: MedicalVolume):
+    """
+    Gets the scanning sequence of each slice from the raw header
+
+    Parameters:
+        med_volume (MedicalVolume): the volume
+
+    Returns:
+        list: the first scanning sequence of each slice, e.g. 'GR' or 'SE'
+    """
+    return [v[0] for v in get_raw_tag_value(med_volume, '00180020', force_raw=True)]
+
+
+@tag_fact('00180081')
+def get_n_echo_times(med_volume: MedicalVolume):
+    """
+    Counts the different echo times of a volume
+
+    Parameters:
+        med_volume (MedicalVolume): the volume
+
+    Returns:
+        int: the number of different positive echo times
+    """
+    echo_times_list = med_volume.omids_header['EchoTime']
+    if not isinstance(echo_times_list, list):
+        echo_times_list = [echo_times_list]
+    return sum(TE > 0. for TE in set(echo_times_list))
 
 
 def replace_volume(medical_volume, new_data):
@@ -119,6 +244,185 @@ def copy_volume_with_omids_headers(medical_volume):
     return new_volume
 
 
+PIXEL_DATA_TAG = 0x7FE00010
+
+
+def _element_key(dataset, tag, charset_key):
+    """
+    Returns a key identifying the raw content of a data element, so that two elements with the same key have the same
+    JSON representation without converting them. None if the element was already decoded or if its decoding depends on
+    other elements of the dataset.
+    """
+    element = dataset.get_item(tag)
+    if not isinstance(element, RawDataElement) or element.value is None:
+        return None
+    vr = element.VR
+    creator_key = None
+    if vr is None: # implicit VR: the VR comes from the dictionary
+        if tag.is_private:
+            creator = dataset.get_item(Tag(tag.group, tag.element >> 8))
+            if not isinstance(creator, RawDataElement):
+                return None
+            creator_key = creator.value
+        else:
+            try:
+                if ' or ' in dictionary_VR(tag):
+                    return None # ambiguous VR, resolved from other elements
+            except KeyError:
+                pass
+    return vr, element.value, element.is_implicit_VR, element.is_little_endian, charset_key, creator_key
+
+
+class _HeaderColumn:
+    """ The values of one tag in all the slices. The value is stored once while it is constant """
+
+    __slots__ = ('content', 'value_tag', 'values', 'last_key', 'last_content')
+
+    def __init__(self, content):
+        self.content = content
+        self.value_tag = None
+        self.values = None
+        self.last_key = None
+        self.last_content = content
+
+    def add(self, content, index):
+        if self.values is None:
+            if content == self.content:
+                return # same as the other slices
+            self.value_tag = _get_value_tag(self.content)
+            self.values = [self.content[self.value_tag]] * index # replicate the content until now
+        self.values.append(content[self.value_tag])
+
+    def to_json(self):
+        if self.values is None:
+            return self.content
+        json_content = dict(self.content)
+        json_content['isList'] = True
+        json_content[self.value_tag] = self.values.tolist() if isinstance(self.values, np.ndarray) else self.values
+        return json_content
+
+
+class ColumnarHeaders:
+    """
+    Columnar representation of the DICOM headers of a series of slices: one column per tag, with the tags that are
+    common to all the slices stored only once, and the numeric tags that change between slices stored as numpy arrays.
+
+    The data elements are only converted to JSON when their raw content differs from the previous slice, so the
+    unchanged tags of large series are compared as bytes.
+    """
+
+    def __init__(self):
+        self.n_slices = 0
+        self.header_columns = {}
+        self.meta_columns = {}
+
+    @classmethod
+    def from_datasets(cls, header_list):
+        """
+        Builds the columns from a list of DICOM headers, in a single pass.
+
+        Parameters:
+            header_list (list): list of DICOM headers
+
+        Returns:
+            ColumnarHeaders: the columns
+        """
+        columnar_headers = cls()
+        for dataset in header_list:
+            columnar_headers.add_slice(dataset)
+        columnar_headers.finalize()
+        return columnar_headers
+
+    @staticmethod
+    def _add_dataset(dataset, columns, index):
+        charset = dataset.get_item(0x00080005)
+        charset_key = charset.value if isinstance(charset, RawDataElement) else None
+        for tag in dataset.keys():
+            json_tag = f"{tag:08X}"
+            if tag == PIXEL_DATA_TAG: # remove pixel data
+                columns[json_tag] = _HeaderColumn({'vr': dataset[tag].VR, 'InlineBinary': ''})
+                continue
+            column = columns.get(json_tag)
+            key = _element_key(dataset, tag, charset_key)
+            if column is not None and key is not None and key == column.last_key:
+                content = column.last_content
+            else:
+                content = dataset[tag].to_json_dict(None, 1024)
+            if column is None:
+                column = _HeaderColumn(content)
+                columns[json_tag] = column
+            else:
+                column.add(content, index)
+            column.last_key = key
+            column.last_content = content
+
+    def add_slice(self, dataset):
+        """
+        Adds the header of a slice.
+
+        Parameters:
+            dataset (pydicom.Dataset): the header
+        """
+        self._add_dataset(dataset, self.header_columns, self.n_slices)
+        self._add_dataset(dataset.file_meta, self.meta_columns, self.n_slices)
+        self.n_slices += 1
+
+    def finalize(self):
+        """ Converts the numeric columns that change between slices to numpy arrays """
+        for columns in (self.header_columns, self.meta_columns):
+            for column in columns.values():
+                column.last_key = None
+                column.last_content = None
+                if column.values is not None and column.value_tag == 'Value':
+                    column.values = _to_numeric_array(column.values)
+
+    def get_values(self, tag):
+        """
+        Gets the values of a tag in all the slices.
+
+        Parameters:
+            tag (str): the DICOM tag identifier, e.g. '00200032'
+
+        Returns:
+            (Any): a numpy array (one row per slice) for numeric tags that change between slices, a list for the other
+                tags that change, or the JSON content if the tag is the same in all the slices
+        """
+        column = self.header_columns[tag]
+        if column.values is None:
+            return column.content
+        return column.values
+
+    def to_json_dicts(self):
+        """
+        Converts the columns to the compressed JSON dictionaries, where the tags that change between slices have
+        the 'isList' flag and the list of the values.
+
+        Returns:
+            (dict, dict): the meta and the header dictionaries
+        """
+        compressed_meta = {tag: column.to_json() for tag, column in self.meta_columns.items()}
+        compressed_header = {tag: column.to_json() for tag, column in self.header_columns.items()}
+        return compressed_meta, compressed_header
+
+
+def _to_numeric_array(values):
+    """ Converts a list of values to a numpy array if all the values are lists of numbers of the same length and type.
+    Otherwise, the list is returned """
+    if not values or not isinstance(values[0], list) or not values[0]:
+        return values
+    value_type = type(values[0][0])
+    if value_type not in (int, float):
+        return values
+    length = len(values[0])
+    for value in values:
+        if not isinstance(value, list) or len(value) != length or any(type(v) is not value_type for v in value):
+            return values
+    try:
+        return np.array(values, dtype=np.float64 if value_type is float else np.int64)
+    except OverflowError:
+        return values
+
+
 def headers_to_dicts(header_list):
     """
     this function takes a list of DICOM headers and converts them into a meta and a header dictionary
@@ -134,54 +438,49 @@ def headers_to_dicts(header_list):
     if type(header_list) != list:
         header_list = header_list.squeeze().tolist()
 
-    json_header_list = []
-    for h in header_list:
-        meta_header = h.file_meta.to_json_dict()
-        # the following should already be in the json dict
-        #meta_header['is_little_endian'] = h.is_little_endian
-        #meta_header['is_implicit_VR'] = h.is_implicit_VR
+    return ColumnarHeaders.from_datasets(header_list).to_json_dicts()
 
-        json_header_list.append({'meta': meta_header, 'header': h.to_json_dict()})
 
-    # compress json header list
-    compressed_meta = {}
-    compressed_header = {}
+def generate_uids(n_uids):
+    """
+    Generates a list of unique UIDs. A single random UID is generated, and the UIDs are numbered below it, which is
+    much faster than generating a random UID for each slice.
 
-    # this function is used to compress the meta and header dictionaries
-    def process_tag(tag, content, index, dest_dictionary):
-        if tag == '7FE00010': # remove pixel data
-            vr_type = content['vr']
-            dest_dictionary[tag] = {'vr': vr_type, 'InlineBinary': ''}
-            return
-        if tag not in dest_dictionary:
-            dest_dictionary[tag] = content
-            return
-        existing_content = dest_dictionary[tag]
-        if content == existing_content:
-            #print("Content already exists", tag, existing_content)
-            return  # do nothing if the content is the same as the other slices
+    Parameters:
+        n_uids (int): the number of UIDs
 
-        # append to existing content
-        value_tag = _get_value_tag(existing_content)
+    Returns:
+        (list): the UIDs
+    """
+    root_uid = generate_uid()[:64 - len(str(n_uids)) - 1]
+    return [pydicom.uid.UID(f'{root_uid}.{i + 1}') for i in range(n_uids)]
 
-        if 'isList' not in existing_content:  # content is not already a list
-            existing_content['isList'] = True
-            existing_content[value_tag] = [existing_content[value_tag]] * (index)  # replicate content until now
 
-        existing_content[value_tag].append(content[value_tag])
+def _split_list_tags(compressed_dict):
+    """ Splits a compressed dictionary into the tags that are common to all the slices and the tags with a list """
+    constant_dict = {}
+    list_dict = {}
+    for key, element in compressed_dict.items():
+        if 'isList' in element:
+            list_dict[key] = (element, _get_value_tag(element))
+        else:
+            constant_dict[key] = element
+    return constant_dict, list_dict
 
-    for i, element in enumerate(json_header_list):
-        for tag, content in element['header'].items():
-            process_tag(tag, content, i, compressed_header)
-        for tag, content in element['meta'].items():
-            process_tag(tag, content, i, compressed_meta)
 
-    return compressed_meta, compressed_header
+def _clone_dataset(template):
+    """ Copies a dataset made of decoded data elements. Only the sequences are copied deeply """
+    clone = type(template)()
+    for element in template:
+        clone.add(copy.deepcopy(element) if element.VR == 'SQ' else copy.copy(element))
+    return clone
 
 
 def dicts_to_headers(n_slices, compressed_header, compressed_meta = None):
     """
     Reverts the headers_to_dicts function and creates a list of DICOM headers from the compressed dictionaries.
+    The tags that are common to all the slices are decoded once into a template dataset, which is copied for each
+    slice, and only the tags with a list of values are decoded for each slice.
 
     Parameters:
         n_slices (int): the number of slices in the volume
@@ -194,46 +493,42 @@ def dicts_to_headers(n_slices, compressed_header, compressed_meta = None):
     if not compressed_meta:
         compressed_meta = None # catch the case of an empty dictionary meta
 
-    # decompress the headers
-
-    dicom_dataset_list = []
+    constant_header, list_header = _split_list_tags(compressed_header)
+    if '7FE00010' not in list_header:
+        vr_std = constant_header.get('7FE00010', {}).get('vr', 'OW')
+        constant_header['7FE00010'] = {'vr': vr_std, 'InlineBinary': ''} # ensure empty pixel data
+    header_template = pydicom.dataset.Dataset.from_json(constant_header)
 
-    header_dict_list = []
-    meta_dict_list = []
+    if compressed_meta is not None:
+        constant_meta, list_meta = _split_list_tags(compressed_meta)
+        meta_template = pydicom.dataset.FileMetaDataset.from_json(constant_meta)
 
-    # decompress header
+    dicom_dataset_list = []
     for i in range(n_slices):
-        new_dict = {}
-        for key, element in compressed_header.items():
-            new_dict[key] = copy.deepcopy(element)
-            if 'isList' in element:
-                value_tag = _get_value_tag(element)
-                try:
-                    new_dict[key][value_tag] = element[value_tag][i]
-                    new_dict[key].pop('isList')
-                except IndexError:
-                    #print(f'Warning: tag {key} not defined for image {i}')
-                    new_dict.pop(key) # tag not defined for all images
-
-        vr_std = 'OW'
-        try:
-            vr_std = new_dict['7FE00010']['vr']
-        except:
-            pass
-        new_dict['7FE00010'] = {'vr': vr_std, 'InlineBinary': ''} # ensure empty pixel data
-        new_header = pydicom.dataset.Dataset.from_json(new_dict)
+        slice_dict = {}
+        for key, (element, value_tag) in list_header.items():
+            try:
+                slice_value = element[value_tag][i]
+            except IndexError:
+                #print(f'Warning: tag {key} not defined for image {i}')
+                continue # tag not defined for all images
+            slice_dict[key] = {tag: value for tag, value in element.items() if tag != 'isList'}
+            slice_dict[key][value_tag] = slice_value
+        if '7FE00010' in list_header:
+            vr_std = slice_dict.get('7FE00010', {}).get('vr', 'OW')
+            slice_dict['7FE00010'] = {'vr': vr_std, 'InlineBinary': ''} # ensure empty pixel data
+
+        new_header = _clone_dataset(header_template)
+        new_header.update(pydicom.dataset.Dataset.from_json(slice_dict))
+
         # ensure file meta
         if compressed_meta is not None:
-            new_meta_dict = {}
-            for key, element in compressed_meta.items():
-
-                new_meta_dict[key] = copy.deepcopy(element)
-                if 'isList' in element:
-                    value_tag = _get_value_tag(element)
-                    new_meta_dict[key][value_tag] = element[value_tag][i]
-                    new_meta_dict[key].pop('isList')
-
-            new_meta = pydicom.dataset.FileMetaDataset.from_json(new_meta_dict)
+            slice_meta_dict = {}
+            for key, (element, value_tag) in list_meta.items():
+                slice_meta_dict[key] = {tag: value for tag, value in element.items() if tag != 'isList'}
+                slice_meta_dict[key][value_tag] = element[value_tag][i]
+            new_meta = _clone_dataset(meta_template)
+            new_meta.update(pydicom.dataset.FileMetaDataset.from_json(slice_meta_dict))
             new_header.file_meta = new_meta
             new_header.ensure_file_meta()
         else:
@@ -357,9 +652,23 @@ def remerge_headers(bids_dict, patient_dict, raw_header_dict):
     return raw_header_dict
 
 
+def _slice_index(slices_list):
+    """ Converts a list of indices to a slice object if the indices form a regular ascending range, so that the volume
+    can be indexed without copy. Returns None otherwise """
+    indices = [int(i) for i in slices_list]
+    if not indices:
+        return None
+    step = indices[1] - indices[0] if len(indices) > 1 else 1
+    if step <= 0 or any(b - a != step for a, b in zip(indices, indices[1:])):
+        return None
+    return slice(indices[0], indices[-1] + 1, step)
+
+
 def slice_volume_3d(medical_volume, slices_list):
     """
     This function extracts slices specified from the slices_list from the medical volume.
+    If the slices form a regular range, the volume of the result is a view of the original volume, otherwise it is a
+    copy.
 
     Parameters:
         medical_volume (MedicalVolume): the medical volume
@@ -368,44 +677,267 @@ def slice_volume_3d(medical_volume, slices_list):
     Returns:
         MedicalVolume: the extracted volume
     """
+    return split_volume_3d(medical_volume, {0: slices_list})[0]
+
+
+def _find_raw_key(named_key, tag_dict, raw_header_dict):
+    """ Returns the numerical key of the raw header that holds a named tag, or None if it is not in the header """
+    numerical_keys = tag_dict.inverse.get(named_key, [])
+    if not isinstance(numerical_keys, list):
+        numerical_keys = [numerical_keys]
+    for numerical_key in numerical_keys:
+        if numerical_key in raw_header_dict:
+            return numerical_key
+    return None
+
+
+def _copy_value(value):
+    """ Copies a header value. The strings and numbers are immutable and are not copied """
+    if isinstance(value, (list, dict)):
+        return copy.deepcopy(value)
+    return value
+
+
+def _copy_element(element):
+    """ Copies an element of a raw header (see _copy_value) """
+    return {key: _copy_value(value) for key, value in element.items()}
+
+
+def split_volume_3d(medical_volume, parts):
+    """
+    Extracts several sets of slices from the medical volume in a single pass over the headers.
+    The lists of per-slice values of the omids, patient and extra headers are sliced directly, and the lists whose
+    values are all equal in a part are collapsed to a single value. The headers of the parts are copies, they do not
+    share any list with the headers of the original volume.
+    The parts that form a regular range of slices are views of the original volume, the others are copies.
+
+    Parameters:
+        medical_volume (MedicalVolume): the medical volume
+        parts (dict): the lists of slices to extract, by name of the part
+
+    Returns:
+        dict: the extracted volumes, by name of the part
+    """
 
     n_dim = medical_volume.volume.ndim
     assert n_dim == 3, "Only 3D volumes are supported"
-    new_volume = np.copy(medical_volume.volume[:,:,slices_list])
-
-    headers = remerge_headers(medical_volume.omids_header, medical_volume.patient_header, medical_volume.extra_header)
-    new_headers = {}
-    for key, value in headers.items():
-        if 'isList' in value: # value is a list
-            new_value = copy.deepcopy(value)
-            value_tag = _get_value_tag(value)
-            new_value_list = []
-            for sl in slices_list:
-                try:
-                    new_value_list.append(value[value_tag][sl])
-                except IndexError:
-                    print(value)
-                    print(value_tag)
-                    sys.exit(-1)
+    n_slices = medical_volume.volume.shape[2]
+
+    raw_header = medical_volume.extra_header
+    new_raws = {name: {} for name in parts}
+    # numerical keys of the per-slice lists that are collapsed in each part
+    collapsed_keys = {name: set() for name in parts}
+    for key, value in raw_header.items():
+        value_tag = _get_value_tag(value)
+        if 'isList' not in value or not isinstance(value.get(value_tag), list):
+            # the per-slice lists of the patient tags are blanked, they are sliced from the patient header
+            for name in parts:
+                new_raws[name][key] = _copy_element(value)
+            continue
+        for name, slices_list in parts.items():
+            new_value = dict(value)
+            new_value_list = [_copy_value(value[value_tag][sl]) for sl in slices_list]
             if _list_all_equal(new_value_list):
                 new_value[value_tag] = new_value_list[0]
                 del new_value['isList']
+                collapsed_keys[name].add(key)
             else:
                 new_value[value_tag] = new_value_list
-
+            new_raws[name][key] = new_value
+
+    def slice_header(header, tag_dict, name, slices_list):
+        new_header = {}
+        for named_key, value in header.items():
+            numerical_key = _find_raw_key(named_key, tag_dict, raw_header)
+            if (numerical_key is None or 'isList' not in raw_header[numerical_key]
+                    or not isinstance(value, list) or len(value) != n_slices):
+                new_header[named_key] = copy.deepcopy(value)
+                continue
+            new_value_list = copy.deepcopy([value[sl] for sl in slices_list])
+            new_raw = new_raws[name][numerical_key]
+            if 'isList' in new_raw and isinstance(new_raw[_get_value_tag(new_raw)], list):
+                collapsed = False
+            else:
+                collapsed = numerical_key in collapsed_keys[name] or _list_all_equal(new_value_list)
+            if collapsed:
+                new_header[named_key] = new_value_list[0]
+                new_raw.pop('isList', None)
+            else:
+                new_header[named_key] = new_value_list
+        return new_header
+
+    new_volumes = {}
+    for name, slices_list in parts.items():
+        slice_index = _slice_index(slices_list)
+        if slice_index is not None:
+            new_volume = medical_volume.volume[:, :, slice_index]
         else:
-            new_value = copy.deepcopy(value)
-        new_headers[key] = new_value
-    new_bids, new_patient, new_raw = separate_headers(new_headers)
-    new_volume = MedicalVolume(new_volume, medical_volume.affine)
+            new_volume = np.copy(medical_volume.volume[:, :, slices_list])
+        new_omids = slice_header(medical_volume.omids_header, defined_tags, name, slices_list)
+        new_patient = slice_header(medical_volume.patient_header, patient_tags, name, slices_list)
+        new_volume = MedicalVolume(new_volume, medical_volume.affine)
+        setattr(new_volume, 'omids_header', new_omids)
+        setattr(new_volume, 'bids_header', new_omids)
+        setattr(new_volume, 'patient_header', new_patient)
+        setattr(new_volume, 'extra_header', new_raws[name])
+        setattr(new_volume, 'meta_header', copy.deepcopy(getattr(medical_volume, 'meta_header')))
+        new_volumes[name] = new_volume
+    return new_volumes
+
+
+def get_volume_part(medical_volume, get_indices, part, tags=None):
+    """
+    Extracts one part (e.g. the magnitude images) of a volume made of several types of images. All the parts are
+    extracted at once with split_volume_3d, and cached on the volume for all its converters (see
+    ormir_mids.utils.facts.volume_fact), so that the headers are processed once instead of once per part.
+    The parts are extracted again if the data or the headers of the volume, or the entries of the tags read by
+    get_indices, are replaced.
+
+    Parameters:
+        medical_volume (MedicalVolume): the medical volume
+        get_indices (callable): function of the volume returning the lists of slices of each part, usually decorated
+            with tag_fact. The parts without slices are ignored
+        part (str): the name of the part
+        tags (iterable): the DICOM tags read by get_indices. By default, the tags of its tag_fact decorator. If
+            they are not known, the parts are not cached
+
+    Returns:
+        MedicalVolume: the extracted volume. The headers are copies, down to their values, that can be modified by
+            the caller without modifying the cached parts or the original volume
+    """
+    def split():
+        parts = {name: slices_list for name, slices_list in get_indices(medical_volume).items() if len(slices_list) > 0}
+        return split_volume_3d(medical_volume, parts)
+
+    raw_tags = ()
+    if tags is None:
+        tags = getattr(get_indices, 'tags', None)
+        raw_tags = getattr(get_indices, 'raw_tags', ())
+    if tags is None:
+        parts = split()
+    else:
+        stamp = (medical_volume.volume, medical_volume.omids_header, medical_volume.patient_header,
+                 medical_volume.extra_header) + get_tag_stamp(medical_volume, tags, raw_tags)
+        parts = volume_fact(medical_volume, ('volume_parts', get_indices.__module__, get_indices.__qualname__),
+                            split, stamp)
+    part_volume = parts[part]
+    new_volume = MedicalVolume(part_volume.volume, part_volume.affine)
+    new_bids = copy.deepcopy(part_volume.omids_header)
     setattr(new_volume, 'omids_header', new_bids)
     setattr(new_volume, 'bids_header', new_bids)
-    setattr(new_volume, 'patient_header', new_patient)
-    setattr(new_volume, 'extra_header', new_raw)
-    setattr(new_volume, 'meta_header', getattr(medical_volume, 'meta_header'))
+    setattr(new_volume, 'patient_header', copy.deepcopy(part_volume.patient_header))
+    setattr(new_volume, 'extra_header', {key: _copy_element(value) for key, value in part_volume.extra_header.items()})
+    setattr(new_volume, 'meta_header', copy.deepcopy(part_volume.meta_header))
     return new_volume
 
 
+class MultiseriesAccumulator:
+    """
+    Concatenates 3D volumes along the slices as they arrive, e.g. the series of a multiseries group.
+
+    The output array is preallocated when the first volume arrives, assuming that all the volumes have its number of
+    slices, and each volume is copied into place, so the appended volumes can be released. The headers are kept as
+    one column of elements per tag and merged in a single pass when the concatenated volume is requested.
+    """
+
+    def __init__(self, n_volumes):
+        """
+        Parameters:
+            n_volumes (int): the expected number of volumes
+        """
+        self.n_volumes = n_volumes
+        self.n_slices_list = []
+        self.header_columns = None
+        self.affine = None
+        self.meta_header = None
+        self._data = None
+        self._n_slices_total = 0
+
+    def __len__(self):
+        return len(self.n_slices_list)
+
+    def _reserve(self, volume):
+        """ Makes sure that the volume fits after the slices that are already stored """
+        n_slices = volume.shape[2]
+        dtype = np.result_type(self._data.dtype, volume.dtype)
+        needed_slices = self._n_slices_total + n_slices
+        if needed_slices <= self._data.shape[2] and dtype == self._data.dtype:
+            return
+        # the volumes have a different number of slices or data type: allocate again for the remaining volumes
+        n_remaining_volumes = max(self.n_volumes - len(self.n_slices_list) - 1, 0)
+        new_data = np.empty(self._data.shape[:2] + (max(needed_slices + n_slices * n_remaining_volumes,
+                                                        self._data.shape[2]),), dtype=dtype)
+        new_data[:, :, :self._n_slices_total] = self._data[:, :, :self._n_slices_total]
+        self._data = new_data
+
+    def append(self, medical_volume):
+        """
+        Copies a volume after the previous ones and records its headers.
+
+        Parameters:
+            medical_volume (MedicalVolume): the 3D volume with headers
+        """
+        assert medical_volume.volume.ndim == 3, "Only 3D volumes are supported"
+        volume = medical_volume.volume
+        if self._data is None:
+            self._data = np.empty(volume.shape[:2] + (volume.shape[2] * max(self.n_volumes, 1),), dtype=volume.dtype)
+            self.affine = medical_volume.affine
+            self.meta_header = getattr(medical_volume, 'meta_header')
+        else:
+            assert volume.shape[:2] == self._data.shape[:2], "All volumes must have the same 2D size"
+            self._reserve(volume)
+
+        n_slices = volume.shape[2]
+        self._data[:, :, self._n_slices_total:self._n_slices_total + n_slices] = volume
+
+        remerged_header = remerge_headers(medical_volume.omids_header, medical_volume.patient_header,
+                                          medical_volume.extra_header)
+        if self.header_columns is None:
+            # the tags of the first volume are the tags of the concatenated volume
+            self.header_columns = {tag: [] for tag in remerged_header}
+        for tag, column in self.header_columns.items():
+            column.append(remerged_header[tag])
+
+        self.n_slices_list.append(n_slices)
+        self._n_slices_total += n_slices
+
+    def _merge_column(self, column):
+        first_element = column[0]
+        if all('isList' not in element and element == first_element for element in column):
+            return copy.deepcopy(first_element)
+
+        value_tag = _get_value_tag(first_element)
+        values = []
+        for element, n_slices in zip(column, self.n_slices_list):
+            if 'isList' in element:
+                values.extend(element[value_tag])
+            else:
+                values.extend([element[value_tag]] * n_slices)
+        new_element = copy.deepcopy({key: value for key, value in first_element.items() if key != value_tag})
+        new_element['isList'] = True
+        new_element[value_tag] = values
+        return new_element
+
+    def get_volume(self):
+        """
+        Builds the concatenated volume from the volumes appended so far.
+
+        Returns:
+            MedicalVolume: the concatenated volume
+        """
+        assert len(self.n_slices_list) > 0, "No volume was appended"
+        new_headers_dict = {tag: self._merge_column(column) for tag, column in self.header_columns.items()}
+
+        new_bids, new_patient, new_raw = separate_headers(new_headers_dict)
+        new_volume = MedicalVolume(self._data[:, :, :self._n_slices_total], self.affine)
+        setattr(new_volume, 'omids_header', new_bids)
+        setattr(new_volume, 'bids_header', new_bids) # for compatibility
+        setattr(new_volume, 'patient_header', new_patient)
+        setattr(new_volume, 'extra_header', new_raw)
+        setattr(new_volume, 'meta_header', self.meta_header)
+        return new_volume
+
+
 def concatenate_volumes_3d(volumes_list):
     """ This function concatenates a list of 3d volumes into one single 3D volume
 
@@ -416,62 +948,46 @@ def concatenate_volumes_3d(volumes_list):
         MedicalVolume: the concatenated volume
     """
     assert len(volumes_list) > 0, "volumes_list is empty"
-    assert all(map(lambda x: x.volume.ndim == 3, volumes_list)), "Only 3D volumes are supported"
-
-    volume_2D_sizes = [ (x.volume.shape[0], x.volume.shape[1]) for x in volumes_list ]
-    assert _list_all_equal(volume_2D_sizes), "All volumes must have the same 2D size"
-
-    # create the new pixel data
-    new_volume = np.concatenate([x.volume for x in volumes_list], axis=2)
+    accumulator = MultiseriesAccumulator(len(volumes_list))
+    for medical_volume in volumes_list:
+        accumulator.append(medical_volume)
+    return accumulator.get_volume()
 
-    n_slices_list = [x.volume.shape[2] for x in volumes_list]
 
-    remerged_header_list = [ remerge_headers(x.omids_header, x.patient_header, x.extra_header) for x in volumes_list ]
+def _group_codes(all_values):
+    """
+    Assigns a group to each slice according to its value.
 
-    all_tags = remerged_header_list[0].keys()
-    new_headers_dict = {}
+    Parameters:
+        all_values (list): the value of each slice
 
-    #iterate over all keys and concatenate the values
-    for tag in all_tags:
-        for header_index, header in enumerate(remerged_header_list):
-            if tag not in new_headers_dict:
-                new_headers_dict[tag] = copy.deepcopy(header[tag])
-            value_tag = _get_value_tag(new_headers_dict[tag])
-            if 'isList' in new_headers_dict[tag]:
-                if 'isList' in header[tag]:
-                    # the tag is a list before and after
-                    new_headers_dict[tag][value_tag] += header[tag][value_tag]
-                else:
-                    # the tag is a list before, but not after
-                    # extend the list of values with another list of copied values with the length as the number of slices
-                    new_headers_dict[tag][value_tag] += [header[tag][value_tag]]*n_slices_list[header_index]
-            else:
-                if 'isList' in header[tag]:
-                    # the tag is not a list before, but after yes.
-                    new_headers_dict[tag]['isList'] = True # make it a list
-                    n_slices_so_far = sum(n_slices_list[:header_index])
-                    new_headers_dict[tag][value_tag] = [header[tag][value_tag]]*n_slices_so_far + new_headers_dict[tag][value_tag]
-                else:
-                    # the tag is not a list before and after
-                    if new_headers_dict[tag] == header[tag]:
-                        # the tag is the same before and after
-                        pass
-                    else:
-                        # the tag is different before and after
-                        # make it a list
-                        new_headers_dict[tag]['isList'] = True  # make it a list
-                        n_slices_so_far = sum(n_slices_list[:header_index])
-                        new_headers_dict[tag][value_tag] = [header[tag][value_tag]] * n_slices_so_far + \
-                                                           [new_headers_dict[tag][value_tag]] * n_slices_list[header_index]
-
-    new_bids, new_patient, new_raw = separate_headers(new_headers_dict)
-    new_volume = MedicalVolume(new_volume, volumes_list[0].affine)
-    setattr(new_volume, 'omids_header', new_bids)
-    setattr(new_volume, 'bids_header', new_bids) # for compatibility
-    setattr(new_volume, 'patient_header', new_patient)
-    setattr(new_volume, 'extra_header', new_raw)
-    setattr(new_volume, 'meta_header', getattr(volumes_list[0], 'meta_header'))
-    return new_volume
+    Returns:
+        (np.ndarray, list, list): the group of each slice, the value of each group (both numbered in order of first
+            appearance), and the groups sorted by value (in order of first appearance if the values cannot be sorted)
+    """
+    if all_values and all(type(value) in (int, float) for value in all_values) \
+            and not np.isnan(np.asarray(all_values, dtype=np.float64)).any():
+        unique_values, first_indices, inverse = np.unique(np.asarray(all_values), return_index=True,
+                                                          return_inverse=True)
+        appearance_order = np.argsort(first_indices, kind='stable')
+        group_of_sorted = np.empty(len(unique_values), dtype=np.intp)
+        group_of_sorted[appearance_order] = np.arange(len(unique_values))
+        group_values = [all_values[i] for i in first_indices[appearance_order]]
+        return group_of_sorted[inverse.ravel()], group_values, group_of_sorted.tolist()
+
+    group_dict = {}
+    codes = np.empty(len(all_values), dtype=np.intp)
+    for index, value in enumerate(all_values):
+        if type(value) == list:
+            value = tuple(value)
+        codes[index] = group_dict.setdefault(value, len(group_dict))
+    group_values = list(group_dict)
+    try:
+        sorted_groups = sorted(range(len(group_values)), key=group_values.__getitem__)
+    except TypeError:
+        print('Warning: could not sort indices_dict')
+        sorted_groups = list(range(len(group_values)))
+    return codes, group_values, sorted_groups
 
 
 def group(medical_volume, key):
@@ -491,61 +1007,47 @@ def group(medical_volume, key):
     assert medical_volume.ndim == 3, 'Error grouping: medical volume must be three dimensional'
     assert key in medical_volume.omids_header, f'Error: medical volume does not have {key}'
 
-    indices_dict = OrderedDict({})
     all_values = medical_volume.omids_header[key]
     if type(all_values) != list:
         return medical_volume  # nothing to do
 
-    # get all indices corresponding to separate values
-    for index, value in enumerate(all_values):
-        if type(value) == list:
-            real_value = tuple(value)
-        else:
-            real_value = value
-        if real_value not in indices_dict:
-            indices_dict[real_value] = []
-        indices_dict[real_value].append(index)
-
-    array_stack = []
-
-    try:
-        items = sorted(indices_dict.items())
-    except TypeError:
-        print('Warning: could not sort indices_dict')
-        items = indices_dict.items()
-
-    for _,index_list in items:
-        array_stack.append(medical_volume.volume[:, :, index_list])
-
-    new_volume = np.stack(array_stack, axis=3)
+    codes, group_values, sorted_groups = _group_codes(all_values)
+    n_groups = len(group_values)
+    group_sizes = np.bincount(codes, minlength=n_groups)
+    if np.any(group_sizes != group_sizes[0]):
+        raise ValueError(f'Error grouping: the groups of {key} do not have the same number of slices')
+    # slices of each group, in order of first appearance of the groups
+    group_indices = np.argsort(codes, kind='stable').reshape((n_groups, group_sizes[0]))
+
+    # the 4D volume is filled one row at a time, so that no intermediate copy of the whole data is needed
+    volume = medical_volume.volume
+    new_volume = np.empty(volume.shape[:2] + (group_sizes[0], n_groups), dtype=volume.dtype)
+    source_indices = group_indices[sorted_groups].T.ravel()
+    for row in range(volume.shape[0]):
+        np.take(volume[row], source_indices, axis=1, out=new_volume[row].reshape((volume.shape[1], -1)))
 
     medical_volume_out = MedicalVolume(new_volume, medical_volume.affine)
 
     copy_headers(medical_volume, medical_volume_out)
 
+    # the lists of the headers are indexed [slice][group]. Note: the groups are in order of first appearance
+    header_indices = group_indices.T.tolist()
+    max_index = int(group_indices.max())
+
     def group_tags(header):
         for tag, element in header.items():
             if type(element) != dict: continue
             if 'isList' in element:
                 value_tag = _get_value_tag(element)
-                new_value_list = [[] for x in range(new_volume.shape[2])]
-                new_value_list_ok = True
-                try:
-                    for outer_index, inner_index_list in enumerate(indices_dict.values()):
-                        for inner_list_index, value_index in enumerate(inner_index_list):
-                            value = element[value_tag][value_index]
-                            new_value_list[inner_list_index].append(value)
-
-                except IndexError:
-                    #print('IndexError', key, element)
-                    new_value_list_ok = False
-                if new_value_list_ok:
-                    element[value_tag] = new_value_list
-                    element['is4dList'] = True
+                values = element[value_tag]
+                if max_index >= len(values):
+                    continue # the tag is not defined for all the slices
+                element[value_tag] = [list(map(values.__getitem__, index_list)) for index_list in header_indices]
+                element['is4dList'] = True
 
 
     medical_volume_out.omids_header['FourthDimension'] = key
-    medical_volume_out.omids_header[key] = [i[0] for i in items]  # only keep the different values
+    medical_volume_out.omids_header[key] = [group_values[i] for i in sorted_groups]  # only keep the different values
     group_tags(medical_volume_out.extra_header)
     group_tags(medical_volume_out.meta_header)
 
@@ -577,7 +1079,11 @@ def ungroup(medical_volume):
     new_shape = (medical_volume.shape[0], medical_volume.shape[1], medical_volume.shape[2]*fourth_dimension_size)
     if fourth_dimension_size > 1:
         # make sure that slices are the fastest-changing index loop, otherwise saving dicom fails
-        new_volume = np.reshape(medical_volume.volume.transpose([0,1,3,2]), new_shape)
+        volume = medical_volume.volume
+        new_volume = np.empty(new_shape, dtype=volume.dtype)
+        for row in range(new_shape[0]):
+            new_volume[row].reshape((new_shape[1], fourth_dimension_size, n_slices))[...] = \
+                volume[row].transpose([0, 2, 1])
     else:
         new_volume = medical_volume.volume
 
@@ -586,19 +1092,16 @@ def ungroup(medical_volume):
 
     fourth_dimension_key = medical_volume.omids_header['FourthDimension']
     fourth_dimension_value = medical_volume.omids_header[fourth_dimension_key]
-    new_fourth_dimension_value = list(itertools.chain(*[ [x]*n_slices for x in fourth_dimension_value ]))
     # multiply the value list
+    new_fourth_dimension_value = [x for x in fourth_dimension_value for _ in range(n_slices)]
 
     def ungroup_tags(header):
         for tag, element in header.items():
             if type(element) != dict: continue
             if 'is4dList' in element:
                 value_tag = _get_value_tag(element)
-                new_value_list = list(
-                    itertools.chain(
-                        *[list(x) for x in zip(*element[value_tag])]
-                        )) # reconcatenate element list
-                element[value_tag] = new_value_list
+                # reconcatenate element list
+                element[value_tag] = [value for group_values in zip(*element[value_tag]) for value in group_values]
                 element.pop('is4dList')
 
     medical_volume_out.omids_header.pop('FourthDimension')
@@ -653,8 +1156,8 @@ def bids_volume_to_dicom(medical_volume, new_series=False):
     new_header_list = dicts_to_headers(medical_volume.shape[2], merged_header, meta_header)
 
     new_series_uid = generate_uid()
-    for header in new_header_list:
-        header.SOPInstanceUID = generate_uid()
+    for header, sop_instance_uid in zip(new_header_list, generate_uids(len(new_header_list))):
+        header.SOPInstanceUID = sop_instance_uid
         if new_series:
             header.SeriesInstanceUID = new_series_uid
 
@@ -686,6 +1189,76 @@ def reduce(med_volume, index):
     return new_volume
 
 
+# tags of the raw header that describe the position and the order of the slices
+SLICE_GEOMETRY_TAGS = ('00200032', '00200037', '00201041', '00280030', '00180050', '00180088', '00280010',
+                       '00280011', '00200013')
+
+
+def copy_realigned_headers(source, destination, realigned):
+    """
+    Sets the headers of a volume realigned from a source to the grid of a destination. The headers of the source are
+    copied, except its per-slice entries, which describe the slices of the source: the geometry of the slices (see
+    SLICE_GEOMETRY_TAGS) is taken from the destination, and the other per-slice entries are dropped. The entries of a
+    4D source that are the same for all the slices, and only change along the fourth dimension (e.g. the echo
+    times), are kept.
+
+    Parameters:
+        source (MedicalVolume): the realigned volume (3D or 4D)
+        destination (MedicalVolume): the volume whose grid was used
+        realigned (MedicalVolume): the result of the realignment, with the shape of the destination
+
+    Returns:
+        No return value
+    """
+    copy_headers(source, realigned)
+    n_slices = realigned.shape[2]
+    n_groups = realigned.shape[3] if realigned.ndim == 4 else None
+    extra_header = realigned.extra_header
+    omids_header = realigned.omids_header
+    patient_header = realigned.patient_header
+    fourth_dimension_key = (omids_header or {}).get('FourthDimension')
+
+    def drop_slice_tags(header):
+        if not header:
+            return
+        for tag in list(header):
+            element = header[tag]
+            if type(element) != dict or 'isList' not in element:
+                continue
+            value_tag = _get_value_tag(element)
+            values = element[value_tag]
+            if 'is4dList' in element and _list_all_equal(values):
+                element[value_tag] = [list(values[0]) for _ in range(n_slices)]
+                continue
+            del header[tag]
+            # the named entries of the tag are per-slice lists too, except the values of the fourth dimension
+            for named_header, tag_dict in ((omids_header, defined_tags), (patient_header, patient_tags)):
+                if not named_header or tag not in tag_dict:
+                    continue
+                for named_tag in tag_dict.get_named_tags(tag):
+                    if named_tag != fourth_dimension_key:
+                        named_header.pop(named_tag, None)
+
+    drop_slice_tags(extra_header)
+    drop_slice_tags(realigned.meta_header)
+
+    destination_header = getattr(destination, 'extra_header', None) or {}
+    if extra_header is None:
+        return
+    for tag in SLICE_GEOMETRY_TAGS:
+        extra_header.pop(tag, None)
+        if tag not in destination_header:
+            continue
+        element = copy.deepcopy(destination_header[tag])
+        if n_groups is not None and 'isList' in element:
+            # the per-slice lists of a 4D volume are indexed [slice][group]
+            value_tag = _get_value_tag(element)
+            element[value_tag] = [[value] * n_groups for value in element[value_tag]]
+            element['is4dList'] = True
+        extra_header[tag] = element
+
+
+@tag_fact('00080070')
 def get_manufacturer(med_volume: MedicalVolume):
     """
     Gets the scanner manufacturer
@@ -697,10 +1270,10 @@ def get_manufacturer(med_volume: MedicalVolume):
         str: the manufacturer always uppercase
     """
 
-    manufacturer = get_raw_tag_value(med_volume, '00080070')[0]
-    return manufacturer.upper()
+    return get_raw_tag_value(med_volume, '00080070')[0].upper()
 
 
+@tag_fact('00080060')
 def get_modality(med_volume: MedicalVolume):
     """
     Gets the imaging modality
@@ -712,5 +1285,4 @@ def get_modality(med_volume: MedicalVolume):
         str: the modality always uppercase
     """
 
-    modality = get_raw_tag_value(med_volume, '00080060')[0]
-    return modality.upper()
+    return get_raw_tag_value(med_volume, '00080060')[0].upper()
@@ -1,25 +1,362 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from .OMidsMedVolume import OMidsMedVolume as MedicalVolume
+from .headers import copy_realigned_headers
 import numpy as np
-from scipy.ndimage import map_coordinates
+from scipy.ndimage import map_coordinates, spline_filter
+
+# default maximum size of the temporary arrays of a realignment, in bytes
+REALIGN_MEMORY_BUDGET = 256 * 1024 ** 2
+
+# default maximum difference between a transform and a permutation, flip or shift of whole voxels, in voxels
+REALIGN_EXACT_TOLERANCE = 1e-6
+
+# modes of realignment of label maps (segmentations)
+REALIGN_LABEL_MODES = ('nearest', 'majority')
+
+# size of the temporary arrays for each voxel of the destination: homogeneous coordinates on the target grid and on
+# the source grid, both float64
+_COORDINATES_BYTES_PER_VOXEL = 2 * 4 * 8
+
+
+def _get_slab_size(shape, bytes_per_voxel, memory_budget, num_threads):
+    """
+    Number of destination slices along z that are realigned at once, so that the temporary arrays of all the threads
+    fit in the memory budget. At least one slice is realigned at once.
+    """
+    slice_bytes = shape[0] * shape[1] * bytes_per_voxel * max(num_threads, 1)
+    return int(min(shape[2], max(1, memory_budget // max(slice_bytes, 1))))
+
+
+def _get_source_coordinates(transform, shape, z_start, z_stop, z_offset=0):
+    """
+    Computes the coordinates in the source grid of a slab of the destination grid.
+
+    Parameters:
+        transform (np.ndarray): the 4x4 affine matrix from the destination grid to the source grid
+        shape (tuple): the shape of the destination
+        z_start (int): the first slice of the slab
+        z_stop (int): the slice after the last one of the slab
+        z_offset (float): offset added to the z coordinates of the destination
+
+    Returns:
+        np.ndarray: the coordinates, shape [3, x, y, z_stop - z_start]
+    """
+    slab_shape = (shape[0], shape[1], z_stop - z_start)
+    shape_as_range = (np.arange(shape[0]),
+                      np.arange(shape[1]),
+                      np.arange(z_start, z_stop) + z_offset)
+
+    coords = np.empty((4,) + slab_shape, dtype=float)
+    coords[:3] = np.meshgrid(*shape_as_range, indexing='ij')
+    # Add additional dimension with 1 to each coordinate to make work with 4x4 affine matrix
+    coords[3] = 1
+    coords = coords.reshape([4, -1])  # shape: [4, x*y*z]
+
+    # transform the coords from target grid to the space of source image
+    coords_src = transform @ coords  # shape: [4, x*y*z]
+    return coords_src.reshape((4,) + slab_shape)[:3, ...]  # shape: [3, x, y, z]
+
+
+def _z_offset_matrix(z_offset):
+    """ Affine matrix adding an offset to the z coordinates """
+    offset_matrix = np.eye(4)
+    offset_matrix[2, 3] = z_offset
+    return offset_matrix
+
+
+def _prefilter(volume, interpolation_order, compute_dtype=np.float64):
+    """
+    Computes the spline coefficients of a volume, as map_coordinates does when prefilter is True, so that they can
+    be reused for several calls of map_coordinates with prefilter=False. The coefficients are stored as compute_dtype
+    (or the complex type of the same precision for complex volumes).
+    """
+    if interpolation_order <= 1:
+        return volume
+    compute_dtype = np.dtype(compute_dtype)
+    if np.iscomplexobj(volume):
+        compute_dtype = np.result_type(compute_dtype, np.complex64)
+    return spline_filter(volume, interpolation_order, output=compute_dtype)
+
+
+def _get_coordinates_getter(transform, target_shape, slab_size, z_offset, keep_coordinates):
+    """
+    Returns a function giving the coordinates in the source grid of the slab of the destination starting at a slice.
+    If keep_coordinates is True, the coordinates of each slab are only computed once.
+    """
+    coordinates_cache = {}
+
+    def get_coordinates(z_start):
+        coords_src = coordinates_cache.get(z_start)
+        if coords_src is None:
+            z_stop = min(z_start + slab_size, target_shape[2])
+            coords_src = _get_source_coordinates(transform, target_shape, z_start, z_stop, z_offset)
+            if keep_coordinates:
+                coordinates_cache[z_start] = coords_src
+        return coords_src
+
+    return get_coordinates
+
+
+def _run_slabs(function, slab_starts, num_threads):
+    """ Calls a function for each slab, on several threads if num_threads > 1 """
+    if num_threads > 1:
+        # map_coordinates releases the GIL
+        with ThreadPoolExecutor(num_threads) as executor:
+            list(executor.map(function, slab_starts))
+    else:
+        for z_start in slab_starts:
+            function(z_start)
+
+
+def _realign_arrays(arrays, outputs, transform, target_shape, interpolation_order, memory_budget, num_threads,
+                    z_offset=0, compute_dtype=np.float64):
+    """
+    Interpolates 3D arrays that share the same grid on the grid of the destination, by slabs of slices.
+
+    The spline coefficients are computed once per array. The coordinates of the destination in the source grid are
+    computed once for all the arrays if they fit in the memory budget, otherwise they are computed again for each
+    array.
+
+    Parameters:
+        arrays (list): the 3D source arrays
+        outputs (list): the 3D output arrays, with the shape of the destination
+        transform (np.ndarray): the 4x4 affine matrix from the destination grid to the source grid
+        target_shape (tuple): the shape of the destination
+        interpolation_order (int): spline interpolation order
+        memory_budget (int): maximum size in bytes of the temporary arrays
+        num_threads (int): number of threads interpolating the slabs in parallel
+        z_offset (float): offset added to the z coordinates of the destination
+        compute_dtype (np.dtype): data type of the spline coefficients
+
+    Returns:
+        None
+    """
+    bytes_per_voxel = _COORDINATES_BYTES_PER_VOXEL + max(output.itemsize for output in outputs)
+    slab_size = _get_slab_size(target_shape, bytes_per_voxel, memory_budget, num_threads)
+    slab_starts = range(0, target_shape[2], slab_size)
+
+    # the coordinates of the slabs are kept for the next arrays if all of them fit in the budget
+    keep_coordinates = len(arrays) > 1 and \
+        int(np.prod(target_shape[:3])) * _COORDINATES_BYTES_PER_VOXEL // 2 <= memory_budget
+    get_coordinates = _get_coordinates_getter(transform, target_shape, slab_size, z_offset, keep_coordinates)
+
+    for array, output in zip(arrays, outputs):
+        # the spline coefficients are computed once for all the slabs
+        coefficients = _prefilter(array, interpolation_order, compute_dtype)
+
+        def realign_slab(z_start):
+            coords_src = get_coordinates(z_start)
+            # Will create a image with the spatial size of coords_src. Each
+            # coordinate contains a place in the source image from which the intensity is taken
+            # and filled into the new image. If the coordinate is not within the range of the source image then
+            # will be filled with 0.
+            output[:, :, z_start:z_start + coords_src.shape[3]] = map_coordinates(
+                coefficients, coords_src, order=interpolation_order, output=output.dtype, prefilter=False)
+
+        _run_slabs(realign_slab, slab_starts, num_threads)
 
 
-def realign_medical_volume(source: MedicalVolume, destination: MedicalVolume, interpolation_order: int = 3):
+def _vote_labels(arrays, outputs, transform, target_shape, memory_budget, num_threads, z_offset=0):
+    """
+    Realigns 3D label maps that share the same grid by per-label majority: each destination voxel gets the label
+    with the largest trilinear weight among the source voxels around it. Each label is interpolated as a binary mask,
+    by slabs of slices, and the outputs keep the data type of the labels. The destination voxels outside of the
+    source are set to 0.
+
+    Parameters:
+        arrays (list): the 3D source label maps
+        outputs (list): the 3D output arrays, with the shape of the destination
+        transform (np.ndarray): the 4x4 affine matrix from the destination grid to the source grid
+        target_shape (tuple): the shape of the destination
+        memory_budget (int): maximum size in bytes of the temporary arrays
+        num_threads (int): number of threads interpolating the slabs in parallel
+        z_offset (float): offset added to the z coordinates of the destination
+
+    Returns:
+        None
+    """
+    # the coordinates are used once per label: keep them if they fit in half of the budget, the other half is used
+    # by the slabs
+    keep_coordinates = int(np.prod(target_shape[:3])) * _COORDINATES_BYTES_PER_VOXEL // 2 <= memory_budget // 2
+    if keep_coordinates:
+        memory_budget = memory_budget // 2
+
+    # the coordinates and the weight of the label
+    bytes_per_voxel = _COORDINATES_BYTES_PER_VOXEL + 4
+    slab_size = _get_slab_size(target_shape, bytes_per_voxel, memory_budget, num_threads)
+    slab_starts = range(0, target_shape[2], slab_size)
+    get_coordinates = _get_coordinates_getter(transform, target_shape, slab_size, z_offset, keep_coordinates)
+
+    for array, output in zip(arrays, outputs):
+        output[...] = 0
+        best_weights = np.zeros(target_shape, dtype=np.float32)
+        for label in np.unique(array):
+            mask = (array == label).view(np.uint8)
+
+            def vote_slab(z_start):
+                coords_src = get_coordinates(z_start)
+                z_stop = z_start + coords_src.shape[3]
+                weights = map_coordinates(mask, coords_src, order=1, output=np.float32, prefilter=False)
+                best_slab = best_weights[:, :, z_start:z_stop]
+                # ties keep the smallest label
+                is_better = weights > best_slab
+                best_slab[is_better] = weights[is_better]
+                output[:, :, z_start:z_stop][is_better] = label
+
+            _run_slabs(vote_slab, slab_starts, num_threads)
+
+
+def _get_exact_mapping(transform, tolerance):
+    """
+    Checks if a transform from the destination grid to the source grid only permutes and flips the axes and shifts
+    them by whole voxels, so that the realignment does not need any interpolation.
+
+    Parameters:
+        transform (np.ndarray): the 4x4 affine matrix from the destination grid to the source grid
+        tolerance (float): maximum difference between the transform and an exact mapping, in voxels
+
+    Returns:
+        list: for each axis of the destination, the source axis, the direction (1 or -1) and the source index of the
+            first destination voxel. None if the transform is not an exact mapping
+    """
+    if tolerance is None:
+        return None
+    rounded_transform = np.round(transform)
+    if not np.allclose(transform, rounded_transform, rtol=0, atol=tolerance) or \
+            not np.array_equal(rounded_transform[3], [0, 0, 0, 1]):
+        return None
+    rotation = rounded_transform[:3, :3]
+    if not np.array_equal(np.abs(rotation).sum(axis=0), [1, 1, 1]) or \
+            not np.array_equal(np.abs(rotation).sum(axis=1), [1, 1, 1]):
+        return None
+    mapping = []
+    for destination_axis in range(3):
+        source_axis = int(np.flatnonzero(rotation[:, destination_axis])[0])
+        mapping.append((source_axis, int(rotation[source_axis, destination_axis]),
+                        int(rounded_transform[source_axis, 3])))
+    return mapping
+
+
+def _get_exact_slices(source_shape, destination_shape, mapping):
+    """
+    Computes the part of the source that is copied to the destination by an exact mapping (see _get_exact_mapping).
+
+    Returns:
+        (tuple, tuple): the slices of the source, with the axes in the order of the destination, and the slices of the
+            destination. None if the destination does not overlap the source
+    """
+    source_slices = []
+    destination_slices = []
+    for destination_size, (source_axis, direction, first_index) in zip(destination_shape, mapping):
+        # the destination index d reads the source index first_index + direction * d
+        source_size = source_shape[source_axis]
+        if direction > 0:
+            d_start = max(0, -first_index)
+            d_stop = min(destination_size, source_size - first_index)
+        else:
+            d_start = max(0, first_index - source_size + 1)
+            d_stop = min(destination_size, first_index + 1)
+        if d_stop <= d_start:
+            return None
+        s_start = first_index + direction * d_start
+        s_stop = first_index + direction * d_stop
+        source_slices.append(slice(s_start, s_stop if s_stop >= 0 else None, direction))
+        destination_slices.append(slice(d_start, d_stop))
+    return tuple(source_slices), tuple(destination_slices)
+
+
+def _copy_exact(arrays, outputs, mapping):
+    """
+    Realigns 3D arrays by permuting, flipping and shifting their axes (see _get_exact_mapping). The voxels of the
+    destination that are outside of the source are set to 0, as by map_coordinates.
+    """
+    source_axes = [source_axis for source_axis, _, _ in mapping]
+    for array, output in zip(arrays, outputs):
+        slices = _get_exact_slices(array.shape, output.shape, mapping)
+        if slices is None:
+            output[...] = 0
+            continue
+        source_slices, destination_slices = slices
+        if output[destination_slices].shape != output.shape:
+            # the destination is not inside the source
+            output[...] = 0
+        output[destination_slices] = array.transpose(source_axes)[source_slices]
+
+
+def realign_medical_volume(source: MedicalVolume, destination: MedicalVolume, interpolation_order: int = 3,
+                           memory_budget: int = REALIGN_MEMORY_BUDGET, num_threads: int = 1,
+                           exact_tolerance: float = REALIGN_EXACT_TOLERANCE,
+                           label_mode: str = None, compute_dtype=np.float64):
     """Realign this volume to the image space of another volume. Similar to ``reformat_as``,
     except that it supports fine rotations, translations and shape changes, so that the affine
     matrix and extent of the modified volume is identical to the one of the target.
 
+    The destination is computed in slabs of slices along its z-axis, so that the temporary coordinate arrays do not
+    exceed the memory budget. The result does not depend on the size of the slabs.
+    A 4D source is realigned volume by volume along its fourth dimension, with the same coordinates. The realigned
+    volume keeps the headers of the source (e.g. the echo times), except the per-slice entries, and the geometry of
+    the slices is taken from the destination (see headers.copy_realigned_headers).
+    If the grids only differ by a permutation or a flip of the axes and a shift of whole voxels, the voxels are copied
+    without interpolation.
+    Label maps (segmentations) should be realigned with a label_mode, so that the labels are not blurred: 'nearest'
+    takes the label of the nearest source voxel, 'majority' the label with the largest trilinear weight around the
+    destination voxel (each label is interpolated as a binary mask, so it is slower with many labels). Both keep the
+    data type of the source and do not compute any spline coefficients.
 
     Parameters:
-        source (MedicalVolume): The volume to realign
+        source (MedicalVolume): The volume to realign (3D or 4D)
         destination (MedicalVolume): The realigned volume will have the same extent and affine matrix of ``destination``.
         interpolation_order (int, optional): spline interpolation order.
+        memory_budget (int, optional): maximum size in bytes of the temporary arrays used for the interpolation
+            (not counting the source, its spline coefficients and the output)
+        num_threads (int, optional): number of threads interpolating the slabs in parallel
+        exact_tolerance (float, optional): maximum difference, in voxels, between the transform of the grids and a
+            permutation, flip or shift of whole voxels to copy the voxels without interpolation. None to always
+            interpolate
+        label_mode (str, optional): None to interpolate intensities, 'nearest' or 'majority' for label maps. The
+            interpolation order is not used for label maps
+        compute_dtype (np.dtype, optional): data type of the spline coefficients. np.float32 halves their memory,
+            with a precision that is enough for most intensity images
 
     Returns:
         MedicalVolume: The realigned volume.
     """
+    return realign_medical_volumes([source], destination, interpolation_order, memory_budget, num_threads,
+                                   exact_tolerance, label_mode, compute_dtype)[0]
+
+
+def realign_medical_volumes(sources, destination: MedicalVolume, interpolation_order: int = 3,
+                            memory_budget: int = REALIGN_MEMORY_BUDGET, num_threads: int = 1,
+                            exact_tolerance: float = REALIGN_EXACT_TOLERANCE,
+                            label_mode: str = None, compute_dtype=np.float64):
+    """Realign several volumes to the image space of the same volume (see realign_medical_volume).
+
+    The sources with the same affine matrix share the coordinates of the destination in their grid, which are only
+    computed once if they fit in the memory budget.
+
+    Parameters:
+        sources (list): The volumes to realign (3D or 4D)
+        destination (MedicalVolume): The realigned volumes will have the same extent and affine matrix of
+            ``destination``.
+        interpolation_order (int, optional): spline interpolation order.
+        memory_budget (int, optional): maximum size in bytes of the temporary arrays used for the interpolation
+            (not counting the sources, their spline coefficients and the outputs)
+        num_threads (int, optional): number of threads interpolating the slabs in parallel
+        exact_tolerance (float, optional): maximum difference, in voxels, between the transform of the grids and a
+            permutation, flip or shift of whole voxels to copy the voxels without interpolation. None to always
+            interpolate
+        label_mode (str, optional): None to interpolate intensities, 'nearest' or 'majority' for label maps
+        compute_dtype (np.dtype, optional): data type of the spline coefficients
+
+    Returns:
+        list: The realigned volumes, in the order of the sources.
+    """
+    if label_mode is not None and label_mode not in REALIGN_LABEL_MODES:
+        raise ValueError(f'Unknown label mode {label_mode}, must be one of {REALIGN_LABEL_MODES}')
 
-    target = destination.volume
-    print("Alignment target shape:", target.shape)
+    target_shape = destination.shape[:3]
+    print("Alignment target shape:", destination.shape)
 
     # disregard our own slice thickness for the moment
     # calculate the difference from the center of each 3D "partition" and the real center of the 2D slice
@@ -30,32 +367,39 @@ def realign_medical_volume(source: MedicalVolume, destination: MedicalVolume, in
     # seems to be the norm, hence the z_offset is 0
     # z_offset = (other_thickness/other.pixel_spacing[2]/2 - 1/2) #(other_thickness - other.pixel_spacing[2])/2
 
-    shape_as_range = (np.arange(target.shape[0]),
-                      np.arange(target.shape[1]),
-                      np.arange(target.shape[2]) + z_offset)
-
-    coords = np.array(np.meshgrid(*shape_as_range, indexing='ij')).astype(float)
-
-    # Add additional dimension with 1 to each coordinate to make work with 4x4 affine matrix
-    addon = np.ones([1, coords.shape[1], coords.shape[2], coords.shape[3]])
-    coords = np.concatenate([coords, addon], axis=0)  # shape: [4, x, y, z]
-    coords = coords.reshape([4, -1])  # shape: [4, x*y*z]
-
-    # build affine which maps from target grid to source grid
-    aff_transf = np.linalg.inv(source.affine) @ destination.affine
-
-    # transform the coords from target grid to the space of source image
-    coords_src = aff_transf @ coords  # shape: [4, x*y*z]
-
-    # reshape to original spatial dimensions
-    coords_src = coords_src.reshape((4,) + target.shape)[:3, ...]  # shape: [3, x, y, z]
-
-    # Will create a image with the spatial size of coords_src (with is target.shape). Each
-    # coordinate contains a place in the source image from which the intensity is taken
-    # and filled into the new image. If the coordinate is not within the range of the source image then
-    # will be filled with 0.
-    src_transf_data = map_coordinates(source.volume, coords_src, order=interpolation_order)
+    realigned_volumes = []
+    # affine matrix, 3D arrays and outputs of the sources that have the same affine matrix
+    geometry_groups = {}
+    for source in sources:
+        source_volume = source.volume
+        assert source_volume.ndim in (3, 4), 'Only 3D and 4D volumes can be realigned'
+        src_transf_data = np.empty(target_shape + source_volume.shape[3:], dtype=source_volume.dtype)
+        _, arrays, outputs = geometry_groups.setdefault(np.asarray(source.affine, dtype=float).tobytes(),
+                                                        (source.affine, [], []))
+        if source_volume.ndim == 4:
+            for volume_index in range(source_volume.shape[3]):
+                arrays.append(source_volume[..., volume_index])
+                outputs.append(src_transf_data[..., volume_index])
+        else:
+            arrays.append(source_volume)
+            outputs.append(src_transf_data)
+        mv = MedicalVolume(src_transf_data, destination.affine)
+        copy_realigned_headers(source, destination, mv)
+        realigned_volumes.append(mv)
 
-    mv = MedicalVolume(src_transf_data, destination.affine, destination.headers())
+    for source_affine, arrays, outputs in geometry_groups.values():
+        # build affine which maps from target grid to source grid
+        transform = np.linalg.inv(source_affine) @ destination.affine
+        # the z offset is part of the transform of the destination coordinates
+        exact_mapping = _get_exact_mapping(transform @ _z_offset_matrix(z_offset), exact_tolerance)
+        if exact_mapping is not None:
+            _copy_exact(arrays, outputs, exact_mapping)
+        elif label_mode == 'majority':
+            _vote_labels(arrays, outputs, transform, target_shape, memory_budget, num_threads, z_offset)
+        elif label_mode == 'nearest':
+            _realign_arrays(arrays, outputs, transform, target_shape, 0, memory_budget, num_threads, z_offset)
+        else:
+            _realign_arrays(arrays, outputs, transform, target_shape, interpolation_order, memory_budget, num_threads,
+                            z_offset, compute_dtype)
 
-    return mv
\ No newline at end of file
+    return realigned_volumes
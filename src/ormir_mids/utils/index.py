@@ -0,0 +1,351 @@
+"""
+Persistent index of an ORMIR-MIDS tree.
+
+The index is a sqlite file at the root of the dataset. It records every NIfTI file with its subject, session,
+directory, suffix, shape and data type, and the values of some fields of its omids header. It is updated
+incrementally: the folders whose modification time did not change are not listed again, only their indexed files
+are checked.
+
+The queries read the index as it is, unless refresh=True. The files written with save_omids (or AsyncOmidsWriter) are
+indexed as they are written, and the indexed files that no longer exist are not returned. The files added by other
+tools are only found after the index is updated (dcm2omids does it after each conversion into an indexed tree).
+
+Usage:
+    update_index('/data/study')  # creates the index, or updates it
+    query('/data/study', suffix='MEGRE', MagneticFieldStrength=3)
+"""
+import json
+import os
+import re
+import sqlite3
+
+import nibabel as nib
+
+INDEX_FILE_NAME = '.ormirmids_index.sqlite'
+
+# fields of the omids header that are recorded in the index
+INDEXED_FIELDS = ('EchoTime', 'RepetitionTime', 'InversionTime', 'FlipAngle', 'MagneticFieldStrength',
+                  'Manufacturer', 'ManufacturersModelName', 'Modality', 'PulseSequenceType', 'BodyPartExamined')
+
+# [series number_]sub-<subject>[_ses-<session>]_<suffix>.nii[.gz]
+_OMIDS_NAME_PATTERN = re.compile(r'^(?:\d+_)?sub-(?P<subject>[^_]*)(?:_ses-(?P<session>[^_]*))?_(?P<suffix>.*)\.nii(?:\.gz)?$',
+                                 re.IGNORECASE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, directory TEXT, name TEXT, subject TEXT, session TEXT,
+                                  suffix TEXT, shape TEXT, dtype TEXT, mtime_ns INTEGER, json_mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS fields (path TEXT, name TEXT, num_value REAL, text_value TEXT);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS files_suffix ON files (suffix);
+CREATE INDEX IF NOT EXISTS fields_path ON fields (path);
+CREATE INDEX IF NOT EXISTS fields_num ON fields (name, num_value);
+CREATE INDEX IF NOT EXISTS fields_text ON fields (name, text_value);
+"""
+
+
+def index_exists(root):
+    """
+    Checks if a folder has an index.
+
+    Parameters:
+        root (str): Path to the root of the dataset
+
+    Returns:
+        bool: True if the index file exists
+    """
+    return os.path.isfile(os.path.join(root, INDEX_FILE_NAME))
+
+
+def parse_omids_name(file_name):
+    """
+    Splits the name of an ORMIR-MIDS file into its parts.
+
+    Parameters:
+        file_name (str): the file name, e.g. 003_sub-anon_ses-1_part-phase_MEGRE.nii.gz
+
+    Returns:
+        (str, str, str): subject, session and suffix (e.g. 'anon', '1', 'part-phase_MEGRE').
+            None for the parts that are not present
+    """
+    m = _OMIDS_NAME_PATTERN.match(file_name)
+    if m is None:
+        return None, None, None
+    return m.group('subject'), m.group('session'), m.group('suffix')
+
+
+def _is_nifti(file_name):
+    file_name = file_name.lower()
+    return file_name.endswith('.nii') or file_name.endswith('.nii.gz')
+
+
+def _json_sidecar(nii_file):
+    if nii_file.lower().endswith('.gz'):
+        nii_file = nii_file[:-3]
+    return nii_file[:-4] + '.json'
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _connect(root):
+    # several processes can write the files of the same tree (see index_written_file)
+    connection = sqlite3.connect(os.path.join(root, INDEX_FILE_NAME), timeout=60)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _index_file(connection, root, relative_path, mtime_ns, json_mtime_ns, fields):
+    """ (Re)indexes a nifti file """
+    directory, name = os.path.split(relative_path)
+    subject, session, suffix = parse_omids_name(name)
+    nii_file = os.path.join(root, relative_path)
+    try:
+        nifti_header = nib.load(nii_file).header # only the header is read
+        shape = json.dumps([int(x) for x in nifti_header.get_data_shape()])
+        dtype = str(nifti_header.get_data_dtype())
+    except Exception:
+        shape = None
+        dtype = None
+
+    connection.execute('DELETE FROM fields WHERE path = ?', (relative_path,))
+    connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (relative_path, directory, name, subject, session, suffix, shape, dtype, mtime_ns,
+                        json_mtime_ns))
+
+    try:
+        with open(_json_sidecar(nii_file), 'r') as f:
+            omids_header = json.load(f)
+    except (OSError, ValueError):
+        return
+    for field in fields:
+        if field not in omids_header:
+            continue
+        values = omids_header[field]
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            if isinstance(value, (int, float)):
+                connection.execute('INSERT INTO fields VALUES (?, ?, ?, NULL)', (relative_path, field, float(value)))
+            elif isinstance(value, str):
+                connection.execute('INSERT INTO fields VALUES (?, ?, NULL, ?)', (relative_path, field, value))
+
+
+def _remove_file(connection, relative_path):
+    connection.execute('DELETE FROM files WHERE path = ?', (relative_path,))
+    connection.execute('DELETE FROM fields WHERE path = ?', (relative_path,))
+
+
+def update_index(root, fields=INDEXED_FIELDS):
+    """
+    Creates or updates the index of an ORMIR-MIDS tree. Only the folders that changed since the last update are
+    listed, and only the files that changed are read again.
+
+    Parameters:
+        root (str): Path to the root of the dataset
+        fields (iterable): the fields of the omids header to record
+
+    Returns:
+        (int, int): the number of files that were (re)indexed and removed
+    """
+    connection = _connect(root)
+    n_indexed = 0
+    n_removed = 0
+    try:
+        with connection:
+            known_directories = dict(connection.execute('SELECT path, mtime_ns FROM directories'))
+            stored_files = {row[0]: (row[1], row[2]) for row in
+                            connection.execute('SELECT path, mtime_ns, json_mtime_ns FROM files')}
+            # content of the folders, as stored in the index
+            stored_subdirectories = {}
+            for path, parent in connection.execute('SELECT path, parent FROM directories'):
+                stored_subdirectories.setdefault(parent, []).append(path)
+            stored_folder_files = {}
+            for path, directory in connection.execute('SELECT path, directory FROM files'):
+                stored_folder_files.setdefault(directory, []).append(path)
+            seen_directories = set()
+            seen_files = set()
+            directory_stack = ['']
+            while directory_stack:
+                relative_directory = directory_stack.pop()
+                absolute_directory = os.path.join(root, relative_directory)
+                directory_mtime = _mtime_ns(absolute_directory)
+                if directory_mtime is None:
+                    continue
+                seen_directories.add(relative_directory)
+
+                if known_directories.get(relative_directory) == directory_mtime:
+                    # the content of the folder did not change: use the stored lists
+                    subdirectories = stored_subdirectories.get(relative_directory, [])
+                    file_list = stored_folder_files.get(relative_directory, [])
+                else:
+                    subdirectories = []
+                    file_list = []
+                    with os.scandir(absolute_directory) as entries:
+                        for entry in entries:
+                            if entry.is_dir():
+                                subdirectories.append(os.path.join(relative_directory, entry.name))
+                            elif _is_nifti(entry.name) and entry.is_file():
+                                file_list.append(os.path.join(relative_directory, entry.name))
+                    parent = os.path.dirname(relative_directory) if relative_directory else None
+                    connection.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?)',
+                                       (relative_directory, parent, directory_mtime))
+
+                for relative_path in file_list:
+                    nii_file = os.path.join(root, relative_path)
+                    mtime_ns = _mtime_ns(nii_file)
+                    if mtime_ns is None:
+                        continue
+                    seen_files.add(relative_path)
+                    json_mtime_ns = _mtime_ns(_json_sidecar(nii_file))
+                    if stored_files.get(relative_path) != (mtime_ns, json_mtime_ns):
+                        _index_file(connection, root, relative_path, mtime_ns, json_mtime_ns, fields)
+                        n_indexed += 1
+
+                directory_stack.extend(subdirectories)
+
+            for relative_directory in set(known_directories) - seen_directories:
+                connection.execute('DELETE FROM directories WHERE path = ?', (relative_directory,))
+            for relative_path in stored_files:
+                if relative_path not in seen_files:
+                    _remove_file(connection, relative_path)
+                    n_removed += 1
+    finally:
+        connection.close()
+    return n_indexed, n_removed
+
+
+def find_index_root(path):
+    """
+    Finds the indexed tree a file belongs to.
+
+    Parameters:
+        path (str): Path to a file
+
+    Returns:
+        str: the closest parent folder of the file that has an index, or None
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    while True:
+        if index_exists(folder):
+            return folder
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+
+
+def index_written_file(nii_file, fields=INDEXED_FIELDS):
+    """
+    Updates the index entry of a nifti file that was just written (with its json sidecar), if the file belongs to an
+    indexed tree. The folders are not listed: the next update_index lists the folder of the file again.
+
+    Parameters:
+        nii_file (str): Path to the nifti file
+        fields (iterable): the fields of the omids header to record
+
+    Returns:
+        bool: True if the file was indexed, False if it is not in an indexed tree or the index cannot be written
+    """
+    root = find_index_root(nii_file)
+    if root is None:
+        return False
+    relative_path = os.path.relpath(os.path.abspath(nii_file), os.path.abspath(root))
+    try:
+        connection = _connect(root)
+        try:
+            with connection:
+                _index_file(connection, root, relative_path, _mtime_ns(nii_file), _mtime_ns(_json_sidecar(nii_file)),
+                            fields)
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        # the file is written, it will be indexed by the next update
+        print(f'Warning: could not index {nii_file}: {e}')
+        return False
+    return True
+
+
+def _query_paths(root, conditions, parameters, refresh):
+    if refresh or not index_exists(root):
+        update_index(root)
+    connection = _connect(root)
+    try:
+        sql = 'SELECT path FROM files'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY path'
+        paths = [os.path.join(root, row[0]) for row in connection.execute(sql, parameters)]
+    finally:
+        connection.close()
+    # the files deleted since the last update are not returned
+    return [path for path in paths if os.path.isfile(path)]
+
+
+def query(root, suffix=None, subject=None, session=None, refresh=False, **fields):
+    """
+    Finds the files of an ORMIR-MIDS tree using its index. The index is created if it does not exist, otherwise it is
+    used as it is unless refresh is True.
+
+    Parameters:
+        root (str): Path to the root of the dataset
+        suffix (str): the suffix of the files, e.g. 'MEGRE' or 'part-phase_MEGRE' (case insensitive)
+        subject (str): the subject id
+        session (str): the session id
+        refresh (bool): if True, the index is updated before the query (default: False)
+        **fields: values of the indexed omids header fields, e.g. MagneticFieldStrength=3.
+            A list matches any of its values. For multi-valued fields (e.g. EchoTime) a file matches if any of
+            its values matches
+
+    Returns:
+        list: the paths of the files
+    """
+    conditions = []
+    parameters = []
+    for column, value in [('suffix', suffix), ('subject', subject), ('session', session)]:
+        if value is not None:
+            conditions.append(f'lower({column}) = lower(?)')
+            parameters.append(value)
+
+    for field, values in fields.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        value_conditions = []
+        parameters.append(field)
+        for value in values:
+            if isinstance(value, (int, float)):
+                value_conditions.append('abs(num_value - ?) < 1e-6')
+            else:
+                value_conditions.append('text_value = ?')
+            parameters.append(value)
+        conditions.append('EXISTS (SELECT 1 FROM fields WHERE fields.path = files.path AND fields.name = ? '
+                          f"AND ({' OR '.join(value_conditions) or '0'}))")
+
+    return _query_paths(root, conditions, parameters, refresh)
+
+
+def find_by_name_ending(root, name_endings, refresh=False):
+    """
+    Finds the files whose name ends with a string, as find_omids does with os.walk, using the index.
+
+    Parameters:
+        root (str): Path to the root of the dataset
+        name_endings (str or tuple): the end of the file name, or a tuple of alternatives (case insensitive)
+        refresh (bool): if True, the index is updated before the query (default: False)
+
+    Returns:
+        list: the paths of the files
+    """
+    if isinstance(name_endings, str):
+        name_endings = (name_endings,)
+    conditions = []
+    parameters = []
+    for name_ending in name_endings:
+        conditions.append('substr(lower(name), -?) = ?')
+        parameters.extend([len(name_ending), name_ending.lower()])
+    return _query_paths(root, ['(' + ' OR '.join(conditions) + ')'], parameters, refresh)
@@ -1,23 +1,283 @@
+import functools
+import gzip
+import io
 import json
 import os
-
-from voxel import DicomReader, DicomWriter, NiftiReader, NiftiWriter
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import nibabel as nib
+import numpy as np
+import pydicom
+import voxel as vx
+from voxel import DicomReader, DicomWriter, NiftiReader, NiftiWriter, MedicalVolume
+from voxel import orientation as stdo
+from natsort import natsorted
 from ..utils import headers
+from .OMidsMedVolume import OMidsMedVolume
+from .index import index_exists, find_by_name_ending, index_written_file
+from .walk import walk_dicom_folders
+
+ENHANCED_MR_STORAGE = '1.2.840.10008.5.1.4.1.1.4.1'
+
+NIFTI_COMPRESSION_MODES = ('none', 'gzip', 'parallel')
+PARALLEL_GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def default_io_threads():
+    """
+    Default number of threads used to read files. Reading is bound by the latency of the storage rather than by
+    the CPU, so more threads than cores are used (same default as concurrent.futures.ThreadPoolExecutor).
+
+    Returns:
+        int: the number of threads
+    """
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _read_file_bytes(file_path):
+    with open(file_path, 'rb') as f:
+        return io.BytesIO(f.read())
+
 
+def _thread_map(function, items, io_threads):
+    """
+    Applies a function to a list of items in a thread pool, keeping the order of the items.
+    """
+    if io_threads is None:
+        io_threads = default_io_threads()
+    if io_threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(io_threads, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+class DicomPrefetcher:
+    """
+    Reads the files of the next series in memory in background threads, while the current series is being converted,
+    so that the latency of slow or network storage is hidden.
+
+    The series are given as an iterable of (key, file list), which is also consumed in the background thread, so the
+    folders can be listed lazily. The series are read in order: at most max_series series and (approximately) max_bytes
+    bytes are kept in memory ahead of the caller. A single series larger than max_bytes is still read.
+
+    Iterating over the prefetcher gives (key, file_data) for each series, where file_data is the list of the file
+    contents (io.BytesIO) or the exception raised while reading them.
+    The statistics count, for each series, if it was already in memory when it was requested (hit), if it was being
+    read (stall) or if its reading had not started (miss), and the time spent waiting for the series.
+
+    Usage:
+        with DicomPrefetcher(series_files, max_series=2) as prefetcher:
+            for key, file_data in prefetcher:
+                ...
+        print(prefetcher.format_statistics())
+    """
 
-def load_dicom(path, group_by = None):
+    def __init__(self, file_groups, max_series=2, max_bytes=None, io_threads=None):
+        """
+        Parameters:
+            file_groups (iterable): (key, list of file paths) for each series
+            max_series (int): Maximum number of series read ahead (None: no limit)
+            max_bytes (int): Maximum size in bytes of the series read ahead (None: no limit)
+            io_threads (int): Number of threads used to read the files of a series (default: None,
+                see default_io_threads)
+        """
+        if io_threads is None:
+            io_threads = default_io_threads()
+        self.statistics = {'series': 0, 'files': 0, 'bytes': 0, 'hits': 0, 'stalls': 0, 'misses': 0,
+                           'wait_time': 0.0}
+        self._file_groups = file_groups
+        self._max_series = max_series
+        self._max_bytes = max_bytes
+        self._io_threads = max(1, io_threads)
+        self._ready = deque() # (key, file_data, size) of the series that were read
+        self._ready_bytes = 0
+        self._reading = False
+        self._done = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _is_full(self):
+        if self._max_series is not None and len(self._ready) >= self._max_series:
+            return True
+        return self._max_bytes is not None and self._ready_bytes >= self._max_bytes
+
+    def _read_loop(self):
+        executor = ThreadPoolExecutor(max_workers=self._io_threads) if self._io_threads > 1 else None
+        try:
+            for key, file_list in self._file_groups:
+                with self._condition:
+                    while self._is_full() and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                    self._reading = True
+                try:
+                    if executor is None:
+                        file_data = [_read_file_bytes(file_path) for file_path in file_list]
+                    else:
+                        file_data = list(executor.map(_read_file_bytes, file_list))
+                    size = sum(data.getbuffer().nbytes for data in file_data)
+                except Exception as e:
+                    file_data = e
+                    size = 0
+                with self._condition:
+                    self._ready.append((key, file_data, size))
+                    self._ready_bytes += size
+                    self._reading = False
+                    self._condition.notify_all()
+        except Exception as e:
+            # the listing of the series failed: the error is raised by the caller after the last series
+            with self._condition:
+                self._ready.append((None, e, 0))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._condition:
+            if self._ready:
+                result = 'hits'
+            else:
+                result = 'stalls' if self._reading else 'misses'
+                start_time = time.perf_counter()
+                while not self._ready and not self._done:
+                    self._condition.wait()
+                self.statistics['wait_time'] += time.perf_counter() - start_time
+                if not self._ready:
+                    raise StopIteration
+            key, file_data, size = self._ready.popleft()
+            self._ready_bytes -= size
+            self._condition.notify_all()
+        if key is None and isinstance(file_data, Exception):
+            raise file_data
+        self.statistics[result] += 1
+        self.statistics['series'] += 1
+        if not isinstance(file_data, Exception):
+            self.statistics['files'] += len(file_data)
+            self.statistics['bytes'] += size
+        return key, file_data
+
+    def close(self):
+        """
+        Stops reading ahead and waits for the background thread. The series that were not requested are discarded.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._ready.clear()
+        self._ready_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def format_statistics(self):
+        """
+        Returns:
+            str: a summary of the statistics
+        """
+        return format_prefetch_statistics(self.statistics)
+
+
+def format_prefetch_statistics(statistics):
+    """
+    Formats the statistics of a DicomPrefetcher.
+
+    Parameters:
+        statistics (dict): the statistics
+
+    Returns:
+        str: a summary of the statistics
+    """
+    return (f"Prefetch: {statistics.get('series', 0)} series, {statistics.get('files', 0)} files, "
+            f"{statistics.get('bytes', 0) / 1024 ** 2:.1f} MB read ahead; {statistics.get('hits', 0)} hits, "
+            f"{statistics.get('stalls', 0)} stalls, {statistics.get('misses', 0)} misses, "
+            f"{statistics.get('wait_time', 0.0):.2f} s waiting")
+
+
+def _list_dicom_files(path, io_threads=None):
+    """
+    Lists the dicom files of a folder (see walk_dicom_folders), or a list of files, in the order used by the dicom
+    reader.
+    """
+    if isinstance(path, (list, tuple)):
+        file_list = list(path)
+    elif os.path.isdir(path):
+        file_list = list(walk_dicom_folders(path, recursive=False, io_threads=io_threads))[0][1]
+    else:
+        file_list = [path]
+    # same order as the reader would use
+    return natsorted(file_list)
+
+
+def _load_dicom_volumes(path, num_workers=0, io_threads=None, file_data=None):
+    """
+    Loads the dicom files in a folder, or a list of files, grouped by SeriesInstanceUID.
+    The files are read in a thread pool and parsed from memory, so that the latency of the storage is hidden.
+
+    Parameters:
+        path (str or list): Path to the folder, or list of file paths
+        num_workers (int): Number of processes used by the dicom reader to parse the files (0: no processes)
+        io_threads (int): Number of threads used to read the files. If None, default_io_threads() is used
+        file_data (list): The contents of the files, if they were already read, or the exception raised while
+            reading them (see DicomPrefetcher)
+
+    Returns:
+        list: the MedicalVolumes, sorted by SeriesInstanceUID
+    """
+    if isinstance(file_data, Exception):
+        raise file_data
+    dicom_reader = DicomReader(num_workers=num_workers, group_by='SeriesInstanceUID', ignore_ext=True)
+    if file_data is None:
+        file_list = _list_dicom_files(path, io_threads)
+        if file_list and io_threads is not None and io_threads <= 1:
+            return dicom_reader.load(file_list)
+        if file_list:
+            file_data = _thread_map(_read_file_bytes, file_list, io_threads)
+    if not file_data:
+        raise FileNotFoundError(f"No valid dicom files found in {path}")
+    return dicom_reader.load(file_data)
+
+
+def _close_prefetcher(prefetcher, statistics):
+    """ Stops a prefetcher and adds its statistics to the statistics dictionary, if not None """
+    prefetcher.close()
+    if statistics is not None:
+        for key, value in prefetcher.statistics.items():
+            statistics[key] = statistics.get(key, 0) + value
+
+
+def load_dicom(path, group_by = None, num_workers=0, io_threads=None):
     """
     Loads all dicom files in a folder.
 
     Parameters:
         path (str): Path to the folder
         group_by (str): If not None, group the volumes by the specified header
+        num_workers (int): Number of processes used to parse the dicom files (default: 0, no processes)
+        io_threads (int): Number of threads used to read the files (default: None, see default_io_threads)
 
     Returns:
         MedicalVolume with muscle-bids headers
     """
-    dicom_reader = DicomReader(num_workers=0, group_by='SeriesInstanceUID', ignore_ext=True)
-    medical_volume = dicom_reader.load(path)[0]
+    medical_volume = _load_dicom_volumes(path, num_workers, io_threads)[0]
     setattr(medical_volume, 'path', path)
     new_volume = headers.dicom_volume_to_bids(medical_volume)
     if group_by is not None:
@@ -25,45 +285,246 @@ def load_dicom(path, group_by = None):
     return new_volume
 
 
-def load_dicom_with_subfolders(path):
+def load_dicom_with_subfolders(path, num_workers=0, io_threads=None, prefetch=0, prefetch_bytes=None,
+                               statistics=None):
     """
     Loads all dicom files in a folder and its subfolders.
 
     Parameters:
         path (str): Path to the root folder
+        num_workers (int): Number of processes used to parse the dicom files (default: 0, no processes)
+        io_threads (int): Number of threads used to read the files (default: None, see default_io_threads)
+        prefetch (int): Number of folders read ahead in the background (default: 0, see iter_dicom_with_subfolders)
+        prefetch_bytes (int): Maximum size in bytes of the folders read ahead (default: None, no limit)
+        statistics (dict): if not None, the statistics of the walk and of the prefetcher are added to it (see
+            iter_dicom_with_subfolders)
 
     Returns:
         list: List of dicom volumes
 
     """
-    dicom_reader = DicomReader(num_workers=0, group_by='SeriesInstanceUID', ignore_ext=True)
-    def _read_dicom_recursive(rootdir):
-        try:
-            output_list = dicom_reader.load(rootdir)
-        except (FileNotFoundError, KeyError):
-            output_list = []
-        for element in output_list:
-            setattr(element, 'path', rootdir)
-        for file in os.listdir(rootdir):
-            d = os.path.join(rootdir, file)
-            if os.path.isdir(d):
-                print(d)
-                output_list.extend(_read_dicom_recursive(d))
-        return output_list
-
-    med_volumes = _read_dicom_recursive(path)
-    out = []
-    for volume in med_volumes:
+    return list(iter_dicom_with_subfolders(path, num_workers, io_threads, prefetch, prefetch_bytes, statistics))
+
+
+def _folder_volumes_to_bids(volume_list, rootdir):
+    """ Converts the volumes loaded from a folder to muscle-bids volumes, skipping the ones that fail """
+    for volume in volume_list:
+        setattr(volume, 'path', rootdir)
         try:
             new_volume = headers.dicom_volume_to_bids(volume)
         except:
             print("Warning: could not convert volume")
             continue
-        out.append(new_volume)
-    return out
+        yield new_volume
 
 
-def save_dicom(path, medical_volume, new_series = True):
+def iter_dicom_with_subfolders(path, num_workers=0, io_threads=None, prefetch=0, prefetch_bytes=None,
+                               statistics=None):
+    """
+    Loads the dicom files in a folder and its subfolders one folder at a time.
+    This is the generator version of load_dicom_with_subfolders: only the volumes of the folder
+    that is currently being read are kept in memory.
+
+    The folders are listed ahead in a thread pool, and only the files with a DICOM preamble (or referenced by a
+    DICOMDIR) are parsed (see walk_dicom_folders).
+    If prefetch or prefetch_bytes is set, the files of the next folders are also read in the background (see
+    DicomPrefetcher) while the caller processes the volumes of the current folder.
+
+    Parameters:
+        path (str): Path to the root folder
+        num_workers (int): Number of processes used to parse the dicom files (default: 0, no processes)
+        io_threads (int): Number of threads used to read the files (default: None, see default_io_threads)
+        prefetch (int): Number of folders read ahead in the background (default: 0, no prefetching)
+        prefetch_bytes (int): Maximum size in bytes of the folders read ahead (default: None, no limit)
+        statistics (dict): if not None, the counts of the walk (see format_walk_statistics) and of the prefetcher
+            (see format_prefetch_statistics) are added to it when the generator ends
+
+    Returns:
+        generator: the dicom volumes, in the same order as load_dicom_with_subfolders
+    """
+    folders = walk_dicom_folders(path, io_threads=io_threads, statistics=statistics)
+    prefetcher = None
+    if prefetch or prefetch_bytes:
+        prefetcher = DicomPrefetcher(folders, prefetch or None, prefetch_bytes, io_threads)
+        folders = prefetcher
+    try:
+        for rootdir, files in folders:
+            if rootdir != path:
+                print(rootdir)
+            try:
+                if prefetcher is None:
+                    output_list = _load_dicom_volumes(files, num_workers, io_threads)
+                else:
+                    output_list = _load_dicom_volumes(rootdir, num_workers, file_data=files)
+            except (FileNotFoundError, KeyError):
+                output_list = []
+            yield from _folder_volumes_to_bids(output_list, rootdir)
+    finally:
+        if prefetcher is not None:
+            _close_prefetcher(prefetcher, statistics)
+
+
+def _read_dicom_header(file_path):
+    """
+    Reads the header of a dicom file, without the pixel data.
+
+    Parameters:
+        file_path (str): Path to the file
+
+    Returns:
+        pydicom.Dataset: the header, or None if the file is not a dicom image
+    """
+    try:
+        header = pydicom.dcmread(file_path, stop_before_pixels=True, force=True)
+    except Exception:
+        return None
+    if 'SOPInstanceUID' not in header or 'SeriesInstanceUID' not in header:
+        return None
+    # reports, presentation states etc. have no image
+    if 'Rows' not in header or 'Columns' not in header:
+        return None
+    return header
+
+
+def scan_dicom_series(path, recursive=True, io_threads=None, statistics=None):
+    """
+    Reads the headers of all the dicom files in a folder (and its subfolders) without decoding any pixel data,
+    and builds a catalog of the series. Only the files with a DICOM preamble, or referenced by a DICOMDIR, are read
+    (see walk_dicom_folders).
+
+    Parameters:
+        path (str): Path to the root folder
+        recursive (bool): If True, the subfolders are scanned too
+        io_threads (int): Number of threads used to read the files (default: None, see default_io_threads)
+        statistics (dict): if not None, the counts of the walk are added to it (see format_walk_statistics)
+
+    Returns:
+        dict: SeriesInstanceUID -> series entry, in the same order as iter_dicom_with_subfolders.
+            Each entry is a dictionary with the keys:
+            'files' (list of file paths), 'path' (the folder of the series), 'headers' (list of pydicom.Dataset),
+            'Manufacturer', 'Modality', 'SeriesNumber', 'ImageType' (set of tuples), 'EchoTime' (set),
+            'enhanced' (True if the series contains enhanced multi-frame files)
+    """
+    catalog = {}
+    for rootdir, file_list in walk_dicom_folders(path, recursive, io_threads, statistics=statistics):
+        if rootdir != path:
+            print(rootdir)
+        folder_series = {}
+        for file_path, header in zip(file_list, _thread_map(_read_dicom_header, file_list, io_threads)):
+            if header is None:
+                continue
+            folder_series.setdefault(str(header.SeriesInstanceUID), []).append((file_path, header))
+
+        # the reader returns the series of a folder sorted by uid
+        for series_uid in sorted(folder_series):
+            if series_uid not in catalog:
+                first_header = folder_series[series_uid][0][1]
+                catalog[series_uid] = {
+                    'files': [],
+                    'path': rootdir,
+                    'headers': [],
+                    'Manufacturer': str(first_header.get('Manufacturer', '')),
+                    'Modality': str(first_header.get('Modality', '')),
+                    'SeriesNumber': first_header.get('SeriesNumber', None),
+                    'ImageType': set(),
+                    'EchoTime': set(),
+                    'enhanced': False,
+                }
+            entry = catalog[series_uid]
+            for file_path, header in folder_series[series_uid]:
+                entry['files'].append(file_path)
+                entry['headers'].append(header)
+                if 'ImageType' in header:
+                    entry['ImageType'].add(tuple(header.ImageType))
+                if 'EchoTime' in header:
+                    entry['EchoTime'].add(header.EchoTime)
+                if 'MediaStorageSOPClassUID' in header.file_meta and \
+                        header.file_meta.MediaStorageSOPClassUID == ENHANCED_MR_STORAGE:
+                    entry['enhanced'] = True
+
+    return catalog
+
+
+def load_dicom_series(series_entry, headers_only=False, num_workers=0, io_threads=None, file_data=None):
+    """
+    Loads a series from the catalog created by scan_dicom_series.
+
+    Parameters:
+        series_entry (dict): the catalog entry of the series
+        headers_only (bool): If True, the pixel data is not read. The volume has the right shape and headers,
+            but its data is a read-only array of zeros that takes no memory. It can be used to check the
+            compatibility of the series with the converters.
+        num_workers (int): Number of processes used to parse the dicom files (default: 0, no processes)
+        io_threads (int): Number of threads used to read the files (default: None, see default_io_threads)
+        file_data (list): The contents of the files, if they were already read, or the exception raised while
+            reading them (see DicomPrefetcher)
+
+    Returns:
+        MedicalVolume with muscle-bids headers, or None if the series cannot be loaded
+    """
+    if headers_only:
+        header_list = series_entry['headers']
+        volume = np.broadcast_to(np.zeros((), dtype=np.uint16),
+                                 (int(header_list[0].Rows), int(header_list[0].Columns), len(header_list)))
+        try:
+            affine = stdo.to_RAS_affine(header_list)
+        except Exception:
+            affine = np.eye(4)
+        medical_volume = MedicalVolume(volume, affine, headers=header_list)
+    else:
+        try:
+            volume_list = _load_dicom_volumes(series_entry['files'], num_workers, io_threads, file_data)
+        except (FileNotFoundError, KeyError):
+            return None
+        if not volume_list:
+            return None
+        medical_volume = volume_list[0]
+    setattr(medical_volume, 'path', series_entry['path'])
+    try:
+        return headers.dicom_volume_to_bids(medical_volume)
+    except:
+        print("Warning: could not convert volume")
+        return None
+
+
+def iter_dicom_series(catalog, num_workers=0, io_threads=None, prefetch=0, prefetch_bytes=None, statistics=None):
+    """
+    Loads the series of a catalog created by scan_dicom_series, one at a time.
+
+    If prefetch or prefetch_bytes is set, the files of the next series are read in the background (see
+    DicomPrefetcher) while the caller processes the current series.
+
+    Parameters:
+        catalog (dict): the catalog, or a subset of it
+        num_workers (int): Number of processes used to parse the dicom files (default: 0, no processes)
+        io_threads (int): Number of threads used to read the files (default: None, see default_io_threads)
+        prefetch (int): Number of series read ahead in the background (default: 0, no prefetching)
+        prefetch_bytes (int): Maximum size in bytes of the series read ahead (default: None, no limit)
+        statistics (dict): if not None, the counts of the prefetcher are added to it when the generator ends (see
+            format_prefetch_statistics)
+
+    Returns:
+        generator: the dicom volumes
+    """
+    if prefetch or prefetch_bytes:
+        file_groups = ((series_uid, natsorted(series_entry['files'])) for series_uid, series_entry in catalog.items())
+        prefetcher = DicomPrefetcher(file_groups, prefetch or None, prefetch_bytes, io_threads)
+        try:
+            for series_uid, file_data in prefetcher:
+                medical_volume = load_dicom_series(catalog[series_uid], num_workers=num_workers, file_data=file_data)
+                if medical_volume is not None:
+                    yield medical_volume
+        finally:
+            _close_prefetcher(prefetcher, statistics)
+        return
+
+    for series_entry in catalog.values():
+        medical_volume = load_dicom_series(series_entry, num_workers=num_workers, io_threads=io_threads)
+        if medical_volume is not None:
+            yield medical_volume
+
+
+def save_dicom(path, medical_volume, new_series = True, num_workers=0):
     """
     Saves a volume to a folder.
 
@@ -71,35 +532,114 @@ def save_dicom(path, medical_volume, new_series = True):
         path (str): Path to the folder
         medical_volume (MedicalVolume): The volume to save
         new_series (bool): If True, a new series is created
+        num_workers (int): Number of processes used to write the files (default: 0, no processes)
 
     Returns:
         None
     """
     new_volume = headers.bids_volume_to_dicom(medical_volume, new_series)
     #print(new_volume.headers().shape)
-    dicom_writer = DicomWriter(num_workers=0)
+    dicom_writer = DicomWriter(num_workers=num_workers)
     dicom_writer.save(new_volume, path)
 
 
-def load_omids(nii_file):
+class _JsonSidecar:
+    """
+    A json sidecar file that is parsed when it is first needed. Only the file name is stored until then,
+    so the sidecar can be pickled.
+    """
+
+    def __init__(self, json_file, default):
+        self.json_file = json_file
+        self.default = default
+        self._content = None
+
+    def get(self, key=None):
+        if self._content is None:
+            try:
+                with open(self.json_file, 'r') as f:
+                    self._content = json.load(f)
+            except FileNotFoundError:
+                self._content = self.default
+        if key is None:
+            return self._content
+        return self._content[key]
+
+
+class _NiftiDataLoader:
+    """
+    Reads the data of a nifti file on demand, as NiftiReader would (float64 values with the scaling applied).
+    Only the file name is stored, so the loader can be pickled.
+    """
+
+    def __init__(self, nii_file, shape):
+        self.nii_file = nii_file
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(np.float64)
+
+    def __call__(self):
+        return nib.load(self.nii_file).get_fdata()
+
+    def get_slice(self, slicer):
+        return np.asarray(nib.load(self.nii_file).dataobj[slicer], dtype=np.float64)
+
+
+def _load_nifti_lazy(nii_file, mmap=False):
+    """
+    Loads a nifti file without reading its data.
+
+    Parameters:
+        nii_file (str): Path to the nifti file
+        mmap (bool): If True, the data of an uncompressed file is memory mapped. The array keeps the data type of
+            the file. Compressed or scaled files cannot be mapped, and are loaded lazily instead
+
+    Returns:
+        OMidsMedVolume: the volume
+    """
+    if not os.path.isfile(nii_file):
+        raise FileNotFoundError("{} not found".format(nii_file))
+    nib_img = nib.load(nii_file)
+    if mmap and not nii_file.lower().endswith('.gz'):
+        try:
+            return OMidsMedVolume.from_nib(nib_img, affine_precision=vx.config.affine_precision,
+                                           origin_precision=vx.config.affine_precision, mmap=True)
+        except ValueError:
+            pass # the data is scaled, it cannot be mapped
+
+    # same rounding as MedicalVolume.from_nib
+    affine = np.array(nib_img.affine)
+    if vx.config.affine_precision is not None:
+        affine[:3, :3] = np.round(affine[:3, :3], vx.config.affine_precision)
+    if vx.config.affine_precision:
+        affine[:3, 3] = np.round(affine[:3, 3], vx.config.affine_precision)
+    return OMidsMedVolume.from_loader(_NiftiDataLoader(nii_file, nib_img.shape), affine)
+
+
+def load_omids(nii_file, mmap=False, lazy=False):
     """
     Loads a nifti file and its corresponding json files.
 
     Parameters:
         nii_file (str): Path to the nifti file
+        mmap (bool): If True, the data of an uncompressed (.nii) file is memory mapped, and keeps the data type of the
+            file. Compressed files are loaded lazily instead
+        lazy (bool): If True, the data is only read when it is first accessed, and slicing the volume (e.g.
+            volume[..., 0] for the first echo) only reads the requested part
 
     Returns:
         MedicalVolume: The loaded volume
     """
-    nifti_reader = NiftiReader()
-    medical_volume = nifti_reader.load(nii_file)
-    json_base_name = nii_file
-
-    # remove extensions
-    if json_base_name.lower().endswith('.gz'):
-        json_base_name = json_base_name[:-3]
-    if json_base_name.lower().endswith('.nii'):
-        json_base_name = json_base_name[:-4]
+    if mmap or lazy:
+        medical_volume = _load_nifti_lazy(nii_file, mmap)
+    else:
+        # same as NiftiReader.load, but the volume is an OMidsMedVolume
+        if not os.path.isfile(nii_file):
+            raise FileNotFoundError("{} not found".format(nii_file))
+        if not NiftiReader.data_format_code.is_filetype(nii_file):
+            raise ValueError("{} must be a file with extension '.nii' or '.nii.gz'".format(nii_file))
+        medical_volume = OMidsMedVolume.from_nib(nib.load(nii_file), affine_precision=vx.config.affine_precision,
+                                                 origin_precision=vx.config.affine_precision)
+    json_base_name = _omids_json_base_name(nii_file)
 
     try:
         with open(json_base_name + '.json', 'r') as f:
@@ -107,48 +647,40 @@ def load_omids(nii_file):
     except FileNotFoundError:
         omids_header = {}
 
-    try:
-        with open(json_base_name + '_patient.json', 'r') as f:
-            patient_header = json.load(f)
-    except FileNotFoundError:
-        patient_header = {}
-
-    try:
-        with open(json_base_name + '_extra.json', 'r') as f:
-            extra_and_meta_header = json.load(f)
-    except FileNotFoundError:
-        extra_and_meta_header = {'extra': {}, 'meta': {}}
-
-    setattr(medical_volume, 'meta_header', extra_and_meta_header['meta'])
     setattr(medical_volume, 'omids_header', omids_header)
     setattr(medical_volume, 'bids_header', omids_header) # for compatibility
-    setattr(medical_volume, 'patient_header', patient_header)
-    setattr(medical_volume, 'extra_header', extra_and_meta_header['extra'])
 
-    return medical_volume
+    # the other sidecars are only parsed when their header is accessed. meta and extra share the same file
+    extra_and_meta_sidecar = _JsonSidecar(json_base_name + '_extra.json', {'extra': {}, 'meta': {}})
+    medical_volume.set_header_loader('patient_header', _JsonSidecar(json_base_name + '_patient.json', {}).get)
+    medical_volume.set_header_loader('meta_header', functools.partial(extra_and_meta_sidecar.get, 'meta'))
+    medical_volume.set_header_loader('extra_header', functools.partial(extra_and_meta_sidecar.get, 'extra'))
 
+    return medical_volume
 
-def save_omids(nii_file, medical_volume, save_patient_json=True, save_extra_json=True):
-    """
-    Saves a volume to a nifti file and its corresponding json files.
 
-    Parameters:
-        nii_file (str): Path to the nifti file
-        medical_volume (MedicalVolume): The volume to save
-
-    Returns:
-        None
-    """
-    nifti_writer = NiftiWriter()
-    nifti_writer.save(medical_volume, nii_file)
+def _omids_json_base_name(nii_file):
+    """ Removes the nifti extensions from a file name """
     json_base_name = nii_file
-
-    # remove extensions
     if json_base_name.lower().endswith('.gz'):
         json_base_name = json_base_name[:-3]
     if json_base_name.lower().endswith('.nii'):
         json_base_name = json_base_name[:-4]
+    return json_base_name
+
+
+def _omids_sidecars(medical_volume, save_patient_json=True, save_extra_json=True):
+    """
+    Serializes the json sidecars of a volume.
+
+    Parameters:
+        medical_volume (MedicalVolume): The volume
+        save_patient_json (bool): If True, the patient sidecar is included
+        save_extra_json (bool): If True, the extra sidecar is included
 
+    Returns:
+        dict: file suffix (e.g. '_patient.json') -> content of the file
+    """
     extra_and_meta_header = {}
 
     extra_and_meta_header['meta'] = getattr(medical_volume, 'meta_header', {})
@@ -156,38 +688,273 @@ def save_omids(nii_file, medical_volume, save_patient_json=True, save_extra_json
     omids_header = getattr(medical_volume, 'omids_header', {})
     patient_header = getattr(medical_volume, 'patient_header', {})
 
-    with open(json_base_name + '.json', 'w') as f:
-        json.dump(omids_header, f, indent=2)
-
+    sidecars = {'.json': json.dumps(omids_header, indent=2)}
     if save_patient_json:
-        with open(json_base_name + '_patient.json', 'w') as f:
-            json.dump(patient_header, f, indent=2)
-
+        sidecars['_patient.json'] = json.dumps(patient_header, indent=2)
     if save_extra_json:
-        with open(json_base_name + '_extra.json', 'w') as f:
-            json.dump(extra_and_meta_header, f, indent=2)
+        sidecars['_extra.json'] = json.dumps(extra_and_meta_header, indent=2)
+    return sidecars
+
+
+def nifti_extension(compression='gzip'):
+    """
+    Returns the file extension to use with a compression mode.
+
+    Parameters:
+        compression (str): 'none', 'gzip' or 'parallel'
+
+    Returns:
+        str: '.nii' or '.nii.gz'
+    """
+    if compression not in NIFTI_COMPRESSION_MODES:
+        raise ValueError(f'Unknown compression {compression}. Valid values are {NIFTI_COMPRESSION_MODES}')
+    return '.nii' if compression == 'none' else '.nii.gz'
+
+
+def parallel_gzip_compress(data, compression_level=None, num_threads=None, block_size=PARALLEL_GZIP_BLOCK_SIZE):
+    """
+    Compresses data to a standard gzip stream, using several threads.
+
+    The data is split in blocks that are compressed independently (zlib releases the GIL). Each block is primed with
+    the last 32 kB of the previous one, as pigz does, so the compression ratio is close to the one of a single stream.
+    The blocks end on a byte boundary (Z_SYNC_FLUSH), so that they can be concatenated into one deflate stream.
+
+    Parameters:
+        data (bytes-like): the data to compress
+        compression_level (int): zlib compression level (default: 1, as nibabel)
+        num_threads (int): number of threads (default: None, number of CPUs)
+        block_size (int): size of the uncompressed blocks
+
+    Returns:
+        list: the pieces of the gzip stream (bytes), to be written in order
+    """
+    if compression_level is None:
+        compression_level = nib.openers.Opener.default_compresslevel
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+    data = memoryview(data).cast('B')
+    n_blocks = max(1, (len(data) + block_size - 1) // block_size)
+
+    def compress_block(block_index):
+        start = block_index * block_size
+        dictionary = data[max(0, start - 32768):start].tobytes()
+        if dictionary:
+            compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        last_block = block_index == n_blocks - 1
+        return compressor.compress(data[start:start + block_size]) + \
+            compressor.flush(zlib.Z_FINISH if last_block else zlib.Z_SYNC_FLUSH)
+
+    # gzip header: no file name, mtime 0 (reproducible output), unknown OS
+    extra_flags = 2 if compression_level == 9 else (4 if compression_level == 1 else 0)
+    pieces = [struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, 0, extra_flags, 255)]
+    if num_threads <= 1 or n_blocks == 1:
+        pieces.extend(compress_block(block_index) for block_index in range(n_blocks))
+    else:
+        with ThreadPoolExecutor(max_workers=min(num_threads, n_blocks)) as executor:
+            pieces.extend(executor.map(compress_block, range(n_blocks)))
+    pieces.append(struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff))
+    return pieces
+
+
+def _write_nifti(nii_file, medical_volume, compression=None, compression_level=None, compression_threads=None):
+    """
+    Writes a volume to a nifti file.
+
+    Parameters:
+        nii_file (str): Path to the nifti file
+        medical_volume (MedicalVolume): The volume to save
+        compression (str): 'none', 'gzip' or 'parallel'. If None, it is chosen from the file extension
+        compression_level (int): zlib compression level (default: 1, as nibabel)
+        compression_threads (int): number of threads for the 'parallel' compression (default: number of CPUs)
+
+    Returns:
+        None
+    """
+    is_gzip_file = nii_file.lower().endswith('.gz')
+    if compression is None:
+        compression = 'gzip' if is_gzip_file else 'none'
+    if nifti_extension(compression) == '.nii.gz' and not is_gzip_file:
+        raise ValueError(f'{nii_file} must end with .nii.gz for {compression} compression')
+    if compression == 'none' and is_gzip_file:
+        raise ValueError(f'{nii_file} must end with .nii if no compression is used')
+
+    if compression == 'none' or (compression == 'gzip' and compression_level is None):
+        nifti_writer = NiftiWriter()
+        nifti_writer.save(medical_volume, nii_file)
+        return
+
+    os.makedirs(os.path.dirname(nii_file), exist_ok=True)
+    nib_img = medical_volume.to_nib()
+    if compression == 'gzip':
+        with gzip.GzipFile(nii_file, 'wb', compresslevel=compression_level, mtime=0) as f:
+            nib_img.to_file_map({'image': nib.FileHolder(fileobj=f)})
+        return
+
+    with open(nii_file, 'wb') as f:
+        for piece in parallel_gzip_compress(nib_img.to_bytes(), compression_level, compression_threads):
+            f.write(piece)
+
+
+def _write_omids(nii_file, medical_volume, sidecars, **compression_options):
+    """ Writes a nifti file and its already serialized json sidecars, and indexes them if the tree has an index """
+    _write_nifti(nii_file, medical_volume, **compression_options)
+    json_base_name = _omids_json_base_name(nii_file)
+    for suffix, content in sidecars.items():
+        with open(json_base_name + suffix, 'w') as f:
+            f.write(content)
+    index_written_file(nii_file)
+
+
+def save_omids(nii_file, medical_volume, save_patient_json=True, save_extra_json=True, compression=None,
+               compression_level=None, compression_threads=None):
+    """
+    Saves a volume to a nifti file and its corresponding json files. If the file belongs to an indexed tree, its
+    entry in the index is updated (see ormir_mids.utils.index).
+
+    Parameters:
+        nii_file (str): Path to the nifti file
+        medical_volume (MedicalVolume): The volume to save
+        save_patient_json (bool): If True, the patient json file is saved
+        save_extra_json (bool): If True, the extra json file is saved
+        compression (str): 'none' (.nii), 'gzip' or 'parallel' (multithreaded gzip, .nii.gz).
+            If None, it is chosen from the file extension
+        compression_level (int): zlib compression level, 1 (fastest) to 9 (smallest) (default: 1, as nibabel)
+        compression_threads (int): number of threads for the 'parallel' compression (default: number of CPUs)
+
+    Returns:
+        None
+    """
+    _write_omids(nii_file, medical_volume, _omids_sidecars(medical_volume, save_patient_json, save_extra_json),
+                 compression=compression, compression_level=compression_level,
+                 compression_threads=compression_threads)
+
+
+class AsyncOmidsWriter:
+    """
+    Saves volumes (see save_omids) in background threads, so that the compression and the disk writes overlap with
+    the computation of the caller.
+
+    The json sidecars are serialized when a volume is submitted, so the headers can be modified afterwards. The volume
+    data must not be modified until the file is written. At most max_pending volumes wait in the queue: when the queue
+    is full, save_omids blocks until a volume has been written, so that the memory stays bounded. A volume saved to a
+    file that is still being written waits for the previous write, so the last volume saved to a path is the one on disk.
+
+    Usage:
+        with AsyncOmidsWriter() as writer:
+            writer.save_omids(path, volume)
+        # all the files are written here, the errors are in writer.errors
+    """
+
+    def __init__(self, num_threads=1, max_pending=None):
+        """
+        Parameters:
+            num_threads (int): Number of writer threads
+            max_pending (int): Maximum number of volumes waiting to be written (default: 2 * num_threads)
+        """
+        num_threads = max(1, num_threads)
+        if max_pending is None:
+            max_pending = 2 * num_threads
+        self.errors = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors_lock = threading.Lock()
+        self._pending_files = {} # path -> event set when the file is written, removed once it is set
+        self._pending_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._write_loop, daemon=True) for _ in range(num_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def _write_loop(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                nii_file, file_key, medical_volume, sidecars, compression_options, written = task
+                try:
+                    _write_omids(nii_file, medical_volume, sidecars, **compression_options)
+                except Exception as e:
+                    with self._errors_lock:
+                        self.errors.append((nii_file, e))
+                finally:
+                    # the next write to the same file must never wait forever
+                    written.set()
+                    with self._pending_lock:
+                        if self._pending_files.get(file_key) is written:
+                            del self._pending_files[file_key]
+            finally:
+                self._queue.task_done()
+
+    def save_omids(self, nii_file, medical_volume, save_patient_json=True, save_extra_json=True, compression=None,
+                   compression_level=None, compression_threads=None):
+        """
+        Queues a volume to be saved. Same parameters as save_omids.
+        """
+        if not self._threads:
+            raise RuntimeError('The writer is closed')
+        sidecars = _omids_sidecars(medical_volume, save_patient_json, save_extra_json)
+        compression_options = {'compression': compression, 'compression_level': compression_level,
+                               'compression_threads': compression_threads}
+        file_key = os.path.abspath(nii_file)
+        with self._pending_lock:
+            previous_write = self._pending_files.get(file_key)
+        if previous_write is not None:
+            previous_write.wait()
+        written = threading.Event()
+        with self._pending_lock:
+            self._pending_files[file_key] = written
+        self._queue.put((nii_file, file_key, medical_volume, sidecars, compression_options, written))
+
+    def close(self):
+        """
+        Waits until all the queued volumes are written and stops the threads.
+
+        Returns:
+            list: list of (nii_file, exception) for the volumes that could not be written
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
 
 save_bids = save_omids
 
-def find_omids(path, suffix):
+def find_omids(path, suffix, refresh=False):
     """
-    Finds an ORMIR-MIDS dataset with a specific suffix (e.g. mese).
+    Finds an ORMIR-MIDS dataset with a specific suffix (e.g. mese). The index of the tree is used if it exists
+    (see ormir_mids.utils.index): it includes the files written with save_omids, but not the files added by other
+    tools until it is refreshed.
 
     Parameters:
         path (str): Path to the root folder
         suffix (str): Suffix of the bids dataset
+        refresh (bool): if True, the index is updated before it is used (default: False)
 
     Returns:
         list: List of paths to the bids datasets
     """
 
-    file_pattern = (suffix + '.nii.gz').lower()
+    file_patterns = ((suffix + '.nii.gz').lower(), (suffix + '.nii').lower())
+
+    if index_exists(path):
+        return find_by_name_ending(path, file_patterns, refresh)
 
     found_files = []
 
     for root, dirs, files in os.walk(path):
         for f in files:
-            if f.lower().endswith(file_pattern):
+            if f.lower().endswith(file_patterns):
                 found_files.append(os.path.join(root, f))
 
     return found_files
\ No newline at end of file
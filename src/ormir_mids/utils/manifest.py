@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILE_NAME = 'ormirmids_manifest.json'
+
+
+def load_manifest(output_folder):
+    """
+    Loads the conversion manifest of an output folder.
+
+    Parameters:
+        output_folder (str): Path to the output folder
+
+    Returns:
+        dict: SeriesInstanceUID -> manifest entry. Empty if the manifest does not exist or cannot be read
+    """
+    try:
+        with open(os.path.join(output_folder, MANIFEST_FILE_NAME), 'r') as f:
+            return json.load(f)['series']
+    except (FileNotFoundError, ValueError, KeyError):
+        return {}
+
+
+def save_manifest(output_folder, manifest):
+    """
+    Saves the conversion manifest of an output folder. The file is replaced atomically, so that an
+    interrupted run never leaves a truncated manifest.
+
+    Parameters:
+        output_folder (str): Path to the output folder
+        manifest (dict): SeriesInstanceUID -> manifest entry
+
+    Returns:
+        None
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'series': manifest}, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def fingerprint_files(file_list, root_folder):
+    """
+    Computes a fingerprint of a list of files from their paths, sizes and modification times.
+    The content of the files is not read.
+
+    Parameters:
+        file_list (list): the file paths
+        root_folder (str): the paths are taken relative to this folder, so that the input can be moved
+
+    Returns:
+        str: the fingerprint
+    """
+    fingerprint = hashlib.sha1()
+    for file_path in sorted(file_list):
+        stat = os.stat(file_path)
+        relative_path = os.path.relpath(file_path, root_folder).replace(os.sep, '/')
+        fingerprint.update(f'{relative_path}\t{stat.st_size}\t{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def make_manifest_entry(fingerprint, version, outputs):
+    """
+    Creates the manifest entry of a series.
+
+    Parameters:
+        fingerprint (str): the fingerprint of the source files
+        version (str): the version of ormir_mids used for the conversion
+        outputs (list): list of (converter name, output path relative to the output folder). The output path is None
+            if the conversion or the saving failed
+
+    Returns:
+        dict: the manifest entry. Its status is 'failed' if any output failed, 'converted' otherwise
+    """
+    return {
+        'fingerprint': fingerprint,
+        'version': version,
+        'status': 'failed' if any(output_path is None for _, output_path in outputs) else 'converted',
+        'converters': sorted(set(converter_name for converter_name, output_path in outputs
+                                 if output_path is not None)),
+        'outputs': sorted(set(output_path for _, output_path in outputs if output_path is not None)),
+    }
+
+
+def is_up_to_date(manifest_entry, fingerprint, version, output_folder):
+    """
+    Checks if a series must be converted again.
+
+    Parameters:
+        manifest_entry (dict): the manifest entry of the series, or None
+        fingerprint (str): the current fingerprint of the source files
+        version (str): the current version of ormir_mids
+        output_folder (str): Path to the output folder
+
+    Returns:
+        bool: True if the previous conversion succeeded and produced outputs, the source files and the converter did
+            not change and all the outputs still exist
+    """
+    if not manifest_entry:
+        return False
+    if manifest_entry.get('fingerprint') != fingerprint or manifest_entry.get('version') != version:
+        return False
+    # the failed conversions are tried again
+    if manifest_entry.get('status') == 'failed' or not manifest_entry.get('outputs'):
+        return False
+    return all(os.path.exists(os.path.join(output_folder, output_path))
+               for output_path in manifest_entry['outputs'])
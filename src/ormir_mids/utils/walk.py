@@ -0,0 +1,221 @@
+"""
+Listing of the DICOM files of a folder tree.
+
+The folders are listed with os.scandir in a thread pool, so that the subfolders are listed concurrently, and the files
+are classified by reading only their first 132 bytes: the 128 bytes of preamble and the 'DICM' marker, or the first data element
+of the files without preamble. The files that are referenced by a DICOMDIR are known to be DICOM files and are not opened. Only the DICOM files are passed to the
+dicom reader, which would otherwise try to parse every file of the tree (reports, screenshots, .DS_Store etc.).
+
+Usage:
+    statistics = {}
+    for folder, file_list in walk_dicom_folders('/data/dicom', statistics=statistics):
+        ...
+    print(format_walk_statistics(statistics))
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pydicom
+from natsort import natsorted
+
+DICOM_PREAMBLE_SIZE = 128
+DICOM_MAGIC = b'DICM'
+DICOMDIR_NAME = 'DICOMDIR'
+
+# number of files classified by each task of the thread pool
+_CLASSIFY_CHUNK_SIZE = 64
+
+# groups of the first element of the files without preamble (e.g. ACR-NEMA), and the largest element number that
+# can come first in each group
+_NO_PREAMBLE_GROUPS = {0x0002: 0x0102, 0x0008: 0x0FFF}
+
+_EXPLICIT_VRS = {
+    b'AE', b'AS', b'AT', b'CS', b'DA', b'DS', b'DT', b'FD', b'FL', b'IS', b'LO', b'LT', b'OB', b'OD', b'OF', b'OL',
+    b'OV', b'OW', b'PN', b'SH', b'SL', b'SQ', b'SS', b'ST', b'SV', b'TM', b'UC', b'UI', b'UL', b'UN', b'UR', b'US',
+    b'UT', b'UV',
+}
+
+
+def is_dicom_file(file_path):
+    """
+    Checks if a file is a DICOM file by reading its preamble.
+
+    Parameters:
+        file_path (str): Path to the file
+
+    Returns:
+        bool: True if the file has the 'DICM' marker after the preamble, or if it starts with a plausible file meta
+            or identifying group element, as the DICOM files without preamble do
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(DICOM_PREAMBLE_SIZE + len(DICOM_MAGIC))
+            file_size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return False
+    if header[DICOM_PREAMBLE_SIZE:] == DICOM_MAGIC:
+        return True
+    return _is_first_element(header, file_size)
+
+
+def _is_first_element(header, file_size):
+    """
+    Checks if the first bytes of a file without preamble are a little endian data element of group 0002 or 0008:
+    a small element number, followed by either a valid explicit VR or an even implicit length that fits in the file
+    """
+    if len(header) < 8:
+        return False
+    group = int.from_bytes(header[0:2], 'little')
+    element = int.from_bytes(header[2:4], 'little')
+    if group not in _NO_PREAMBLE_GROUPS or element > _NO_PREAMBLE_GROUPS[group]:
+        return False
+    if header[4:6] in _EXPLICIT_VRS:
+        return True
+    implicit_length = int.from_bytes(header[4:8], 'little')
+    return implicit_length % 2 == 0 and implicit_length <= file_size - 8
+
+
+def _path_key(file_path):
+    """ Key used to match the paths of a DICOMDIR, whose file ids are usually upper case """
+    return os.path.normcase(os.path.normpath(file_path)).lower()
+
+
+def read_dicomdir(dicomdir_path):
+    """
+    Reads the files referenced by a DICOMDIR.
+
+    Parameters:
+        dicomdir_path (str): Path to the DICOMDIR file
+
+    Returns:
+        set: the keys (see _path_key) of the paths of the referenced files. Empty if the DICOMDIR cannot be read
+    """
+    try:
+        dicomdir = pydicom.dcmread(dicomdir_path, stop_before_pixels=True, force=True)
+        records = dicomdir.get('DirectoryRecordSequence', [])
+    except Exception:
+        return set()
+    root = os.path.dirname(dicomdir_path)
+    referenced_files = set()
+    for record in records:
+        file_id = record.get('ReferencedFileID', None)
+        if not file_id:
+            continue
+        if isinstance(file_id, str):
+            file_id = [file_id]
+        referenced_files.add(_path_key(os.path.join(root, *[str(part) for part in file_id])))
+    return referenced_files
+
+
+def _classify_files(file_paths, known_files):
+    """ Returns the DICOM files of a list """
+    return [file_path for file_path in file_paths if _path_key(file_path) in known_files or is_dicom_file(file_path)]
+
+
+def _scan_folder(executor, stopped, folder, known_files, recursive, ignore_hidden):
+    """
+    Lists a folder, and submits to the executor the classification of its files and the listing of its subfolders.
+    The tasks never wait for other tasks, so the pool cannot deadlock. Nothing is listed once the stopped event is set.
+
+    Returns:
+        dict: 'folder', 'chunks' (futures of the lists of DICOM files), 'subfolders' (futures of the results of the
+            subfolders), 'n_files' (number of candidate files), 'n_hidden', 'n_dicomdir' and 'error' (the exception
+            raised while listing the folder)
+    """
+    result = {'folder': folder, 'chunks': [], 'subfolders': [], 'n_files': 0, 'n_hidden': 0, 'n_dicomdir': 0,
+              'error': None}
+    if stopped.is_set():
+        return result
+    file_paths = []
+    subfolders = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subfolders.append(entry.path)
+                elif not entry.is_file():
+                    continue
+                elif ignore_hidden and entry.name.startswith('.'):
+                    result['n_hidden'] += 1
+                elif entry.name.upper() == DICOMDIR_NAME:
+                    result['n_dicomdir'] += 1
+                    # the DICOMDIR is not an image, but the files it references are known to be DICOM files
+                    known_files = known_files | read_dicomdir(entry.path)
+                else:
+                    file_paths.append(entry.path)
+    except OSError as e:
+        result['error'] = e
+        return result
+
+    result['n_files'] = len(file_paths)
+    for chunk_start in range(0, len(file_paths), _CLASSIFY_CHUNK_SIZE):
+        result['chunks'].append(executor.submit(
+            _classify_files, file_paths[chunk_start:chunk_start + _CLASSIFY_CHUNK_SIZE], known_files))
+    if recursive:
+        # same order as os.listdir
+        for subfolder in subfolders:
+            result['subfolders'].append(executor.submit(
+                _scan_folder, executor, stopped, subfolder, known_files, recursive, ignore_hidden))
+    return result
+
+
+def walk_dicom_folders(path, recursive=True, io_threads=None, ignore_hidden=True, statistics=None):
+    """
+    Lists the DICOM files of a folder and its subfolders. The subfolders are listed, and the files are classified, in
+    a thread pool, ahead of the caller.
+
+    Parameters:
+        path (str): Path to the root folder
+        recursive (bool): If True, the subfolders are listed too
+        io_threads (int): Number of threads used to list the folders and read the preambles (default: None, the
+            default of ThreadPoolExecutor)
+        ignore_hidden (bool): If True, the hidden files (starting with '.') are skipped
+        statistics (dict): if not None, the counts of folders, DICOM files and skipped files are added to it
+            (see format_walk_statistics)
+
+    Returns:
+        generator: (folder, list of DICOM files in natsort order) for each folder, the root first, then each
+            subfolder followed by its own subfolders, in the order of os.listdir. The folders without DICOM files
+            are included. A folder that cannot be listed raises its error when it is reached
+    """
+    if statistics is not None:
+        for key in ['folders', 'dicom_files', 'skipped_files', 'hidden_files', 'dicomdirs']:
+            statistics.setdefault(key, 0)
+
+    executor = ThreadPoolExecutor(max_workers=None if io_threads is None else max(1, io_threads))
+    stopped = threading.Event()
+    try:
+        stack = [executor.submit(_scan_folder, executor, stopped, path, frozenset(), recursive, ignore_hidden)]
+        while stack:
+            result = stack.pop().result()
+            if result['error'] is not None:
+                raise result['error']
+            file_list = natsorted([file_path for chunk in result['chunks'] for file_path in chunk.result()])
+            if statistics is not None:
+                statistics['folders'] += 1
+                statistics['dicom_files'] += len(file_list)
+                statistics['skipped_files'] += result['n_files'] - len(file_list)
+                statistics['hidden_files'] += result['n_hidden']
+                statistics['dicomdirs'] += result['n_dicomdir']
+            stack.extend(reversed(result['subfolders']))
+            yield result['folder'], file_list
+    finally:
+        # the caller may stop before the end of the tree: the pending listings return immediately
+        stopped.set()
+        executor.shutdown(wait=False)
+
+
+def format_walk_statistics(statistics):
+    """
+    Formats the statistics of walk_dicom_folders.
+
+    Parameters:
+        statistics (dict): the statistics
+
+    Returns:
+        str: a summary of the statistics
+    """
+    return (f"Listed {statistics.get('folders', 0)} folders: {statistics.get('dicom_files', 0)} DICOM files, "
+            f"{statistics.get('skipped_files', 0)} other files skipped, "
+            f"{statistics.get('hidden_files', 0)} hidden files, {statistics.get('dicomdirs', 0)} DICOMDIR")
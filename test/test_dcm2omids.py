@@ -0,0 +1,84 @@
+import os
+
+import nibabel
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from ormir_mids.dcm2omids import convert_dicom_to_ormirmids
+
+
+def _write_mese_series(folder, series_uid, n_slices, size, pixel_value):
+    """Writes a Siemens multi-echo spin echo series of constant pixel value"""
+    os.makedirs(folder, exist_ok=True)
+    for index in range(3 * n_slices):
+        ds = Dataset()
+        ds.file_meta = FileMetaDataset()
+        ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+        ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = '1.2.3.4'
+        ds.SeriesInstanceUID = series_uid
+        ds.SeriesNumber = 3
+        ds.InstanceNumber = index + 1
+        ds.Modality = 'MR'
+        ds.Manufacturer = 'SIEMENS'
+        ds.PatientName = 'Doe^John'
+        ds.PatientID = '123'
+        ds.ImageType = ['ORIGINAL', 'PRIMARY', 'M', 'ND']
+        ds.ScanningSequence = 'SE'
+        ds.SequenceName = 'se'
+        ds.EchoTime = 10.0 * (index // n_slices + 1)
+        ds.RepetitionTime = 20
+        ds.FlipAngle = 15
+        ds.PixelBandwidth = 400
+        ds.ImagingFrequency = 123.2
+        ds.MagneticFieldStrength = 3
+        ds.InPlanePhaseEncodingDirection = 'ROW'
+        ds.ImageComments = 'comment'
+        ds.ImagePositionPatient = [0, 0, float(index % n_slices) * 2]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [1, 1]
+        ds.SliceThickness = 2
+        ds.Rows = size
+        ds.Columns = size
+        ds.BitsAllocated = 16
+        ds.BitsStored = 12
+        ds.HighBit = 11
+        ds.PixelRepresentation = 0
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.PixelData = np.full((size, size), pixel_value, dtype=np.uint16).tobytes()
+        pydicom.dcmwrite(os.path.join(folder, f'{series_uid}_{index:05d}'), ds, enforce_file_format=True)
+
+
+def _read_outputs(output_folder):
+    outputs = {}
+    for folder, _, files in os.walk(output_folder):
+        for file_name in files:
+            if file_name.endswith('.nii.gz'):
+                file_path = os.path.join(folder, file_name)
+                outputs[os.path.relpath(file_path, output_folder)] = np.unique(nibabel.load(file_path).get_fdata())
+    return outputs
+
+
+def test_parallel_same_output_files(tmp_path):
+    """Two series saved to the same file are written in input order by the parallel conversion, as in a serial run"""
+    # the series of a folder are loaded in the order of their uid. The first series takes longer to convert, it
+    # must still be overwritten by the second one
+    _write_mese_series(str(tmp_path / 'input'), '1.2.3.4.1', 20, 64, 100)
+    _write_mese_series(str(tmp_path / 'input'), '1.2.3.4.2', 2, 8, 200)
+    convert_dicom_to_ormirmids(str(tmp_path / 'input'), str(tmp_path / 'serial'))
+    serial_outputs = _read_outputs(str(tmp_path / 'serial'))
+    assert len(serial_outputs) == 1
+    assert [list(values) for values in serial_outputs.values()] == [[200]]
+
+    for run in range(3):
+        output_folder = str(tmp_path / f'parallel{run}')
+        convert_dicom_to_ormirmids(str(tmp_path / 'input'), output_folder, workers=2)
+        parallel_outputs = _read_outputs(output_folder)
+        assert parallel_outputs.keys() == serial_outputs.keys()
+        for file_path, values in serial_outputs.items():
+            assert np.array_equal(parallel_outputs[file_path], values)
@@ -0,0 +1,80 @@
+from ormir_mids.converter_base import Converter
+from ormir_mids.converter_base.dispatch import DispatchPlan, format_trace
+from ormir_mids.utils.facts import volume_fact
+
+
+class _Volume:
+    def __init__(self, vendor):
+        self.vendor = vendor
+        self.evaluations = 0
+
+
+def _get_vendor(volume):
+    def compute():
+        volume.evaluations += 1
+        return volume.vendor
+    return volume_fact(volume, 'vendor', compute, (volume.vendor,))
+
+
+class _Root(Converter):
+    children = None
+
+    @classmethod
+    def get_name(cls):
+        return 'Root'
+
+    @classmethod
+    def is_dataset_compatible(cls, med_volume):
+        return True
+
+
+class _Vendor(Converter):
+    children = None
+
+    @classmethod
+    def get_name(cls):
+        return 'Vendor'
+
+    @classmethod
+    def is_dataset_compatible(cls, med_volume):
+        return _get_vendor(med_volume) == 'A'
+
+
+class _Leaf(Converter):
+    children = None
+
+    @classmethod
+    def get_name(cls):
+        return 'Leaf'
+
+    @classmethod
+    def is_dataset_compatible(cls, med_volume):
+        return _get_vendor(med_volume) == 'A'
+
+    @classmethod
+    def convert_dataset(cls, med_volume):
+        return med_volume
+
+
+_Vendor.set_parent(_Root)
+_Leaf.set_parent(_Vendor)
+
+
+def test_dispatch_plan():
+    """The facts are computed once per volume, and incompatible nodes prune their subtree"""
+    plan = DispatchPlan(_Root)
+    volume = _Volume('A')
+    assert list(plan.iter_converters(volume)) == [_Leaf]
+    assert volume.evaluations == 1
+    # the facts stay on the volume until their stamp changes
+    _get_vendor(volume)
+    assert volume.evaluations == 1
+    volume.vendor = 'B'
+    assert list(plan.iter_converters(volume)) == []
+    assert volume.evaluations == 2
+
+    trace = []
+    assert plan.find_converters(_Volume('B'), trace) == []
+    assert [record['converter'] for record in trace] == ['Root', 'Vendor']
+    assert trace[1]['pruned'] == 1
+    assert 'not compatible' in format_trace(trace)[1]
@@ -0,0 +1,279 @@
+import copy
+import io
+import pickle
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+from ormir_mids.utils.OMidsMedVolume import OMidsMedVolume
+from ormir_mids.utils.headers import ColumnarHeaders, headers_to_dicts, dicts_to_headers, generate_uids, \
+    dicom_volume_to_bids, slice_volume_3d, split_volume_3d, get_volume_part, group, ungroup, concatenate_volumes_3d, \
+    MultiseriesAccumulator, tag_fact, get_n_echo_times, get_raw_tag_value, get_manufacturer
+from ormir_mids.config.tag_definitions import TagDefinitionDict
+from ormir_mids.utils.facts import clear_volume_facts
+
+
+def _make_slice(index, transfer_syntax):
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+    file_meta.MediaStorageSOPInstanceUID = f'1.2.3.{index}'
+    file_meta.TransferSyntaxUID = transfer_syntax
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPInstanceUID = f'1.2.3.{index}'
+    ds.Manufacturer = 'SIEMENS'
+    ds.EchoTime = 10.0
+    ds.ImagePositionPatient = [0.0, 0.0, float(index)]
+    ds.ImageComments = 'first' if index == 0 else 'other'
+    ds.add_new(0x00290010, 'LO', 'SIEMENS CSA HEADER')
+    ds.add_new(0x00291010, 'OB', bytes(16))
+    ds.Rows = 2
+    ds.Columns = 2
+    ds.BitsAllocated = 16
+    ds.PixelData = bytes(8)
+    buffer = io.BytesIO()
+    pydicom.dcmwrite(buffer, ds, enforce_file_format=True, implicit_vr=transfer_syntax == ImplicitVRLittleEndian)
+    buffer.seek(0)
+    return pydicom.dcmread(buffer)
+
+
+def test_columnar_headers():
+    """Constant tags are stored once and the tags that change are lists, as with the JSON dictionaries"""
+    for transfer_syntax in [ExplicitVRLittleEndian, ImplicitVRLittleEndian]:
+        slices = [_make_slice(i, transfer_syntax) for i in range(3)]
+        slices[2].EchoTime = 10.0 # decoded element with the same value
+        reference = [s.to_json_dict() for s in slices]
+
+        meta, header = headers_to_dicts(slices)
+        assert header['00080070'] == reference[0]['00080070']
+        assert header['00180081'] == reference[0]['00180081']
+        assert header['00291010'] == reference[0]['00291010']
+        assert header['00200032'] == {'vr': 'DS', 'Value': [r['00200032']['Value'] for r in reference], 'isList': True}
+        assert header['00204000']['Value'] == [['first'], ['other'], ['other']]
+        assert header['7FE00010']['InlineBinary'] == ''
+        assert meta['00020003']['Value'] == [['1.2.3.0'], ['1.2.3.1'], ['1.2.3.2']]
+
+        columns = ColumnarHeaders.from_datasets(slices)
+        assert np.array_equal(columns.get_values('00200032'), [[0, 0, 0], [0, 0, 1], [0, 0, 2]])
+        assert columns.get_values('00080070') == reference[0]['00080070']
+
+
+def test_dicts_to_headers():
+    """The headers are rebuilt from the compressed dictionaries, and the slices do not share their elements"""
+    slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(3)]
+    meta, header = headers_to_dicts(slices)
+    new_slices = dicts_to_headers(3, header, meta)
+    for uid, new_slice in zip(generate_uids(3), new_slices):
+        new_slice.SOPInstanceUID = uid
+    for original_slice, new_slice in zip(slices, new_slices):
+        assert new_slice.ImagePositionPatient == original_slice.ImagePositionPatient
+        assert new_slice.Manufacturer == 'SIEMENS'
+        assert new_slice.file_meta.MediaStorageSOPInstanceUID == original_slice.file_meta.MediaStorageSOPInstanceUID
+        assert new_slice.PixelData == b''
+    assert len({new_slice.SOPInstanceUID for new_slice in new_slices}) == 3
+    assert all(len(uid) <= 64 for uid in generate_uids(10000))
+
+
+def test_slice_volume_3d():
+    """Regular ranges of slices are views of the volume, and the headers of the original volume are not modified"""
+    slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(4)]
+    for i, s in enumerate(slices):
+        s.EchoTime = float(i % 2 + 1)
+        s.InPlanePhaseEncodingDirection = 'ROW'
+        s.PatientName = 'Patient'
+    volume = dicom_volume_to_bids(OMidsMedVolume(np.arange(16).reshape((2, 2, 4)), np.eye(4), headers=slices))
+    extra_header = copy.deepcopy(volume.extra_header)
+
+    first_echo = slice_volume_3d(volume, [0, 2])
+    assert np.shares_memory(first_echo.volume, volume.volume)
+    assert first_echo.omids_header['EchoTime'] == 1.0
+    assert first_echo.extra_header['00200032']['Value'] == [[0.0, 0.0, 0.0], [0.0, 0.0, 2.0]]
+    assert first_echo.patient_header['PatientName'] == volume.patient_header['PatientName']
+
+    shuffled = slice_volume_3d(volume, [3, 0])
+    assert not np.shares_memory(shuffled.volume, volume.volume)
+    assert np.array_equal(shuffled.volume, volume.volume[:, :, [3, 0]])
+    assert shuffled.omids_header['EchoTime'] == [2.0, 1.0]
+    assert volume.extra_header == extra_header
+
+
+def test_split_volume():
+    """The parts are the same as the sliced volumes, and they are only computed once until their tags change"""
+    slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(4)]
+    for i, s in enumerate(slices):
+        s.EchoTime = float(i % 2 + 1)
+        s.InPlanePhaseEncodingDirection = 'ROW'
+    volume = dicom_volume_to_bids(OMidsMedVolume(np.arange(16).reshape((2, 2, 4)), np.eye(4), headers=slices))
+    parts = split_volume_3d(volume, {'first': [0, 2], 'second': [1, 3]})
+    for name, slices_list in [('first', [0, 2]), ('second', [1, 3])]:
+        sliced_volume = slice_volume_3d(volume, slices_list)
+        assert np.array_equal(parts[name].volume, sliced_volume.volume)
+        assert parts[name].omids_header == sliced_volume.omids_header
+        assert parts[name].extra_header == sliced_volume.extra_header
+    # the per-slice lists that are constant in a part are collapsed
+    assert parts['second'].omids_header['EchoTime'] == 2.0
+    assert 'isList' not in parts['second'].extra_header['00180081']
+    assert volume.omids_header['EchoTime'] == [1.0, 2.0, 1.0, 2.0]
+
+    n_calls = []
+
+    def get_indices(med_volume):
+        n_calls.append(1)
+        return {'first': [0, 2], 'second': [1, 3], 'empty': []}
+
+    first_part = get_volume_part(volume, get_indices, 'first', tags=('00180081',))
+    first_part.omids_header['EchoTime'] = 10.0
+    # the values of the headers are not shared with the cached parts or with the volume
+    first_part.extra_header['00200032']['Value'][0][2] = 100.0
+    first_part.extra_header['00080070']['Value'].append('OTHER')
+    for meta_element in first_part.meta_header.values():
+        meta_element.clear()
+    source_position = volume.extra_header['00200032']['Value'][0]
+    assert source_position[2] != 100.0
+    for other_part in [get_volume_part(volume, get_indices, 'first', tags=('00180081',)), parts['first']]:
+        assert other_part.extra_header['00200032']['Value'][0] == source_position
+        assert other_part.extra_header['00080070']['Value'] == volume.extra_header['00080070']['Value']
+        assert other_part.meta_header == volume.meta_header
+    assert volume.meta_header and all(volume.meta_header.values())
+    assert get_volume_part(volume, get_indices, 'first', tags=('00180081',)).omids_header['EchoTime'] == 1.0
+    assert get_volume_part(volume, get_indices, 'second', tags=('00180081',)).omids_header['EchoTime'] == 2.0
+    assert len(n_calls) == 1
+    # the parts are extracted again, from the modified header, when a tag read by get_indices is replaced
+    volume.omids_header['EchoTime'] = [echo_time + 2 for echo_time in volume.omids_header['EchoTime']]
+    assert get_volume_part(volume, get_indices, 'second', tags=('00180081',)).omids_header['EchoTime'] == 4.0
+    assert len(n_calls) == 2
+    # without tags, the parts are not cached
+    get_volume_part(volume, get_indices, 'first')
+    assert len(n_calls) == 3
+
+    # the tags of a tag fact are used by default
+    @tag_fact('00180081')
+    def get_fact_indices(med_volume):
+        return get_indices(med_volume)
+
+    get_volume_part(volume, get_fact_indices, 'first')
+    get_volume_part(volume, get_fact_indices, 'second')
+    assert len(n_calls) == 4
+
+
+def test_group_ungroup():
+    """Grouping puts the slices of each value in a 4D volume, ungrouping restores the 3D volume and its headers"""
+    slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(6)]
+    for i, s in enumerate(slices):
+        s.EchoTime = float(i % 2 + 1)
+        s.InPlanePhaseEncodingDirection = 'ROW'
+    volume = dicom_volume_to_bids(OMidsMedVolume(np.arange(24).reshape((2, 2, 6)), np.eye(4), headers=slices))
+    extra_header = copy.deepcopy(volume.extra_header)
+
+    grouped_volume = group(volume, 'EchoTime')
+    assert grouped_volume.shape == (2, 2, 3, 2)
+    assert np.array_equal(grouped_volume.volume[:, :, :, 0], volume.volume[:, :, [0, 2, 4]])
+    assert np.array_equal(grouped_volume.volume[:, :, :, 1], volume.volume[:, :, [1, 3, 5]])
+    assert grouped_volume.omids_header['EchoTime'] == [1.0, 2.0]
+    assert grouped_volume.extra_header['00200032']['Value'][1] == [[0.0, 0.0, 2.0], [0.0, 0.0, 3.0]]
+    assert volume.extra_header == extra_header
+
+    ungrouped_volume = ungroup(grouped_volume)
+    assert np.array_equal(ungrouped_volume.volume, volume.volume[:, :, [0, 2, 4, 1, 3, 5]])
+    assert ungrouped_volume.omids_header['EchoTime'] == [1.0, 1.0, 1.0, 2.0, 2.0, 2.0]
+    assert ungrouped_volume.extra_header['00200032']['Value'] == \
+           [extra_header['00200032']['Value'][i] for i in [0, 2, 4, 1, 3, 5]]
+
+
+def test_concatenate_volumes():
+    """The volumes and their headers are concatenated in order, also when the volumes have different sizes"""
+    volumes = []
+    for echo_time, n_slices in [(4.0, 2), (8.0, 3), (12.0, 2)]:
+        slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(n_slices)]
+        for s in slices:
+            s.EchoTime = echo_time
+            s.InPlanePhaseEncodingDirection = 'ROW'
+        data = np.full((2, 2, n_slices), echo_time, dtype=np.float32 if n_slices == 3 else np.int16)
+        volumes.append(dicom_volume_to_bids(OMidsMedVolume(data, np.eye(4), headers=slices)))
+
+    concatenated_volume = concatenate_volumes_3d(volumes)
+    assert np.array_equal(concatenated_volume.volume, np.concatenate([v.volume for v in volumes], axis=2))
+    assert concatenated_volume.volume.dtype == np.float32
+    assert concatenated_volume.omids_header['EchoTime'] == [4.0] * 2 + [8.0] * 3 + [12.0] * 2
+    assert concatenated_volume.omids_header['Manufacturer'] == 'SIEMENS'
+    assert [p[2] for p in concatenated_volume.extra_header['00200032']['Value']] == [0, 1, 0, 1, 2, 0, 1]
+
+    # the volumes of the same size are copied into the preallocated array
+    accumulator = MultiseriesAccumulator(2)
+    accumulator.append(volumes[2])
+    accumulator.append(volumes[0])
+    assert len(accumulator) == 2
+    grouped_volume = group(accumulator.get_volume(), 'EchoTime')
+    assert grouped_volume.omids_header['EchoTime'] == [4.0, 12.0]
+    assert np.array_equal(grouped_volume.volume[..., 0], volumes[0].volume)
+
+
+def test_tag_fact():
+    """Tag facts are cached on the volume until the header entries of their tags are replaced"""
+    slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(4)]
+    for i, s in enumerate(slices):
+        s.EchoTime = float(i % 2 + 1)
+        s.InPlanePhaseEncodingDirection = 'ROW'
+    volume = dicom_volume_to_bids(OMidsMedVolume(np.arange(16).reshape((2, 2, 4)), np.eye(4), headers=slices))
+    n_calls = []
+
+    @tag_fact('00180081', '00200032')
+    def get_echo_times(med_volume):
+        n_calls.append(1)
+        return list(med_volume.omids_header['EchoTime'])
+
+    assert get_echo_times(volume) == [1.0, 2.0, 1.0, 2.0]
+    get_echo_times(volume).append(3.0)
+    assert get_echo_times(volume) == [1.0, 2.0, 1.0, 2.0]
+    volume.omids_header['FlipAngle'] = 10.0
+    assert len(n_calls) == 1
+
+    volume.omids_header['EchoTime'] = [3.0, 4.0, 3.0, 4.0]
+    assert get_echo_times(volume) == [3.0, 4.0, 3.0, 4.0]
+    volume.extra_header['00200032'] = dict(volume.extra_header['00200032'])
+    get_echo_times(volume)
+    assert len(n_calls) == 3
+
+    volume.omids_header['EchoTime'][0] = 5.0
+    clear_volume_facts(volume)
+    assert get_echo_times(volume)[0] == 5.0
+    assert get_n_echo_times(volume) == 3
+
+
+def test_pickle_volume_facts():
+    """Volumes with cached facts can be sent to other processes, without their cache"""
+    slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(2)]
+    for s in slices:
+        s.InPlanePhaseEncodingDirection = 'ROW'
+    volume = dicom_volume_to_bids(OMidsMedVolume(np.arange(8).reshape((2, 2, 2)), np.eye(4), headers=slices))
+    assert get_manufacturer(volume) == 'SIEMENS'
+    assert get_n_echo_times(volume) == 1
+    loaded_volume = pickle.loads(pickle.dumps(volume))
+    assert getattr(loaded_volume, '_volume_facts', None) is None
+    assert get_manufacturer(loaded_volume) == 'SIEMENS'
+
+
+def test_raw_tag_value_cache():
+    """Tag values are translated once, and again when the header entry is replaced or the definitions change"""
+    tag_dict = TagDefinitionDict({'00180081': 'EchoTime', '00189082': 'EchoTime', '00181314': ('FlipAngle', 'Angle')})
+    assert tag_dict.get_named_tags('00181314') == ('FlipAngle',)
+    tag_dict.add_element('00181314', 'OtherAngle', None)
+    assert tag_dict.get_named_tags('00181314') == ('FlipAngle', 'OtherAngle')
+    assert tag_dict.get_translator('EchoTime')(2.0) == [2.0]
+
+    slices = [_make_slice(i, ExplicitVRLittleEndian) for i in range(2)]
+    for i, s in enumerate(slices):
+        s.EchoTime = float(i + 1)
+        s.InPlanePhaseEncodingDirection = 'ROW'
+    volume = dicom_volume_to_bids(OMidsMedVolume(np.arange(8).reshape((2, 2, 2)), np.eye(4), headers=slices))
+    echo_times = get_raw_tag_value(volume, '00180081')
+    assert echo_times == [[1.0], [2.0]]
+    echo_times.append([3.0])
+    assert get_raw_tag_value(volume, '00180081') == [[1.0], [2.0]]
+    # the lists are shallow copies
+    assert get_raw_tag_value(volume, '00180081')[0] is echo_times[0]
+    volume.omids_header['EchoTime'] = [4.0, 5.0]
+    assert get_raw_tag_value(volume, '00180081') == [[4.0], [5.0]]
+    assert get_raw_tag_value(volume, '00080070', force_raw=True) == ['SIEMENS']
+    assert get_raw_tag_value(volume, '00181314', '00180081') == [[4.0], [5.0]]
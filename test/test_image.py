@@ -0,0 +1,163 @@
+import numpy as np
+from scipy.ndimage import map_coordinates
+from ormir_mids.utils.OMidsMedVolume import OMidsMedVolume
+from ormir_mids.utils.image import realign_medical_volume, realign_medical_volumes
+from ormir_mids.utils.headers import ungroup
+
+
+def _make_volumes(dtype=np.float64):
+    rng = np.random.default_rng(0)
+    source_affine = np.diag([0.9, 1.1, 2.0, 1.0])
+    source_affine[:3, 3] = [1, 2, 3]
+    angle = 0.1
+    destination_affine = np.eye(4)
+    destination_affine[:2, :2] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    destination_affine[:3, 3] = [0.5, -1, 2]
+    source = OMidsMedVolume((rng.random((23, 19, 11)) * 100).astype(dtype), source_affine)
+    destination = OMidsMedVolume(np.zeros((29, 21, 17)), destination_affine)
+    return source, destination
+
+
+def _get_source_coordinates(source, destination):
+    grid = np.array(np.meshgrid(*[np.arange(s) for s in destination.shape], indexing='ij'), dtype=float)
+    coordinates = np.concatenate([grid, np.ones((1,) + destination.shape)]).reshape((4, -1))
+    coordinates = (np.linalg.inv(source.affine) @ destination.affine @ coordinates)[:3]
+    return coordinates.reshape((3,) + destination.shape)
+
+
+def test_realign_slabs():
+    """Realigning by slabs, with or without threads, gives the same result as interpolating the whole grid"""
+    source, destination = _make_volumes()
+    expected = map_coordinates(source.volume, _get_source_coordinates(source, destination), order=3)
+
+    realigned = realign_medical_volume(source, destination)
+    assert np.array_equal(realigned.volume, expected)
+    assert np.allclose(realigned.affine, destination.affine)
+    assert np.array_equal(realign_medical_volume(source, destination, memory_budget=1).volume, expected)
+    assert np.array_equal(realign_medical_volume(source, destination, memory_budget=20000, num_threads=3).volume,
+                          expected)
+
+    source, destination = _make_volumes(np.int16)
+    realigned = realign_medical_volume(source, destination, interpolation_order=1, memory_budget=1)
+    assert realigned.volume.dtype == np.int16
+    assert np.array_equal(realigned.volume, realign_medical_volume(source, destination, interpolation_order=1).volume)
+
+
+def test_realign_batch():
+    """4D volumes and lists of volumes are realigned as each of their 3D volumes, and 4D volumes keep their headers"""
+    source, destination = _make_volumes()
+    second_echo = OMidsMedVolume(source.volume[::-1].copy(), source.affine)
+    source_4d = OMidsMedVolume(np.stack([source.volume, second_echo.volume], axis=3), source.affine)
+    source_4d.omids_header = {'EchoTime': [2.0, 4.0], 'FourthDimension': 'EchoTime'}
+    shifted = OMidsMedVolume(source.volume, source.affine + np.diag([0, 0, 0.5, 0]))
+
+    expected = [realign_medical_volume(volume, destination).volume for volume in [source, second_echo, shifted]]
+    realigned_4d = realign_medical_volume(source_4d, destination, memory_budget=20000)
+    assert realigned_4d.shape == destination.shape + (2,)
+    assert np.array_equal(realigned_4d.volume[..., 0], expected[0])
+    assert np.array_equal(realigned_4d.volume[..., 1], expected[1])
+    assert realigned_4d.omids_header['EchoTime'] == [2.0, 4.0]
+
+    realigned_list = realign_medical_volumes([source, shifted, second_echo], destination)
+    for realigned, expected_volume in zip(realigned_list, [expected[0], expected[2], expected[1]]):
+        assert np.array_equal(realigned.volume, expected_volume)
+
+
+def test_realign_headers():
+    """The realigned volumes keep the headers of the source that do not depend on its slices, and take the geometry of
+    the slices from the destination, for 3D and 4D sources"""
+    source, destination = _make_volumes()
+    n_source_slices = source.shape[2]
+    n_slices = destination.shape[2]
+    destination.extra_header = {
+        '00200032': {'vr': 'DS', 'Value': [[0.5, -1, 2 + z] for z in range(n_slices)], 'isList': True},
+        '00280030': {'vr': 'DS', 'Value': [1, 1]},
+        '00180081': {'vr': 'DS', 'Value': [30.0]},
+    }
+    source_4d = OMidsMedVolume(np.stack([source.volume, source.volume], axis=3), source.affine)
+    source_4d.omids_header = {'EchoTime': [2.0, 4.0], 'FourthDimension': 'EchoTime',
+                              'ImageTypeSiemens': [['M', str(z)] for z in range(n_source_slices)]}
+    source_4d.extra_header = {
+        '00080070': {'vr': 'LO', 'Value': ['SIEMENS']},
+        '00180081': {'vr': 'DS', 'Value': [[2.0, 4.0]] * n_source_slices, 'isList': True, 'is4dList': True},
+        '00080008': {'vr': 'CS', 'Value': [[['M', str(z)]] * 2 for z in range(n_source_slices)], 'isList': True,
+                     'is4dList': True},
+        '00200032': {'vr': 'DS', 'Value': [[[1, 2, 3 + 2 * z]] * 2 for z in range(n_source_slices)], 'isList': True,
+                     'is4dList': True},
+        '00201041': {'vr': 'DS', 'Value': [[3 + 2 * z] * 2 for z in range(n_source_slices)], 'isList': True,
+                     'is4dList': True},
+        '00280030': {'vr': 'DS', 'Value': [0.9, 1.1]},
+    }
+    source_4d.meta_header = {'00020003': {'vr': 'UI', 'Value': [[str(z)] * 2 for z in range(n_source_slices)],
+                                          'isList': True, 'is4dList': True}}
+
+    realigned_4d = realign_medical_volume(source_4d, destination)
+    assert realigned_4d.omids_header == {'EchoTime': [2.0, 4.0], 'FourthDimension': 'EchoTime'}
+    extra_header = realigned_4d.extra_header
+    assert sorted(extra_header) == ['00080070', '00180081', '00200032', '00280030']
+    assert extra_header['00180081']['Value'] == [[2.0, 4.0]] * n_slices
+    assert extra_header['00200032']['Value'] == [[[0.5, -1, 2 + z]] * 2 for z in range(n_slices)]
+    assert extra_header['00280030']['Value'] == [1, 1]
+    assert realigned_4d.meta_header == {}
+    assert source_4d.extra_header['00200032']['Value'][0] == [[1, 2, 3]] * 2
+    ungrouped = ungroup(realigned_4d)
+    assert len(ungrouped.extra_header['00180081']['Value']) == 2 * n_slices
+    assert len(ungrouped.extra_header['00200032']['Value']) == 2 * n_slices
+
+    # the same rule for a 3D source
+    source.omids_header = {'EchoTime': 2.0, 'ImageTypeSiemens': [['M', str(z)] for z in range(n_source_slices)]}
+    source.extra_header = {key: source_4d.extra_header[key] for key in ['00080070', '00280030']}
+    source.extra_header['00180081'] = {'vr': 'DS', 'Value': [2.0]}
+    source.extra_header['00080008'] = {'vr': 'CS', 'Value': [['M', str(z)] for z in range(n_source_slices)],
+                                       'isList': True}
+    realigned = realign_medical_volume(source, destination)
+    assert realigned.omids_header == {'EchoTime': 2.0}
+    assert sorted(realigned.extra_header) == ['00080070', '00180081', '00200032', '00280030']
+    assert realigned.extra_header['00180081']['Value'] == [2.0]
+    assert realigned.extra_header['00200032'] == destination.extra_header['00200032']
+
+
+def test_realign_exact():
+    """Permutations, flips and shifts of whole voxels copy the voxels, the rest of the destination is 0"""
+    source, _ = _make_volumes()
+    grid_transform = np.array([[0, 1, 0, 2], [-1, 0, 0, 15], [0, 0, 1, -3], [0, 0, 0, 1]], dtype=float)
+    destination = OMidsMedVolume(np.zeros((12, 20, 9)), source.affine @ grid_transform)
+
+    realigned = realign_medical_volume(source, destination)
+    expected = np.zeros((12, 20, 9))
+    # destination (i, j, k) reads source (j + 2, 15 - i, k - 3)
+    expected[:, :, 3:] = source.volume[2:22, 15:3:-1, :6].transpose((1, 0, 2))
+    assert np.array_equal(realigned.volume, expected)
+
+    interpolated = realign_medical_volume(source, destination, exact_tolerance=None)
+    assert np.allclose(realigned.volume[1:-1, 1:-1, 4:-1], interpolated.volume[1:-1, 1:-1, 4:-1])
+
+
+def test_realign_labels():
+    """Label maps keep their data type and their labels, and float32 coefficients are close to float64 ones"""
+    source, destination = _make_volumes()
+    labels = np.zeros(source.shape, dtype=np.uint16)
+    labels[5:18, 4:15, 2:9] = 3
+    labels[8:12, 6:10, 3:7] = 700
+    label_source = OMidsMedVolume(labels, source.affine)
+    coordinates = _get_source_coordinates(label_source, destination)
+
+    nearest = realign_medical_volume(label_source, destination, label_mode='nearest', memory_budget=30000)
+    assert nearest.volume.dtype == np.uint16
+    assert np.array_equal(nearest.volume, map_coordinates(labels, coordinates, order=0))
+
+    weights = np.stack([map_coordinates((labels == label).astype(float), coordinates, order=1)
+                        for label in [0, 3, 700]])
+    expected = np.array([0, 3, 700], dtype=np.uint16)[np.argmax(weights, axis=0)]
+    expected[weights.max(axis=0) == 0] = 0
+    for num_threads in [1, 2]:
+        majority = realign_medical_volume(label_source, destination, label_mode='majority', memory_budget=30000,
+                                          num_threads=num_threads)
+        assert majority.volume.dtype == np.uint16
+        # the weights are compared in float32: only the ties can differ
+        assert np.mean(majority.volume != expected) < 0.001
+        assert set(np.unique(majority.volume)) == {0, 3, 700}
+
+    single = realign_medical_volume(source, destination, compute_dtype=np.float32)
+    assert single.volume.dtype == np.float64
+    assert np.allclose(single.volume, realign_medical_volume(source, destination).volume, atol=1e-3)
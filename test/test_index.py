@@ -0,0 +1,59 @@
+import os
+import shutil
+
+import numpy as np
+from ormir_mids.converters.megre_siemens import MeGreConverterSiemensMagnitude
+from ormir_mids.utils.OMidsMedVolume import OMidsMedVolume
+from ormir_mids.utils.index import update_index, query, parse_omids_name
+from ormir_mids.utils.io import save_omids, find_omids
+
+
+def _save(path, echo_times, field_strength):
+    volume = OMidsMedVolume(np.zeros((2, 3, len(echo_times)), dtype=np.int16), np.eye(4))
+    volume.omids_header = {'EchoTime': echo_times, 'MagneticFieldStrength': field_strength, 'Manufacturer': 'SIEMENS'}
+    save_omids(str(path), volume)
+
+
+def test_parse_omids_name():
+    assert parse_omids_name('003_sub-anon_ses-1_part-phase_MEGRE.nii.gz') == ('anon', '1', 'part-phase_MEGRE')
+    assert parse_omids_name('sub-01_MESE.nii') == ('01', None, 'MESE')
+    assert parse_omids_name('report.pdf') == (None, None, None)
+
+
+def test_index(tmp_path):
+    """The index finds the same files as a walk of the tree, and follows the changes"""
+    anat_dir = tmp_path / 'sub-01' / 'mr-anat'
+    anat_dir.mkdir(parents=True)
+    _save(anat_dir / 'sub-01_MEGRE.nii.gz', [2.0, 4.0], 3)
+    _save(anat_dir / 'sub-01_part-phase_MEGRE.nii.gz', [2.0, 4.0], 3)
+    _save(anat_dir / 'sub-01_MESE.nii.gz', [10.0], 1.5)
+
+    walk_files = sorted(find_omids(str(tmp_path), 'MEGRE'))
+    walk_converter_files = MeGreConverterSiemensMagnitude.find(str(tmp_path))
+    assert update_index(str(tmp_path)) == (3, 0)
+    assert update_index(str(tmp_path)) == (0, 0)
+    assert find_omids(str(tmp_path), 'MEGRE') == walk_files
+    assert MeGreConverterSiemensMagnitude.find(str(tmp_path)) == walk_converter_files == \
+        [str(anat_dir / 'sub-01_MEGRE.nii.gz')]
+
+    assert query(str(tmp_path), suffix='megre', MagneticFieldStrength=3) == [str(anat_dir / 'sub-01_MEGRE.nii.gz')]
+    assert len(query(str(tmp_path), EchoTime=4, Manufacturer='SIEMENS')) == 2
+    assert len(query(str(tmp_path), MagneticFieldStrength=[1.5, 3])) == 3
+
+    # the files saved with save_omids are indexed as they are written, the deleted files are not returned
+    _save(anat_dir / 'sub-01_MESE.nii.gz', [10.0], 3)
+    os.remove(anat_dir / 'sub-01_part-phase_MEGRE.nii.gz')
+    assert query(str(tmp_path), MagneticFieldStrength=1.5) == []
+    assert len(query(str(tmp_path), subject='01')) == 2
+    new_dir = tmp_path / 'sub-02' / 'mr-anat'
+    new_dir.mkdir(parents=True)
+    _save(new_dir / 'sub-02_MEGRE.nii.gz', [2.0, 4.0], 3)
+    assert find_omids(str(tmp_path), 'MEGRE') == [str(anat_dir / 'sub-01_MEGRE.nii.gz'),
+                                                  str(new_dir / 'sub-02_MEGRE.nii.gz')]
+    assert update_index(str(tmp_path)) == (0, 1)
+
+    # the files added by other tools are found once the index is refreshed
+    shutil.copy(new_dir / 'sub-02_MEGRE.nii.gz', new_dir / 'sub-02_MESE.nii.gz')
+    assert query(str(tmp_path), suffix='MESE') == [str(anat_dir / 'sub-01_MESE.nii.gz')]
+    assert len(query(str(tmp_path), suffix='MESE', refresh=True)) == 2
+    assert update_index(str(tmp_path)) == (0, 0)
@@ -0,0 +1,149 @@
+import gzip
+
+import numpy as np
+from ormir_mids.utils.OMidsMedVolume import OMidsMedVolume
+from ormir_mids.utils.io import AsyncOmidsWriter, DicomPrefetcher, save_omids, load_omids, parallel_gzip_compress, \
+    iter_dicom_with_subfolders, scan_dicom_series, format_prefetch_statistics
+
+
+def _make_volume():
+    volume = OMidsMedVolume(np.arange(24, dtype=np.int16).reshape((2, 3, 4)), np.eye(4))
+    volume.omids_header = {'Modality': 'MR', 'EchoTime': 10.0}
+    volume.patient_header = {'PatientName': 'anon'}
+    volume.extra_header = {'00080070': {'vr': 'LO', 'Value': ['SIEMENS']}}
+    volume.meta_header = {}
+    return volume
+
+
+def test_async_writer(tmp_path):
+    """The background writer produces the same files as save_omids and reports the errors"""
+    volume = _make_volume()
+    save_omids(str(tmp_path / 'sync.nii.gz'), volume)
+
+    with AsyncOmidsWriter(num_threads=2) as writer:
+        writer.save_omids(str(tmp_path / 'async.nii.gz'), volume)
+        # the headers are serialized when the volume is queued
+        volume.omids_header['EchoTime'] = 20.0
+        writer.save_omids(str(tmp_path / 'sync.json' / 'failed.nii.gz'), volume)
+
+    assert len(writer.errors) == 1
+    assert writer.errors[0][0].endswith('failed.nii.gz')
+
+    for suffix in ['.json', '_patient.json', '_extra.json']:
+        with open(tmp_path / ('sync' + suffix)) as f_sync, open(tmp_path / ('async' + suffix)) as f_async:
+            assert f_sync.read() == f_async.read()
+
+    loaded_volume = load_omids(str(tmp_path / 'async.nii.gz'))
+    assert np.array_equal(loaded_volume.volume, np.arange(24).reshape((2, 3, 4)))
+    assert loaded_volume.omids_header['EchoTime'] == 10.0
+
+    # the last volume saved to a path is the one on disk
+    with AsyncOmidsWriter(num_threads=4) as writer:
+        for echo_time in range(20):
+            volume.omids_header['EchoTime'] = float(echo_time)
+            writer.save_omids(str(tmp_path / 'overwritten.nii.gz'), volume)
+    assert load_omids(str(tmp_path / 'overwritten.nii.gz')).omids_header['EchoTime'] == 19.0
+    # the finished writes are forgotten
+    assert writer._pending_files == {}
+
+
+def test_compression_modes(tmp_path):
+    """All the compression modes save the same image, and the parallel gzip stream is standard"""
+    volume = _make_volume()
+    save_omids(str(tmp_path / 'plain.nii'), volume, compression='none')
+    save_omids(str(tmp_path / 'level9.nii.gz'), volume, compression='gzip', compression_level=9)
+    save_omids(str(tmp_path / 'parallel.nii.gz'), volume, compression='parallel', compression_threads=2)
+    for file_name in ['plain.nii', 'level9.nii.gz', 'parallel.nii.gz']:
+        assert np.array_equal(load_omids(str(tmp_path / file_name)).volume, volume.volume)
+
+    data = np.random.default_rng(0).integers(0, 10, 100000, dtype=np.uint8).tobytes()
+    compressed = b''.join(parallel_gzip_compress(data, 6, num_threads=3, block_size=7000))
+    assert gzip.decompress(compressed) == data
+
+
+def test_lazy_and_mmap_loading(tmp_path):
+    """Lazy volumes are only read when needed, and mmap gives the file data type without copy"""
+    volume = OMidsMedVolume(np.arange(360, dtype=np.int16).reshape((4, 5, 6, 3)), np.diag([0.5, 0.5, 2, 1]))
+    save_omids(str(tmp_path / 'volume.nii.gz'), volume)
+    save_omids(str(tmp_path / 'volume.nii'), volume)
+    eager_volume = load_omids(str(tmp_path / 'volume.nii.gz'))
+
+    lazy_volume = load_omids(str(tmp_path / 'volume.nii.gz'), lazy=True)
+    assert lazy_volume.shape == (4, 5, 6, 3) and lazy_volume.dtype == eager_volume.dtype
+    echo = lazy_volume[..., 1]
+    assert not lazy_volume.is_loaded
+    assert np.array_equal(echo.volume, eager_volume[..., 1].volume)
+    assert np.allclose(echo.affine, eager_volume.affine)
+    assert np.array_equal(lazy_volume.volume, eager_volume.volume)
+    assert lazy_volume.is_loaded
+
+    mapped_volume = load_omids(str(tmp_path / 'volume.nii'), mmap=True)
+    assert mapped_volume.is_mmap and mapped_volume.dtype == np.int16
+    assert np.array_equal(mapped_volume[..., 2].volume, volume.volume[..., 2])
+
+
+def test_lazy_sidecars(tmp_path):
+    """The patient and extra sidecars are only parsed when their header is used"""
+    save_omids(str(tmp_path / 'volume.nii.gz'), _make_volume())
+    loaded_volume = load_omids(str(tmp_path / 'volume.nii.gz'))
+    assert loaded_volume.omids_header['Modality'] == 'MR'
+    assert loaded_volume.get_header_loader('extra_header') is not None
+
+    sliced_volume = loaded_volume[:, :, :2]
+    assert sliced_volume.get_header_loader('extra_header') is not None
+
+    assert loaded_volume.extra_header['00080070']['Value'] == ['SIEMENS']
+    assert loaded_volume.get_header_loader('extra_header') is None
+    assert loaded_volume.patient_header == {'PatientName': 'anon'}
+    assert sliced_volume.extra_header == loaded_volume.extra_header
+
+    # saving the loaded volume gives the same files
+    save_omids(str(tmp_path / 'copy.nii.gz'), loaded_volume)
+    for suffix in ['.json', '_patient.json', '_extra.json']:
+        with open(tmp_path / ('volume' + suffix)) as f_original, open(tmp_path / ('copy' + suffix)) as f_copy:
+            assert f_original.read() == f_copy.read()
+
+
+def test_dicom_prefetcher(tmp_path):
+    """The series are read ahead in order within the limits, and the read errors are given to the caller"""
+    file_groups = []
+    for series_index in range(5):
+        file_list = []
+        for file_index in range(3):
+            file_path = tmp_path / f'{series_index}_{file_index}.dcm'
+            file_path.write_bytes(bytes([series_index, file_index]) * 100)
+            file_list.append(str(file_path))
+        file_groups.append((series_index, file_list))
+    file_groups.insert(2, ('missing', [str(tmp_path / 'missing.dcm')]))
+
+    for max_series, max_bytes in [(2, None), (None, 700), (1, 1)]:
+        with DicomPrefetcher(iter(file_groups), max_series, max_bytes, io_threads=2) as prefetcher:
+            results = list(prefetcher)
+        assert [key for key, _ in results] == [key for key, _ in file_groups]
+        assert isinstance(results[2][1], FileNotFoundError)
+        assert results[4][1][2].read() == bytes([3, 2]) * 100
+        statistics = prefetcher.statistics
+        assert statistics['series'] == 6 and statistics['files'] == 15 and statistics['bytes'] == 3000
+        assert statistics['hits'] + statistics['stalls'] + statistics['misses'] == 6
+        assert 'Prefetch: 6 series' in prefetcher.format_statistics()
+
+    # stopping early does not block
+    with DicomPrefetcher(iter(file_groups), max_series=1) as prefetcher:
+        assert next(prefetcher)[0] == 0
+
+
+def test_load_statistics(tmp_path, capsys):
+    """The statistics of the walk and of the prefetcher are collected in the given dictionary, not printed"""
+    for folder in ['a', 'b']:
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / 'report.pdf').write_bytes(b'%PDF-1.4' + bytes(200))
+    statistics = {}
+    assert list(iter_dicom_with_subfolders(str(tmp_path), prefetch=2, statistics=statistics)) == []
+    assert statistics['folders'] == 3 and statistics['skipped_files'] == 2 and statistics['series'] == 3
+    assert 'Prefetch: 3 series' in format_prefetch_statistics(statistics)
+
+    statistics = {}
+    assert scan_dicom_series(str(tmp_path), statistics=statistics) == {}
+    assert statistics['folders'] == 3 and 'series' not in statistics
+    output = capsys.readouterr().out
+    assert 'Listed' not in output and 'Prefetch' not in output
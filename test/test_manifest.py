@@ -0,0 +1,51 @@
+import os
+from ormir_mids.utils.manifest import load_manifest, save_manifest, fingerprint_files, make_manifest_entry, \
+    is_up_to_date
+
+
+def test_manifest_roundtrip(tmp_path):
+    """A saved manifest is loaded back unchanged, a missing one is empty"""
+    assert load_manifest(str(tmp_path)) == {}
+    manifest = {'1.2.3': make_manifest_entry('abc', '1.0', [('MESE', 'sub-anon/mr-anat/sub-anon_MESE.nii.gz')])}
+    save_manifest(str(tmp_path), manifest)
+    assert load_manifest(str(tmp_path)) == manifest
+
+
+def test_up_to_date(tmp_path):
+    """A series is up to date only if the sources, the version and the outputs did not change"""
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    source_file = input_dir / 'slice1'
+    source_file.write_bytes(b'1234')
+    output_dir = tmp_path / 'output'
+    output_dir.mkdir()
+    (output_dir / 'out.nii.gz').write_bytes(b'')
+
+    fingerprint = fingerprint_files([str(source_file)], str(input_dir))
+    entry = make_manifest_entry(fingerprint, '1.0', [('MESE', 'out.nii.gz')])
+    assert is_up_to_date(entry, fingerprint, '1.0', str(output_dir))
+    assert not is_up_to_date(None, fingerprint, '1.0', str(output_dir))
+    assert not is_up_to_date(entry, fingerprint, '1.1', str(output_dir))
+
+    source_file.write_bytes(b'12345')
+    assert not is_up_to_date(entry, fingerprint_files([str(source_file)], str(input_dir)), '1.0', str(output_dir))
+
+    os.remove(output_dir / 'out.nii.gz')
+    assert not is_up_to_date(entry, fingerprint, '1.0', str(output_dir))
+
+
+def test_failed_conversion(tmp_path):
+    """A series whose conversion failed, even partly, or that produced no output is never up to date"""
+    (tmp_path / 'magnitude.nii.gz').write_bytes(b'')
+    failed_entry = make_manifest_entry('abc', '1.0', [('MESE', 'magnitude.nii.gz'), ('MESE', None)])
+    assert failed_entry['status'] == 'failed'
+    assert failed_entry['outputs'] == ['magnitude.nii.gz']
+    assert not is_up_to_date(failed_entry, 'abc', '1.0', str(tmp_path))
+
+    empty_entry = make_manifest_entry('abc', '1.0', [])
+    assert empty_entry['status'] == 'converted'
+    assert not is_up_to_date(empty_entry, 'abc', '1.0', str(tmp_path))
+
+    entry = make_manifest_entry('abc', '1.0', [('MESE', 'magnitude.nii.gz')])
+    assert entry['status'] == 'converted'
+    assert is_up_to_date(entry, 'abc', '1.0', str(tmp_path))
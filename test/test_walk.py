@@ -0,0 +1,85 @@
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian
+from ormir_mids.utils.walk import walk_dicom_folders, is_dicom_file, format_walk_statistics
+
+
+def _write_dicomdir(file_path, file_ids):
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = '1.2.840.10008.1.3.10'
+    ds.file_meta.MediaStorageSOPInstanceUID = '1.2.3'
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    records = []
+    for file_id in file_ids:
+        record = Dataset()
+        record.DirectoryRecordType = 'IMAGE'
+        record.ReferencedFileID = file_id
+        records.append(record)
+    ds.DirectoryRecordSequence = Sequence(records)
+    pydicom.dcmwrite(file_path, ds, enforce_file_format=True)
+
+
+def test_walk_dicom_folders(tmp_path):
+    """Only the files with a DICOM preamble or referenced by a DICOMDIR are listed, in the order of a recursive walk"""
+    dicom_bytes = bytes(128) + b'DICM' + bytes(100)
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'c' / 'IMAGES').mkdir(parents=True)
+    for index in [10, 2, 1]:
+        (tmp_path / 'a' / f'IM{index}').write_bytes(dicom_bytes)
+    (tmp_path / 'a' / 'report.pdf').write_bytes(b'%PDF-1.4' + bytes(200))
+    (tmp_path / 'a' / '.DS_Store').write_bytes(dicom_bytes)
+    (tmp_path / 'a' / 'b' / 'raw').write_bytes(b'\x08\x00\x05\x00' + bytes(20))
+    (tmp_path / 'a' / 'b' / 'short').write_bytes(b'\x08\x00')
+    # the files referenced by the DICOMDIR are not opened
+    (tmp_path / 'c' / 'IMAGES' / 'IM0').write_bytes(b'not checked')
+    (tmp_path / 'c' / 'IMAGES' / 'IM1').write_bytes(b'not a dicom')
+    _write_dicomdir(str(tmp_path / 'c' / 'DICOMDIR'), [['IMAGES', 'IM0']])
+
+    assert is_dicom_file(str(tmp_path / 'a' / 'IM1'))
+    assert not is_dicom_file(str(tmp_path / 'a' / 'report.pdf'))
+    assert not is_dicom_file(str(tmp_path / 'missing'))
+
+    expected_folders = {
+        str(tmp_path): [],
+        str(tmp_path / 'a'): [str(tmp_path / 'a' / name) for name in ['IM1', 'IM2', 'IM10']],
+        str(tmp_path / 'a' / 'b'): [str(tmp_path / 'a' / 'b' / 'raw')],
+        str(tmp_path / 'c'): [],
+        str(tmp_path / 'c' / 'IMAGES'): [str(tmp_path / 'c' / 'IMAGES' / 'IM0')],
+    }
+    for io_threads in [1, 4]:
+        statistics = {}
+        folders = list(walk_dicom_folders(str(tmp_path), io_threads=io_threads, statistics=statistics))
+        assert dict(folders) == expected_folders
+        # each folder is followed by its subfolders
+        folder_names = [folder for folder, _ in folders]
+        assert folder_names[0] == str(tmp_path)
+        assert folder_names.index(str(tmp_path / 'a' / 'b')) == folder_names.index(str(tmp_path / 'a')) + 1
+        assert statistics == {'folders': 5, 'dicom_files': 5, 'skipped_files': 3, 'hidden_files': 1,
+                              'dicomdirs': 1}
+        assert '3 other files skipped' in format_walk_statistics(statistics)
+
+    assert [folder for folder, _ in walk_dicom_folders(str(tmp_path), recursive=False)] == [str(tmp_path)]
+
+
+def test_is_dicom_file_without_preamble(tmp_path):
+    """The files without preamble are only accepted if they start with a plausible group 0002 or 0008 element"""
+    files = {
+        # (0008,0016) UI, explicit VR
+        'explicit': (b'\x08\x00\x16\x00UI\x1a\x00' + bytes(26), True),
+        # (0008,0005) with an implicit length of 10
+        'implicit': (b'\x08\x00\x05\x00\x0a\x00\x00\x00' + bytes(10), True),
+        # implicit length larger than the file
+        'long': (b'\x08\x00\x05\x00\x00\x01\x00\x00' + bytes(10), False),
+        # odd implicit length
+        'odd': (b'\x08\x00\x05\x00\x03\x00\x00\x00' + bytes(10), False),
+        # element number that cannot come first
+        'element': (b'\x08\x00\xff\xffUI\x1a\x00' + bytes(26), False),
+        # text starting with a backspace
+        'text': (b'\x08\x00 hello world', False),
+        'group': (b'\x10\x00\x10\x00PN\x04\x00' + bytes(4), False),
+    }
+    for name, (content, expected) in files.items():
+        (tmp_path / name).write_bytes(content)
+        assert is_dicom_file(str(tmp_path / name)) == expected, name